@@ -1,15 +1,22 @@
-import io, requests
+import os, time, logging, multiprocessing
 from pathlib import Path
 from decouple import config
-from urllib.parse import urlsplit
-from utils import get_db_record, update_db_record, s3_uploader
-from threading import Thread
-from auto_tagging.tagging import auto_tagging
+from utils import get_db_record, update_db_record, get_s3_uploader
 from flask import Flask, request
 
+# measure import cost of the tagging pipeline, reported in /api/ready
+import_start = time.perf_counter()
+from auto_tagging.tagging import auto_tagging, warm_up
+from auto_tagging.jobs import JobQueue, QueueFull
+from auto_tagging.download import get_downloader
+
+import_seconds = time.perf_counter() - import_start
+
 
 app = Flask(__name__)
 
+warm_up_status = {"import_seconds": round(import_seconds, 3)}
+
 storage_dir = "data"
 base_dir = Path().absolute()
 # create data directory if not exits
@@ -17,42 +24,42 @@ Path(f"{base_dir}/{storage_dir}").mkdir(parents=True, exist_ok=True)
 storage_dir = Path(storage_dir).absolute()
 
 
-def auto_tagging_thread(file_id: int, url: str, htm_type: str):
+def auto_tagging_job(file_id: int, file_url: str, html_type: str):
+    """runs in a job queue worker process, raises if filing is not tagged"""
     try:
         record = get_db_record(file_id=file_id)
         html = record.get("url", "")
     except:
-        html = url
+        html = file_url
     output_dir = f"{storage_dir}/html/{Path(html).stem}".replace("_", "-")
     # create viewer folder
     Path(f"{output_dir}").mkdir(parents=True, exist_ok=True)
     filename = f"{output_dir}/{Path(html).stem}_1.html"
-    # Send an HTTP GET request to the URL
-    response = requests.get(html)
-
-    # Check if the request was successful (status code 200)
-    if response.status_code == 200:
-        # Get the content from the response
-        html_content = response.text
-
-        # Write the content to a local file
-        with open(filename, "w") as file:
-            file.write(html_content)
-
-        output_html = auto_tagging(filename, htm_type)
-        try:
-            with open(output_html, "rb") as file:
-                body = io.BytesIO(file.read())
-                # Parse the URL to extract the path
-                parsed_url = urlsplit(output_html)
-                # Get the filename from the path using pathlib
-                path = Path(parsed_url.path)
-                filename = path.name
-                url = s3_uploader(name=filename, body=body)
-                update_db_record(file_id, {"url": url, "inAutoTaggingProcess": False})
-        except Exception as e:
-            return {"error": "auto_tagging_html file is not generated"}, 400
-    return {"error": "html file is not found"}, 400
+    # streamed to a local file, unchanged filings are read from cache
+    source_sha256 = get_downloader().download(html, filename)
+
+    # a filing tagged before is read from result cache, straight to upload
+    output_html = auto_tagging(filename, html_type, source_sha256)
+    # streamed from disk, uploaded with the output file name
+    url = get_s3_uploader().upload_file(output_html)
+    update_db_record(file_id, {"url": url, "inAutoTaggingProcess": False})
+
+
+def auto_tagging_job_failed(file_id: int, file_url: str, html_type: str):
+    """job failed for good, file is no longer in auto tagging process"""
+    update_db_record(file_id, {"inAutoTaggingProcess": False})
+
+
+def warm_up_worker():
+    """loads models in each worker process before its first job"""
+    start = time.perf_counter()
+    models = warm_up()
+    logging.info(f"Worker warmed up in {time.perf_counter() - start:.3f}s: {models}")
+
+
+# pipelines run in a fixed pool of worker processes, JOBS in config.yaml
+job_queue = JobQueue.from_config(handler=auto_tagging_job, initializer=warm_up_worker,
+                                 on_failure=auto_tagging_job_failed)
 
 
 @app.route("/")
@@ -60,15 +67,44 @@ def index():
     return {"message": "welcome to auto-tagging"}
 
 
+@app.route("/api/ready")
+def ready_view():
+    """readiness probe, 200 only after a worker loaded all models"""
+    stats = job_queue.stats()
+    if stats["workers_ready"]:
+        return {"ready": True, **warm_up_status, **stats}, 200
+    return {"ready": False, **warm_up_status, **stats}, 503
+
+
 @app.route("/api/auto-tagging", methods=["POST"])
 def auto_tagging_view():
     file_id = request.json.get("file_id", None)
     file_url = request.json.get("file_url", None)
     html_type = request.json.get("html_type", None)
-    # run process in background
-    thread = Thread(target=auto_tagging_thread, args=(file_id, file_url, html_type))
-    thread.start()
-    return {"message": "We will notify you once auto tagging is done."}, 200
+    # run process in background, by a job queue worker
+    try:
+        job_id = job_queue.submit(file_id=file_id, file_url=file_url, html_type=html_type)
+    except QueueFull as e:
+        return {"error": str(e), "retry_after": e.retry_after}, 429, {"Retry-After": str(e.retry_after)}
+    return {"message": "We will notify you once auto tagging is done.", "job_id": job_id}, 200
+
+
+@app.route("/api/auto-tagging/<job_id>")
+def auto_tagging_status_view(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "job is not found"}, 404
+    fields = ["status", "attempts", "error", "created_at", "updated_at"]
+    return {"job_id": job_id, **{field: job[field] for field in fields}}, 200
+
+
+# workers load models in background, so the server starts listening immediately.
+# debug reloader's parent process only watches files & worker processes
+# import this module too, no workers there.
+if multiprocessing.parent_process() is None and (
+    __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+):
+    job_queue.start()
 
 
 if __name__ == "__main__":
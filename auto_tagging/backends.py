@@ -0,0 +1,210 @@
+"""
+Title:
+    Inference Backends
+
+Description:
+    Runs the DEI, Notes and Table models either with eager pytorch or with
+    ONNX Runtime on CPU. Backend is chosen with INFERENCE.Backend in config.yaml.
+
+Takeaways:
+    - Every backend takes input_ids & attention_mask and returns logits as numpy.
+    - ONNX files are exported once from the pytorch models in to
+      INFERENCE.Onnx_Dir and exported again if the model checkpoint is newer.
+    - onnxruntime is imported only when the onnx backend is selected.
+    - Worker processes export/quantize under a file lock, files are written
+      to a temp file & renamed, so no process loads a half written model.
+    - INFERENCE.Quantize runs int8 copies of the models, see quantization.py
+"""
+
+import os
+import json
+import fcntl
+import torch
+import inspect
+import logging
+import tempfile
+import numpy as np
+
+from contextlib import contextmanager
+from typing import Dict
+from .utils import System, get_config
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx")
+
+
+class TorchBackend:
+    """eager pytorch model on the compute device"""
+
+    # set by registry, identifies model & checkpoint in prediction cache
+    model_id = None
+
+    def __init__(self, model, device=None) -> None:
+        self.model = model
+        # int8 quantized models only run on cpu
+        self.device = device or System().get_device_to_compute()
+        self.id2label: Dict[int, str] = model.config.id2label
+
+    def logits(self, input_ids, attention_mask) -> np.ndarray:
+        with torch.no_grad():
+            logits = self.model(input_ids=torch.as_tensor(input_ids).to(self.device),
+                                attention_mask=torch.as_tensor(attention_mask).to(self.device),
+                                ).logits
+        return logits.cpu().numpy()
+
+
+class OnnxBackend:
+    """exported model running with ONNX Runtime on CPU"""
+
+    model_id = None
+
+    def __init__(self, onnx_path: str, id2label: Dict[int, str]) -> None:
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path,
+                                            sess_options=session_options,
+                                            providers=["CPUExecutionProvider"],
+                                            )
+        self.id2label = id2label
+
+    def logits(self, input_ids, attention_mask) -> np.ndarray:
+        inputs = {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        }
+        return self.session.run(["logits"], inputs)[0]
+
+
+def get_backend_name() -> str:
+    backend = get_config()["INFERENCE"].get("Backend", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"INFERENCE.Backend should be one of {BACKENDS}, got '{backend}'")
+    return backend
+
+
+def get_source_mtime(model_path: str) -> float:
+    """latest modified time of checkpoint file or of files in model folder"""
+    if os.path.isdir(model_path):
+        return max(
+            [os.path.getmtime(os.path.join(path, file))
+             for path, _, files in os.walk(model_path) for file in files],
+            default=0.0,
+        )
+    return os.path.getmtime(model_path)
+
+
+@contextmanager
+def file_lock(path: str):
+    """exclusive lock across processes on `path`.lock, held inside the block"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+@contextmanager
+def write_atomically(path: str):
+    """yields a temp path in same folder, renamed to `path` once the block
+    is done, removed if it fails. readers see old file or whole new file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix="tmp", suffix=os.path.splitext(path)[1], dir=directory)
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_to_onnx(model, onnx_path: str, token_level: bool = True):
+    """exports huggingface classifier to onnx with dynamic batch & sequence
+    length, id2label is saved next to it as json for loading without torch.
+    labels are written first, so a complete onnx file always has its labels"""
+    model = model.to("cpu").eval()
+    with write_atomically(onnx_path.replace(".onnx", ".labels.json")) as labels_path:
+        with open(labels_path, "w") as fp:
+            json.dump({"id2label": model.config.id2label}, fp)
+
+    dummy_input_ids = torch.ones((2, 8), dtype=torch.long)
+    dummy_attention_mask = torch.ones((2, 8), dtype=torch.long)
+    logits_axes = {0: "batch", 1: "sequence"} if token_level else {0: "batch"}
+
+    export_kwargs = {}
+    # newer torch defaults to dynamo exporter, this model exports with torchscript
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False
+
+    with torch.no_grad(), write_atomically(onnx_path) as tmp_path:
+        torch.onnx.export(
+            model,
+            (dummy_input_ids, dummy_attention_mask),
+            tmp_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": logits_axes,
+            },
+            opset_version=14,
+            **export_kwargs,
+        )
+    logger.info(f"Exported model to {onnx_path}")
+
+
+def quantize_onnx(onnx_path: str, int8_path: str):
+    """int8 dynamic quantization of onnx model weights"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    with write_atomically(int8_path) as tmp_path:
+        quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QInt8)
+    logger.info(f"Quantized {onnx_path} to {int8_path}")
+
+
+def load_onnx_backend(name: str, model_path: str, load_torch_model,
+                      token_level: bool = True, quantize: bool = False):
+    """loads onnx file of the model, exports it first if missing or
+    older than the checkpoint at `model_path`. with `quantize`, runs
+    the int8 copy of the exported model."""
+    onnx_dir = get_config()["INFERENCE"]["Onnx_Dir"]
+    onnx_path = os.path.join(onnx_dir, f"{name}.onnx")
+    labels_path = onnx_path.replace(".onnx", ".labels.json")
+
+    def onnx_is_stale():
+        return (
+            not os.path.exists(onnx_path)
+            or not os.path.exists(labels_path)
+            or os.path.getmtime(onnx_path) < get_source_mtime(model_path)
+        )
+
+    if onnx_is_stale():
+        with file_lock(onnx_path):
+            # another worker may have exported it while this one waited
+            if onnx_is_stale():
+                logger.info(f"Exporting {name} to onnx......")
+                export_to_onnx(load_torch_model(), onnx_path, token_level=token_level)
+
+    if quantize:
+        int8_path = onnx_path.replace(".onnx", ".int8.onnx")
+
+        def int8_is_stale():
+            return not os.path.exists(int8_path) or os.path.getmtime(int8_path) < os.path.getmtime(onnx_path)
+
+        if int8_is_stale():
+            with file_lock(int8_path):
+                if int8_is_stale():
+                    quantize_onnx(onnx_path, int8_path)
+        onnx_path = int8_path
+
+    with open(labels_path, "r") as fp:
+        id2label = {int(index): label for index, label in json.load(fp)["id2label"].items()}
+    return OnnxBackend(onnx_path, id2label)
@@ -0,0 +1,331 @@
+"""
+Title:
+    Caches
+
+Description:
+    In-memory LRU and size bounded on-disk caches, the prediction cache
+    that memoizes model outputs by (model id, model input text), and the
+    result cache of whole tagged filings.
+
+Takeaways:
+    - Filings repeat a lot of boilerplate, cover rows, notes sentences and
+      statement line items are predicted only once per model.
+    - Model id has a fingerprint of the checkpoint files, so a new
+      checkpoint never reads predictions of the old one.
+    - Disk tier is shared by all worker processes, files are written to a
+      temp file and renamed, oldest used files are evicted above the size limit.
+      Total size is kept in a file under a file lock, so writes of every
+      process count towards the limit.
+    - A re-submitted filing with same html, html type & models is read from
+      result cache, no parsing or model runs.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from .utils import get_config
+from .backends import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """thread safe in-memory cache, drops least recently used above `max_items`
+    items or above `max_bytes` total of the sizes given to `put`(0 is no limit)"""
+
+    def __init__(self, max_items: int = 0, max_bytes: int = 0) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items: OrderedDict = OrderedDict()
+        self._sizes: Dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value, size: int = 0):
+        with self._lock:
+            self.total_bytes += size - self._sizes.get(key, 0)
+            self._items[key] = value
+            self._sizes[key] = size
+            self._items.move_to_end(key)
+            while self._items and ((self.max_items and len(self._items) > self.max_items)
+                                   or (self.max_bytes and self.total_bytes > self.max_bytes)):
+                old_key, _ = self._items.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(old_key)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCache:
+    """Files in `directory` named by key hash, total size kept under
+    `max_bytes` by deleting least recently used files. reading a file
+    updates its modified time, which is used as last access time.
+    total size of all processes is in the `size` file of `directory`."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size_path = os.path.join(directory, "size")
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(self._size_path):
+            self._write_size(sum(os.path.getsize(path) for path in self._entries()))
+
+    def _entries(self):
+        for path, _, files in os.walk(self.directory):
+            # size file & its lock are in top folder, cached files in sub folders
+            if path == self.directory:
+                continue
+            for file in files:
+                if not file.startswith("tmp"):
+                    yield os.path.join(path, file)
+
+    def _read_size(self) -> int:
+        try:
+            with open(self._size_path, "r") as fp:
+                return int(fp.read())
+        except (OSError, ValueError):
+            # missing or half written, counted again from the files
+            return sum(os.path.getsize(path) for path in self._entries())
+
+    def _write_size(self, size: int):
+        with open(self._size_path, "w") as fp:
+            fp.write(str(size))
+
+    def path_for(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def get_file(self, key: str, dest_path: str) -> bool:
+        """copies file of key to `dest_path`, False if not in cache"""
+        path = self.path_for(key)
+        try:
+            shutil.copyfile(path, dest_path)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_bytes(self, key: str, data: bytes):
+        self._put(key, lambda fp: fp.write(data))
+
+    def put_file(self, key: str, source_path: str):
+        """copy of file at `source_path` for key, never read in to memory"""
+        def copy(fp):
+            with open(source_path, "rb") as source:
+                shutil.copyfileobj(source, fp, 1024 * 1024)
+        self._put(key, copy)
+
+    def _put(self, key: str, write):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to temp file & rename, so readers never see half written files
+        fd, tmp_path = tempfile.mkstemp(prefix="tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                write(fp)
+            size = os.path.getsize(tmp_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        with file_lock(self._size_path):
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            total_size = self._read_size() + size - old_size
+            if total_size > self.max_bytes:
+                total_size = self._evict()
+            self._write_size(total_size)
+
+    def _evict(self) -> int:
+        """deletes least recently used files until under max_bytes,
+        returns total size of files left"""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+        logger.info(f"Disk cache {self.directory} evicted to {total_size} bytes")
+        return total_size
+
+
+class PredictionCache:
+    """Memoizes model outputs by model id & input text,
+    memory LRU first, then the optional disk tier.
+    outputs must be json types, tuples are read back from disk as lists.
+    memory tier is bounded by json size of key & output, python objects
+    take about 2-3 times of it."""
+
+    def __init__(self, memory_bytes: int, disk_dir: str = None, disk_max_bytes: int = 0) -> None:
+        self.memory = LRUCache(max_bytes=memory_bytes)
+        self.disk = DiskCache(disk_dir, disk_max_bytes) if disk_dir else None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    @staticmethod
+    def make_key(model_id: str, text: str) -> str:
+        return f"{model_id}\x00{text}"
+
+    def get(self, model_id: str, text: str) -> Optional[Any]:
+        key = self.make_key(model_id, text)
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        if self.disk is not None:
+            data = self.disk.get_bytes(key)
+            if data is not None:
+                try:
+                    value = json.loads(data)
+                except ValueError:
+                    # written by an older version, predicted again & replaced
+                    value = None
+                if value is not None:
+                    self.memory.put(key, value, len(key) + len(data))
+                    self._count("disk_hits")
+                    return value
+
+        self._count("misses")
+        return None
+
+    def put(self, model_id: str, text: str, value: Any):
+        key = self.make_key(model_id, text)
+        data = json.dumps(value).encode("utf-8")
+        self.memory.put(key, value, len(key) + len(data))
+        if self.disk is not None:
+            self.disk.put_bytes(key, data)
+
+    def stats(self) -> Dict:
+        stats = dict(self.counters)
+        lookups = sum(stats.values())
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        stats["memory_items"] = len(self.memory)
+        stats["memory_bytes"] = self.memory.total_bytes
+        return stats
+
+
+class ResultCache:
+    """tagged html file & tag lists(as json) of whole filings, keyed by source
+    html hash, html type & model ids. least recently used filings are evicted
+    above max_bytes by DiskCache."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.disk = DiskCache(directory, max_bytes)
+
+    @staticmethod
+    def make_key(source_sha256: str, html_type: str, model_ids: List[str]) -> str:
+        return "\x00".join([source_sha256, str(html_type), *model_ids])
+
+    def get(self, key: str, dest_path: str) -> Optional[Dict]:
+        """copies tagged html to `dest_path` & returns its tags, None if not in cache"""
+        data = self.disk.get_bytes(f"tags\x00{key}")
+        if data is None or not self.disk.get_file(f"html\x00{key}", dest_path):
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            # written by an older version, tagged again & replaced
+            return None
+
+    def put(self, key: str, html_path: str, tags: Dict):
+        # tags last, a filing is a hit only once both are saved
+        self.disk.put_file(f"html\x00{key}", html_path)
+        self.disk.put_bytes(f"tags\x00{key}", json.dumps(tags).encode("utf-8"))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_result_cache() -> Optional[ResultCache]:
+    """process wide result cache from RESULT_CACHE in config.yaml, None if disabled"""
+    cache_config = get_config().get("RESULT_CACHE", {})
+    if not cache_config.get("Dir"):
+        return None
+    return ResultCache(cache_config["Dir"], int(cache_config["Max_MB"] * 1024 * 1024))
+
+
+@lru_cache(maxsize=None)
+def get_prediction_cache() -> Optional[PredictionCache]:
+    """process wide prediction cache from PREDICTION_CACHE in config.yaml,
+    None if disabled"""
+    cache_config = get_config().get("PREDICTION_CACHE", {})
+    if not cache_config.get("Enabled", False):
+        return None
+    return PredictionCache(
+        memory_bytes=int(cache_config["Memory_MB"] * 1024 * 1024),
+        disk_dir=cache_config.get("Disk_Dir") or None,
+        disk_max_bytes=int(cache_config.get("Disk_Max_MB", 0) * 1024 * 1024),
+    )
+
+
+def cached_predict(model_id: Optional[str], texts, predict) -> list:
+    """returns predict(texts) using the prediction cache. only texts not in
+    cache are passed to `predict`, each unique text only once. `predict`
+    takes a list of texts and returns one output per text in same order."""
+    cache = get_prediction_cache()
+    if cache is None or not model_id:
+        return predict(texts)
+
+    results = [None] * len(texts)
+    missing: Dict[str, list] = {}
+    for index, text in enumerate(texts):
+        value = cache.get(model_id, text) if text not in missing else None
+        if value is None:
+            missing.setdefault(text, []).append(index)
+        else:
+            results[index] = value
+
+    if missing:
+        missing_texts = list(missing)
+        for text, value in zip(missing_texts, predict(missing_texts)):
+            cache.put(model_id, text, value)
+            for index in missing[text]:
+                results[index] = value
+    return results
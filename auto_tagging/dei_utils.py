@@ -13,22 +13,15 @@ Author: purnasai@soulpage
 Date: 10-10-2023
 """
 
-import re
-import bs4
-import nltk
 import warnings
 import logging
 
-from nltk import pos_tag
-from nltk.tree import Tree
-from nltk.chunk import conlltags2tree
 from nltk.tokenize import sent_tokenize
 
 from typing import List, Dict
-from bs4 import BeautifulSoup, Comment
-from .utils import FileManager, HtmlContent, ProcessText
+from .utils import ProcessText, decode_bio_spans
+from .document import FilingDocument, Page
 
-nltk.download('punkt')
 warnings.filterwarnings("ignore")
 logger = logging.getLogger(__name__)
 
@@ -54,7 +47,7 @@ def collect_tokens(divs:list) -> list:
             for sentence in sentences:
                 # so clean it
                 sentence_tokens = sentence.split(" ")
-                sentence_tokens = [processtext.clean_text(token) for token in sentence_tokens if len(processtext.clean_text(token)) >= 1]
+                sentence_tokens = [token for token in map(processtext.clean_text, sentence_tokens) if token]
                 ip_text.append(sentence_tokens)
 
             inputs.extend(ip_text)
@@ -79,7 +72,7 @@ def collect_tokens(divs:list) -> list:
                     for sentence in sentences:
                         # so clean it
                         sentence_tokens = sentence.split(" ")
-                        sentence_tokens = [processtext.clean_text(token) for token in sentence_tokens if len(processtext.clean_text(token)) >= 1]
+                        sentence_tokens = [token for token in map(processtext.clean_text, sentence_tokens) if token]
                         ip_text.append(sentence_tokens)
         
                     inputs.extend(ip_text)
@@ -97,7 +90,7 @@ def collect_tokens(divs:list) -> list:
                 for sentence in sentences:
                     # so clean it
                     sentence_tokens = sentence.split(" ")
-                    sentence_tokens = [processtext.clean_text(token) for token in sentence_tokens if len(processtext.clean_text(token)) >= 1]
+                    sentence_tokens = [token for token in map(processtext.clean_text, sentence_tokens) if token]
                     ip_text.append(sentence_tokens)
                 inputs.extend(ip_text)
         
@@ -114,7 +107,7 @@ def collect_tokens(divs:list) -> list:
                 for sentence in sentences:
                     # so clean it
                     sentence_tokens = sentence.split(" ")
-                    sentence_tokens = [processtext.clean_text(token) for token in sentence_tokens if len(processtext.clean_text(token)) >= 1]
+                    sentence_tokens = [token for token in map(processtext.clean_text, sentence_tokens) if token]
                     ip_text.append(sentence_tokens)
                 inputs.extend(ip_text)
             
@@ -135,7 +128,7 @@ def collect_tokens(divs:list) -> list:
                         for sentence in sentences:
                             # so clean it
                             sentence_tokens = sentence.split(" ")
-                            sentence_tokens = [processtext.clean_text(token) for token in sentence_tokens if len(processtext.clean_text(token)) >= 1]
+                            sentence_tokens = [token for token in map(processtext.clean_text, sentence_tokens) if token]
                             ip_text.append(sentence_tokens)
                         inputs.extend(ip_text)
 
@@ -149,13 +142,13 @@ def collect_tokens(divs:list) -> list:
             for sentence in sentences:
                 # so clean it
                 sentence_tokens = sentence.split(" ")
-                sentence_tokens = [processtext.clean_text(token) for token in sentence_tokens if len(processtext.clean_text(token)) >= 1]
+                sentence_tokens = [token for token in map(processtext.clean_text, sentence_tokens) if token]
                 ip_text.append(sentence_tokens)
             inputs.extend(ip_text)
             # logger.warning("No span/div/table tags found. Text collectiong Failed")
     return inputs
 
-def process_p_tags(page_html_data:bs4.BeautifulSoup) -> list:
+def process_p_tags(page_html_data: Page) -> list:
     ps = page_html_data.find_all("p")
     ps = ps[1:]
     inputs = collect_tokens(ps)
@@ -166,81 +159,66 @@ def process_p_tags(page_html_data:bs4.BeautifulSoup) -> list:
     total_rows = inputs + inputs1
     return total_rows
 
-def split_page_and_extract_text(html_path) -> list:
-    """Takes html file as input, read the data,
-    checks for comment/header(hr) tag, splits
-    the long html into parts. takes only first page
+def split_page_and_extract_text(document: FilingDocument) -> list:
+    """Takes parsed html filing(or FilingStream) as input, checks for
+    comment/header(hr) page breaks, takes only first page
     & gets the text inside them."""
-    html_data: str = FileManager().read_html_file(html_path)
-    soup = BeautifulSoup(html_data, 'lxml')
+    total_rows = []
+    cover_page = document.cover_page()
 
-    # Find all <!-- Field: Page; Sequence> tags
-    comments: list = soup.find_all(string=lambda text: isinstance(text, Comment) and 'Field: Page;' in text)
-
-    # split html page by comments
-    if comments:
+    # split html page by comments, considering only cover page
+    if document.page_break_type == "comment":
         logger.info("Comments found as page break")
-        for i in range(len(comments[:1])): # considering only cover page
-            start_comment = comments[i]
-            content_between_comments = HtmlContent().extract_until_comments(start_comment)
-            content_between_comments = content_between_comments.encode("utf-8")
-            page_html_data =  BeautifulSoup(content_between_comments, "lxml", from_encoding="utf-8")
+        divs = cover_page.find_all("div")
+        divs = divs[1:] # avoiding first div tag to avoid unncessary text: mmm-20230331.htm
 
-            divs = page_html_data.find_all("div")
-            divs = divs[1:] # avoiding first div tag to avoid unncessary text: mmm-20230331.htm
-            
-            if divs and len(divs) > 10:
-                logger.info("Only div tags found inside, collecting text...")
-                inputs = collect_tokens(divs)
-                total_rows = inputs
-                
-                if total_rows == []:
-                    logger.info("No, all divs empty. found P tags inside, collecting text...")
-                    total_rows = process_p_tags(page_html_data)
+        if divs and len(divs) > 10:
+            logger.info("Only div tags found inside, collecting text...")
+            inputs = collect_tokens(divs)
+            total_rows = inputs
 
-            elif divs and len(divs) < 10:
-                    logger.info("less divs found. So finding P tags, collecting text...")
-                    total_rows = process_p_tags(page_html_data)
+            if total_rows == []:
+                logger.info("No, all divs empty. found P tags inside, collecting text...")
+                total_rows = process_p_tags(cover_page)
 
-            else:
-                logger.info("Only P tags found in Else block, collecting text...")
-                total_rows = process_p_tags(page_html_data)
+        elif divs and len(divs) < 10:
+                logger.info("less divs found. So finding P tags, collecting text...")
+                total_rows = process_p_tags(cover_page)
+
+        else:
+            logger.info("Only P tags found in Else block, collecting text...")
+            total_rows = process_p_tags(cover_page)
 
     # split html by header tags.
-    elif soup.find_all(re.compile('^hr')):
+    elif document.page_break_type == "hr":
         logger.info("Header tag found as page break")
-        page_break_tags = soup.find_all(re.compile('^hr'))
-
-        if len(page_break_tags)>1:
-            for i in range(len(page_break_tags[:1])): # Considering only coverpage
-                start_page_break = page_break_tags[i]
-                content_between_page_breaks = HtmlContent().extract_until_comments(start_page_break)
-                page_html_data =  BeautifulSoup(content_between_page_breaks)
 
-                divs = page_html_data.find_all("div")
-                divs = divs[1:] # avoiding first div tag to avoid unncessary text: mmm-20230331.htm
-                if divs:
-                    inputs = collect_tokens(divs)
-                    total_rows = inputs
+        if document.has_cover_page: # Considering only coverpage
+            divs = cover_page.find_all("div")
+            divs = divs[1:] # avoiding first div tag to avoid unncessary text: mmm-20230331.htm
+            if divs:
+                inputs = collect_tokens(divs)
+                total_rows = inputs
 
-                else:
-                    ps = page_html_data.find_all("p")
-                    ps = ps[1:]
+            else:
+                ps = cover_page.find_all("p")
+                ps = ps[1:]
 
-                    inputs = collect_tokens(ps)
-                    total_rows = inputs
+                inputs = collect_tokens(ps)
+                total_rows = inputs
 
     else:
-        total_rows = []
         logger.warning("No Page break/comment found.")
     return total_rows
 
 
 def remove_unpredicted_rows(total_reconstructed_sentence: list, total_reconstructed_labels: list):
-    """Method to filter out the rows that were all tagged with "O" label"""
+    """Method to filter out the rows that were all tagged with "O" label.
+    also returns index of the row each word came from"""
     new_words = []
     new_labels = []
-    for in_row, out_row in zip(total_reconstructed_sentence, total_reconstructed_labels):
+    word_rows = []
+    for row_index, (in_row, out_row) in enumerate(zip(total_reconstructed_sentence, total_reconstructed_labels)):
         words = in_row.strip().split(" ")[1:-1]
         labels = out_row[1:-1]
         
@@ -249,50 +227,46 @@ def remove_unpredicted_rows(total_reconstructed_sentence: list, total_reconstruc
                 # if list(set(labels))[0] != "O":
                     new_words.extend(words)
                     new_labels.extend(labels)
+                    word_rows.extend([row_index] * len(words))
 
-    return new_words, new_labels
+    return new_words, new_labels, word_rows
 
 
-def post_process_tags(tokens, tags) -> List[tuple]:
-    """Method i.e final step in postprocessing in DEI tags"""
-    # tag each token with pos
-    pos_tags = [pos for token, pos in pos_tag(tokens)]
+def post_process_tags(tokens, tags, token_rows: list = None):
+    """Method i.e final step in postprocessing in DEI tags.
+    with `token_rows`, returns row index of each entity too"""
+    # BIO / IOB tags to (text, label) of each entity, 'O' tags skipped
+    if token_rows is None:
+        return decode_bio_spans(tokens, tags)
+    spans, starts = decode_bio_spans(tokens, tags, return_starts=True)
+    return spans, [token_rows[start] for start in starts]
 
-    # convert the BIO / IOB tags to tree
-    conlltags = [(token, pos, tg) for token, pos, tg in zip(tokens, pos_tags, tags)]
-    ne_tree = conlltags2tree(conlltags)
-
-    # parse the tree to get our original text
-    original_text = []
-    for subtree in ne_tree:
-        # skipping 'O' tags
-        if type(subtree) == Tree:
-            original_label = subtree.label()
-            original_string = " ".join([token for token, pos in subtree.leaves()])
-            original_text.append((original_string, original_label))
-
-    return original_text
-
-def format_processed_result(processed_result: List[tuple], total_given_input: list) -> Dict:
+def format_processed_result(processed_result: List[tuple], total_given_input: list, result_rows: list = None) -> Dict:
     """ This maps/places all values&their tags to the original row,
     i.e like below
     {'1025 Connecticut Avenue NW Suite 1000': [('1025 Connecticut Avenue',
     'EntityAddressAddressLine1'),
     ('NW', 'EntityAddressAddressLine2'),
-    ('Suite 1000', 'EntityAddressAddressLine2')]}"""
-    
+    ('Suite 1000', 'EntityAddressAddressLine2')]}
+    each entity goes to `result_rows` row it was predicted in. entities not
+    in that row(span across rows, "filer" row) or without row index go to
+    every row they are in."""
+    # rows with "filer" are not tagged
+    is_tagged_row = ["filer" not in orig_row.lower() for orig_row in total_given_input]
+
+    row_items = {}
+    for index, item in enumerate(processed_result):
+        if len(item[0]) <= 1:
+            continue
+        row = result_rows[index] if result_rows is not None else None
+        if row is not None and is_tagged_row[row] and item[0] in total_given_input[row]:
+            row_items.setdefault(row, []).append(item)
+            continue
+        for row, orig_row in enumerate(total_given_input):
+            if is_tagged_row[row] and item[0] in orig_row:
+                row_items.setdefault(row, []).append(item)
+
     output_dict = {}
-    for orig_row in total_given_input:
-        for item in processed_result:
-            if item[0] in orig_row and len(item[0])>1:
-                
-                if orig_row not in output_dict:
-                    output_dict[orig_row] = [item]
-                else:
-                    output_dict[orig_row].append(item)
-
-    for row in list(output_dict):
-        if "filer" in row.lower():
-            del output_dict[row]
-    
-    return output_dict
\ No newline at end of file
+    for row in sorted(row_items):
+        output_dict.setdefault(total_given_input[row], []).extend(row_items[row])
+    return output_dict
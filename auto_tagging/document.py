@@ -0,0 +1,232 @@
+"""
+Title:
+    Filing Document
+
+Description:
+    Parses the filing html once and keeps its page breaks, pages, tables
+    and text blocks. Cover page(DEI), Table, Notes and Overwrite stages
+    all read from this one parsed document.
+
+Takeaways:
+    - Pages are split by <!-- Field: Page; --> comments, or by <hr> tags
+      when the filing has no such comments.
+    - A page is the list of parsed nodes between two page breaks, pages are
+      never serialized & parsed again.
+    - PageIndex has offsets of page breaks in raw html from one regex scan,
+      raw html of pages is sliced by these offsets for overwriting.
+    - Nothing here modifies the parsed tree, tables are skipped while
+      reading text instead of being removed.
+"""
+
+import re
+import bs4
+import logging
+
+from typing import Iterator, List, Optional, Tuple
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
+from .utils import FileManager
+
+logger = logging.getLogger(__name__)
+
+PAGE_BREAK_COMMENT = "Field: Page;"
+
+## comments & <hr> tags in raw html, comments are matched first
+## so an <hr> inside a commented out block is not a page break
+PAGE_BREAK_PATTERN = re.compile(r"<!--(.*?)-->|<hr\b[^>]*>", re.IGNORECASE | re.DOTALL)
+
+## tags removed along with tables when reading text outside tables
+TABLE_TAGS = {"table", "tbody", "thead", "tfoot", "tr", "th", "td"}
+
+
+def walk_outside_tables(element: bs4.Tag) -> Iterator[bs4.PageElement]:
+    """yields tags & strings inside `element` in document order,
+    skipping tables and table related tags with everything inside them"""
+    stack = list(reversed(element.contents))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tag):
+            if node.name in TABLE_TAGS:
+                continue
+            yield node
+            stack.extend(reversed(node.contents))
+        else:
+            yield node
+
+
+def text_outside_tables(element: bs4.Tag, types=None) -> str:
+    """same text as element.get_text() after removing tables from it"""
+    types = types or element.interesting_string_types or Tag.MAIN_CONTENT_STRING_TYPES
+    return "".join(node for node in walk_outside_tables(element)
+                   if isinstance(node, NavigableString) and type(node) in types)
+
+
+def collect_text_blocks(element: bs4.Tag) -> Tuple[List[str], List[str]]:
+    """texts of paragraphs & texts of spans outside tables in `element`"""
+    paragraphs, spans = [], []
+    for node in walk_outside_tables(element):
+        if isinstance(node, Tag):
+            if node.name == "p":
+                paragraphs.append(text_outside_tables(node))
+            elif node.name == "span":
+                spans.append(text_outside_tables(node))
+    return paragraphs, spans
+
+
+class Page:
+    """One page of the filing, the top level nodes between two page breaks."""
+
+    def __init__(self, nodes: List[bs4.PageElement]) -> None:
+        self.nodes = nodes
+
+    @property
+    def html(self) -> str:
+        return "".join(str(node) for node in self.nodes)
+
+    def find_all(self, name: str) -> List[bs4.Tag]:
+        """all tags with `name` in the page, in document order"""
+        found = []
+        for node in self.nodes:
+            if isinstance(node, Tag):
+                if node.name == name:
+                    found.append(node)
+                found.extend(node.find_all(name))
+        return found
+
+    @property
+    def tables(self) -> List[bs4.Tag]:
+        return self.find_all("table")
+
+    def text_outside_tables(self) -> str:
+        """text of the page without its tables. comments between
+        page nodes are read as text & whitespace before first tag is
+        dropped, same as the text of page html parsed on its own."""
+        texts, tag_found = [], False
+        for node in self.nodes:
+            if isinstance(node, Tag):
+                tag_found = True
+                if node.name not in TABLE_TAGS:
+                    texts.append(text_outside_tables(node, Tag.MAIN_CONTENT_STRING_TYPES))
+            elif tag_found or texts:
+                texts.append(str(node))
+            elif str(node).strip():
+                texts.append(str(node).lstrip())
+        return "".join(texts)
+
+
+class PageIndex:
+    """Offsets of page breaks in the raw filing html, found in a single
+    regex scan. Pages are read as slices of the raw html by these offsets,
+    without serializing any parsed nodes."""
+
+    def __init__(self, html_data: str) -> None:
+        self.html_data = html_data
+
+        comment_spans, hr_spans = [], []
+        for match in PAGE_BREAK_PATTERN.finditer(html_data):
+            if match.group(1) is None:
+                hr_spans.append(match.span())
+            elif PAGE_BREAK_COMMENT in match.group(1):
+                comment_spans.append(match.span())
+
+        # same preference as the parsed document, comments then <hr> tags
+        if comment_spans:
+            self.page_break_type, self.spans = "comment", comment_spans
+        else:
+            self.page_break_type, self.spans = ("hr" if hr_spans else None), hr_spans
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def html_before(self, index: int) -> str:
+        """raw html from start of the filing until page break at `index`"""
+        return self.html_data[:self.spans[index][0]]
+
+    def html_after(self, index: int) -> str:
+        """raw html after page break at `index` until end of the filing"""
+        return self.html_data[self.spans[index][1]:]
+
+    def page_html(self, index: int) -> str:
+        """raw html between page break at `index` and the next one"""
+        return self.html_data[self.spans[index][1]:self.spans[index + 1][0]]
+
+
+class FilingDocument:
+    """Filing html parsed once with lxml, with its page breaks."""
+
+    def __init__(self, html_data: str) -> None:
+        self.soup = BeautifulSoup(html_data, "lxml")
+        self.page_index = PageIndex(html_data)
+
+        # Find all <!-- Field: Page; Sequence> tags
+        self.page_breaks = self.soup.find_all(
+            string=lambda text: isinstance(text, Comment) and PAGE_BREAK_COMMENT in text
+        )
+        self.page_break_type = "comment"
+        if not self.page_breaks:
+            # find all <hr style="page-break-after:always;"/>
+            self.page_breaks = self.soup.find_all(re.compile("^hr"))
+            self.page_break_type = "hr" if self.page_breaks else None
+        logger.info(f"Parsed filing, {len(self.page_breaks)} page breaks of type {self.page_break_type}")
+
+    @classmethod
+    def from_file(cls, html_path: str) -> "FilingDocument":
+        return cls(FileManager().read_html_file(html_path))
+
+    @property
+    def has_cover_page(self) -> bool:
+        """a single <hr> tag is not taken as end of cover page"""
+        return self.page_break_type == "comment" or len(self.page_breaks) > 1
+
+    def cover_page(self) -> Optional[Page]:
+        """tags before the first page break"""
+        if not self.page_breaks:
+            return None
+
+        nodes = []
+        curr = self.page_breaks[0].find_previous_sibling()
+        while curr:
+            nodes.append(curr)
+            curr = curr.find_previous_sibling()
+        return Page(nodes[::-1])
+
+    def pages(self, max_page_breaks: int = None) -> List[Page]:
+        """pages between every pair of page breaks, only first
+        `max_page_breaks` page breaks are used if given"""
+        page_breaks = self.page_breaks[:max_page_breaks]
+        return [
+            Page(self._nodes_after(start_break, end_break))
+            for start_break, end_break in zip(page_breaks, page_breaks[1:])
+        ]
+
+    def split_cover_page(self) -> Tuple[str, str]:
+        """html of cover page & html of everything after it, these are
+        overwritten with output tags. both are sliced from raw html at the
+        first page break offset. ("", whole html) if filing has no cover page,
+        same as FilingStream segments"""
+        if not self.has_cover_page:
+            return "", self.page_index.html_data
+
+        if (self.page_index.page_break_type, len(self.page_index)) == (self.page_break_type, len(self.page_breaks)):
+            return self.page_index.html_before(0), self.page_index.html_after(0)
+
+        # page breaks in raw html differ from parsed ones, ex: inside <script>
+        logger.warning("Page breaks in raw html differ from parsed html, splitting parsed html")
+        cover_html = self.cover_page().html
+        other_pages_html = "".join(str(node) for node in self._nodes_after(self.page_breaks[0], None))
+        return cover_html, other_pages_html
+
+    def text_blocks(self) -> List[str]:
+        """text of every paragraph outside tables, or of every
+        span if the filing has no paragraphs outside tables"""
+        paragraphs, spans = collect_text_blocks(self.soup)
+        return paragraphs or spans
+
+    @staticmethod
+    def _nodes_after(start_break, end_break) -> List[bs4.PageElement]:
+        """sibling nodes from `start_break` until `end_break` or the end"""
+        nodes = []
+        curr = start_break.next_sibling
+        while curr and curr != end_break:
+            nodes.append(curr)
+            curr = curr.next_sibling
+        return nodes
@@ -0,0 +1,144 @@
+"""
+Title:
+    Source Filing Downloads
+
+Description:
+    Downloads source filings with a pooled requests.Session, streamed in
+    chunks to the job directory, with a size bounded on-disk cache of
+    source files. Configured with DOWNLOADS in config.yaml.
+
+Takeaways:
+    - Connections to the filing host are reused across jobs of a worker.
+    - Filing is decoded & written chunk by chunk, whole response is never
+      in memory. File is same as writing `response.text` as utf-8.
+    - Cached files are keyed by content hash, urls keep the ETag &
+      Last-Modified of their content, a re-submitted url is sent as a
+      conditional request & a 304 is served from cache.
+    - Cache is a DiskCache, shared by worker processes & evicted by size.
+"""
+
+import os
+import json
+import codecs
+import hashlib
+import logging
+import tempfile
+import requests
+
+from functools import lru_cache
+from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import DiskCache
+from .utils import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class SourceDownloader:
+    """downloads urls to files, returns sha256 of the saved file"""
+
+    def __init__(self, cache_dir: str = None, cache_max_bytes: int = 0, chunk_size: int = 256 * 1024,
+                 timeout: float = 60, pool_size: int = 4, retries: int = 2) -> None:
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.cache = DiskCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return f"url\x00{url}"
+
+    @staticmethod
+    def content_key(sha256: str) -> str:
+        return f"content\x00{sha256}"
+
+    def _cached_url(self, url: str) -> Optional[Dict]:
+        """validators & content hash of last download of url"""
+        if self.cache is None:
+            return None
+        data = self.cache.get_bytes(self.url_key(url))
+        return json.loads(data) if data is not None else None
+
+    def download(self, url: str, dest_path: str) -> str:
+        """saves url at `dest_path` & returns sha256 of the file,
+        raises requests.HTTPError if url is not downloaded"""
+        cached = self._cached_url(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304 and cached:
+                if self.cache.get_file(self.content_key(cached["sha256"]), dest_path):
+                    logger.info(f"Source file not modified, read from cache: {url}")
+                    return cached["sha256"]
+                # cached file was evicted, download again without validators
+                response = self.session.get(url, stream=True, timeout=self.timeout)
+            return self._download(url, dest_path, response)
+
+    def _download(self, url: str, dest_path: str, response: requests.Response) -> str:
+        with response:
+            response.raise_for_status()
+            sha256 = self._save(response, dest_path)
+        if self.cache is not None:
+            content_key = self.content_key(sha256)
+            # same content from another url is saved only once
+            if not os.path.exists(self.cache.path_for(content_key)):
+                self.cache.put_file(content_key, dest_path)
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": sha256,
+            }
+            self.cache.put_bytes(self.url_key(url), json.dumps(validators).encode("utf-8"))
+        return sha256
+
+    def _save(self, response: requests.Response, dest_path: str) -> str:
+        """writes response text as utf-8 one chunk at a time, same as
+        writing `response.text`. returns sha256 of written file"""
+        # charset of headers, None only for non text types that
+        # response.text guesses from content, mostly utf-8 for filings
+        try:
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        sha256 = hashlib.sha256()
+
+        directory = os.path.dirname(os.path.abspath(dest_path))
+        fd, tmp_path = tempfile.mkstemp(prefix="tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    data = decoder.decode(chunk).encode("utf-8")
+                    sha256.update(data)
+                    file.write(data)
+                data = decoder.decode(b"", final=True).encode("utf-8")
+                sha256.update(data)
+                file.write(data)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return sha256.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_downloader() -> SourceDownloader:
+    """process wide downloader from DOWNLOADS in config.yaml"""
+    download_config = get_config()["DOWNLOADS"]
+    return SourceDownloader(
+        cache_dir=download_config.get("Cache_Dir") or None,
+        cache_max_bytes=int(download_config["Cache_Max_MB"] * 1024 * 1024),
+        chunk_size=download_config["Chunk_Size_KB"] * 1024,
+        timeout=download_config["Timeout_Seconds"],
+        pool_size=download_config["Pool_Size"],
+    )
@@ -0,0 +1,381 @@
+"""
+Title:
+    Persistent Job Queue
+
+Description:
+    Auto tagging jobs are saved in a sqlite file and run by a fixed pool of
+    worker processes, instead of a new thread for every request.
+    Configured with JOBS in config.yaml.
+
+Takeaways:
+    - At most `Workers` pipelines run at once, each in its own process with
+      its own models, so memory does not grow with number of requests.
+    - New jobs are refused with QueueFull above `Max_Queued` queued & running
+      jobs, api returns HTTP 429 with a Retry-After for it.
+    - Jobs are in sqlite until done, jobs that were running when the service
+      or a worker process died are queued again, up to `Max_Attempts` times.
+      A starting queue takes back only jobs of worker processes that are not
+      alive, so queues of other api processes(gunicorn workers) keep theirs.
+    - `on_failure` is called with the payload of a job that failed for good.
+    - Workers are started with "spawn", so no torch/thread state is forked
+      from the api process.
+    - A worker failing in its initializer is restarted after a growing delay,
+      and not restarted after `Max_Init_Failures` failures in a row.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import traceback
+import multiprocessing
+
+from contextlib import closing, contextmanager
+from typing import Any, Callable, Dict, List, Optional
+from .utils import get_config
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# longest wait before restarting a worker that failed in its initializer
+MAX_RESTART_DELAY = 60
+
+
+class QueueFull(Exception):
+    """too many queued & running jobs, try again after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"job queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class JobStore:
+    """jobs table in a sqlite file, shared by api & worker processes.
+    every call opens its own connection, so it is safe in any process/thread."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_pid INTEGER,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit, transactions are started explicitly with BEGIN IMMEDIATE
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """connection in a write transaction, one writer at a time across processes"""
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            # BEGIN itself might have failed(database locked), nothing to roll back
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def add(self, payload: Dict, max_queued: int = 0, retry_after: int = 0) -> str:
+        """saves a queued job & returns its id, raises QueueFull if there are
+        already `max_queued` queued & running jobs(0 is no limit)"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as connection:
+            if max_queued:
+                (pending,) = connection.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+                ).fetchone()
+                if pending >= max_queued:
+                    raise QueueFull(retry_after)
+            connection.execute(
+                "INSERT INTO jobs (id, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), QUEUED, now, now),
+            )
+        return job_id
+
+    def claim(self, worker_pid: int) -> Optional[Dict]:
+        """oldest queued job marked as running by `worker_pid`, None if no job"""
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at, rowid LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, worker_pid = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, worker_pid, time.time(), row["id"]),
+            )
+        job = self._as_dict(row)
+        job.update(status=RUNNING, attempts=job["attempts"] + 1, worker_pid=worker_pid)
+        return job
+
+    def finish(self, job_id: str, error: str = None):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (FAILED if error else DONE, error, time.time(), job_id),
+            )
+
+    def requeue_running(self, max_attempts: int, worker_pids: List[int] = None,
+                        on_failed: Callable = None) -> int:
+        """running jobs of dead workers(all running jobs if `worker_pids` is None)
+        are queued again, or failed after `max_attempts`. returns number of jobs.
+        `on_failed` is called with each failed job once saved"""
+        query, params = "SELECT id, attempts FROM jobs WHERE status = ?", [RUNNING]
+        if worker_pids is not None:
+            if not worker_pids:
+                return 0
+            query += f" AND worker_pid IN ({','.join('?' * len(worker_pids))})"
+            params += list(worker_pids)
+
+        failed = []
+        with self._transaction() as connection:
+            rows = connection.execute(query, params).fetchall()
+            for row in rows:
+                if row["attempts"] >= max_attempts:
+                    status, error = FAILED, "worker process stopped while running the job"
+                    failed.append(row["id"])
+                else:
+                    status, error = QUEUED, None
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, worker_pid = NULL, updated_at = ? WHERE id = ?",
+                    (status, error, time.time(), row["id"]),
+                )
+        if on_failed is not None:
+            for job_id in failed:
+                on_failed(self.get(job_id))
+        return len(rows)
+
+    def dead_worker_pids(self) -> List[int]:
+        """pids of processes running jobs that are not alive anymore"""
+        with closing(self._connect()) as connection:
+            pids = [pid for (pid,) in connection.execute(
+                "SELECT DISTINCT worker_pid FROM jobs WHERE status = ? AND worker_pid IS NOT NULL", (RUNNING,)
+            )]
+        return [pid for pid in pids if not pid_is_alive(pid)]
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._as_dict(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        with closing(self._connect()) as connection:
+            for status, count in connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                counts[status] = count
+        return counts
+
+    @staticmethod
+    def _as_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+
+def pid_is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, run by another user
+        return True
+    return True
+
+
+def call_on_failure(on_failure: Optional[Callable], job: Dict):
+    """on_failure(**payload) of a failed job, its errors are only logged"""
+    if on_failure is None:
+        return
+    try:
+        on_failure(**job["payload"])
+    except Exception:
+        logger.exception(f"on_failure of job {job['id']} failed")
+
+
+def run_worker(db_path: str, handler: Callable, initializer: Optional[Callable], stop, ready, slot: int,
+               poll_seconds: float, on_failure: Optional[Callable] = None):
+    """worker process loop, runs handler(**payload) for one queued job at a time.
+    ready[slot] is set once initializer is done"""
+    logging.basicConfig(level=logging.INFO)
+    if initializer is not None:
+        try:
+            initializer()
+        except Exception:
+            logger.exception(f"Worker {os.getpid()} initializer failed")
+            sys.exit(1)
+    ready[slot] = 1
+
+    store = JobStore(db_path)
+    pid = os.getpid()
+    parent = multiprocessing.parent_process()
+    # stops with api process too, even if it was killed before stopping workers
+    while not stop.is_set() and parent.is_alive():
+        job = store.claim(pid)
+        if job is None:
+            stop.wait(poll_seconds)
+            continue
+        logger.info(f"Worker {pid} running job {job['id']}, attempt {job['attempts']}")
+        try:
+            handler(**job["payload"])
+        except Exception:
+            logger.exception(f"Job {job['id']} failed")
+            store.finish(job["id"], error=traceback.format_exc(limit=5))
+            call_on_failure(on_failure, job)
+        else:
+            store.finish(job["id"])
+
+
+class JobQueue:
+    """queue of jobs in a JobStore & the worker processes running them.
+    `handler`, `initializer` & `on_failure` must be importable functions, they
+    are run in spawned processes. `initializer` runs once per worker, before
+    any job. `on_failure(**payload)` runs once a job has failed for good."""
+
+    def __init__(self, db_path: str, handler: Callable, workers: int = 1, max_queued: int = 0,
+                 retry_after: int = 30, max_attempts: int = 1, poll_seconds: float = 1.0,
+                 initializer: Callable = None, max_init_failures: int = 5,
+                 on_failure: Callable = None) -> None:
+        self.store = JobStore(db_path)
+        self.handler = handler
+        self.initializer = initializer
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.max_init_failures = max_init_failures
+
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        # 1 for each worker slot that is done with initializer
+        self._ready = self._context.Array("b", workers)
+        self._processes: List[multiprocessing.Process] = []
+        # failures in initializer in a row, for each worker slot
+        self._init_failures = [0] * workers
+        self._monitor: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, handler: Callable, initializer: Callable = None,
+                    on_failure: Callable = None) -> "JobQueue":
+        """job queue with JOBS settings in config.yaml"""
+        jobs_config = get_config()["JOBS"]
+        return cls(
+            db_path=jobs_config["Db_Path"],
+            handler=handler,
+            workers=jobs_config["Workers"],
+            max_queued=jobs_config["Max_Queued"],
+            retry_after=jobs_config["Retry_After_Seconds"],
+            max_attempts=jobs_config["Max_Attempts"],
+            poll_seconds=jobs_config["Poll_Seconds"],
+            initializer=initializer,
+            max_init_failures=jobs_config["Max_Init_Failures"],
+            on_failure=on_failure,
+        )
+
+    def _start_worker(self, slot: int) -> multiprocessing.Process:
+        self._ready[slot] = 0
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.store.db_path, self.handler, self.initializer, self._stop,
+                  self._ready, slot, self.poll_seconds, self.on_failure),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self):
+        """queues jobs left running by workers that are not alive(earlier run)
+        & starts the workers"""
+        requeued = self.store.requeue_running(self.max_attempts, worker_pids=self.store.dead_worker_pids(),
+                                              on_failed=self._job_failed)
+        if requeued:
+            logger.info(f"Queued {requeued} jobs left running by dead workers again")
+        self._processes = [self._start_worker(slot) for slot in range(self.workers)]
+        self._monitor = threading.Thread(target=self._watch_workers, daemon=True)
+        self._monitor.start()
+
+    def _watch_workers(self):
+        """restarts dead worker processes(OOM killed etc) & requeues their job.
+        workers that died in initializer are restarted after a delay doubling
+        with every failure in a row, up to `max_init_failures` failures"""
+        # restart time of each dead worker slot, None if not dead
+        restart_at: List[Optional[float]] = [None] * self.workers
+        while not self._stop.wait(self.poll_seconds):
+            for slot, process in enumerate(self._processes):
+                if process.is_alive() or self._stop.is_set() or self._init_failures[slot] >= self.max_init_failures:
+                    continue
+                if restart_at[slot] is None:
+                    self.store.requeue_running(self.max_attempts, worker_pids=[process.pid],
+                                               on_failed=self._job_failed)
+                    if self._ready[slot]:
+                        self._init_failures[slot] = 0
+                        delay = 0
+                    else:
+                        self._init_failures[slot] += 1
+                        if self._init_failures[slot] >= self.max_init_failures:
+                            logger.error(f"Worker {process.pid} failed in initializer {self._init_failures[slot]} "
+                                         f"times in a row, not restarting it")
+                            continue
+                        delay = min(self.poll_seconds * 2 ** self._init_failures[slot], MAX_RESTART_DELAY)
+                    logger.warning(f"Worker {process.pid} stopped with exit code {process.exitcode}, "
+                                   f"restarting in {delay} seconds")
+                    restart_at[slot] = time.time() + delay
+                if time.time() >= restart_at[slot]:
+                    restart_at[slot] = None
+                    self._processes[slot] = self._start_worker(slot)
+
+    def _job_failed(self, job: Dict):
+        call_on_failure(self.on_failure, job)
+
+    def stop(self, timeout: float = None):
+        """workers stop after their current job"""
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+
+    def submit(self, **payload: Any) -> str:
+        """queues a job & returns its id, raises QueueFull if queue is full"""
+        return self.store.add(payload, self.max_queued, self.retry_after)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "workers_alive": sum(process.is_alive() for process in self._processes),
+            "workers_ready": sum(self._ready[:]),
+            "workers_stopped": sum(failures >= self.max_init_failures for failures in self._init_failures),
+            "jobs": self.store.counts(),
+        }
@@ -0,0 +1,94 @@
+"""
+Title:
+    Multi Pattern Matching
+
+Description:
+    Regex alternation of many patterns that finds/replaces all of them in
+    one pass over a text, and a replacer of ">text<" patterns that looks up
+    every text between tags once.
+
+Takeaways:
+    - PatternReplacer runs in C(re module), used on multi MB html, longest
+      pattern wins at a position & replaced text is never matched again.
+    - CellReplacer locates every text between tags once & looks it up in a
+      dict, time does not grow with number of ">text<" patterns. a regex
+      alternation of ">text<" patterns is tried at every ">" in html.
+"""
+
+import re
+
+from typing import Dict, Iterable, Set, Union
+
+
+class PatternReplacer:
+    """replaces/finds all given patterns in a text in one pass"""
+
+    def __init__(self, replacements: Dict[str, str]):
+        self.replacements = replacements
+        # at same position the longest pattern is matched
+        patterns = sorted(replacements, key=len, reverse=True)
+        self.regex = re.compile("|".join(map(re.escape, patterns))) if patterns else None
+
+    def find(self, text: str) -> Set[str]:
+        """patterns found in text"""
+        if self.regex is None:
+            return set()
+        return {match.group() for match in self.regex.finditer(text)}
+
+    def replace(self, text: str) -> str:
+        if self.regex is None:
+            return text
+        return self.regex.sub(lambda match: self.replacements[match.group()], text)
+
+
+class CellReplacer:
+    """replaces/finds ">text<" patterns in a text in one pass, same as
+    PatternReplacer if no pattern has "<" or ">" other than around text.
+    other patterns are replaced anywhere else, also inside untagged cells"""
+
+    # text between tags, with the ">" & "<" around it
+    CELL = re.compile(r">[^<>]*<")
+
+    def __init__(self, replacements: Dict[str, str]):
+        self.replacements = replacements
+        self.plain = PatternReplacer(
+            {pattern: value for pattern, value in replacements.items() if not self.CELL.fullmatch(pattern)}
+        )
+        # plain patterns never start with ">", so a cell is always tried first
+        plain_regex = "|" + self.plain.regex.pattern if self.plain.regex else ""
+        self.regex = re.compile(self.CELL.pattern + plain_regex)
+
+    @classmethod
+    def supports(cls, patterns: Iterable[str]) -> bool:
+        return all(cls.CELL.fullmatch(pattern) or (pattern and not set("<>") & set(pattern)) for pattern in patterns)
+
+    def find(self, text: str) -> Set[str]:
+        """patterns found in text"""
+        found = set()
+        for pattern in set(self.regex.findall(text)):
+            if pattern in self.replacements:
+                found.add(pattern)
+            elif self.plain.regex:
+                found |= self.plain.find(pattern[1:-1])
+        return found
+
+    def replace(self, text: str) -> str:
+        replacements, plain = self.replacements, self.plain
+
+        def replacement(match):
+            pattern = match.group()
+            if pattern in replacements:
+                return replacements[pattern]
+            if plain.regex is None:
+                return pattern
+            # cell with no tag of its own, plain patterns can be in its text
+            return ">" + plain.replace(pattern[1:-1]) + "<"
+
+        return self.regex.sub(replacement, text)
+
+
+def pattern_replacer(replacements: Dict[str, str]) -> Union[CellReplacer, PatternReplacer]:
+    """CellReplacer if it can replace all patterns, else PatternReplacer"""
+    if CellReplacer.supports(replacements):
+        return CellReplacer(replacements)
+    return PatternReplacer(replacements)
@@ -9,18 +9,21 @@ Takeaways:
     - Same tokenizer used for Cover and Notes page.
     - Table model is in another file.
     - Cover page max_length=64, Notes max_length=128
+    - Models are loaded once per process through registry.py
+    - Models run with pytorch or onnx runtime backend, see backends.py
+    - Predictions are memoized by input text in cache.py
 
 Author: purnasai@soulpage
 Date: 10-10-2023
 """
 
-import os
-import torch
 import warnings
+import numpy as np
 
 from typing import List
-from .utils import post_process, System, FileManager
-from transformers import AutoTokenizer, AutoModelForTokenClassification
+from .utils import TokenAligner, System, get_config
+from .cache import cached_predict
+from .registry import model_registry
 
 warnings.filterwarnings("ignore")
 
@@ -28,91 +31,96 @@ SEED= 33
 device = System().get_device_to_compute()
 System().set_seed(SEED)
 
-CONFIG_PATH = "config.yaml"
-yaml_obj = FileManager().load_yaml(CONFIG_PATH)
 
 class Xbrl_Tag():
     """ML Model class with tokenizers and Models loaded.
     These models are already trained on the 10-Q dataset of 
     50 to 70 companies.
     """
-    def __init__(self):
+    def __init__(self, dei_backend=None, notes_backend=None):
+        # models are loaded once per process & shared by every instance
         self.device        =  device
-        self.dei_tokenizer =  AutoTokenizer.from_pretrained(yaml_obj["IXBRL_MODELS"]["Tokenizer"],
-                                                            add_prefix_space= True,
-                                                            do_lower_case = True
-                                                            )
-
-        self.dei_model = AutoModelForTokenClassification.from_pretrained(os.path.abspath(
-                                                            yaml_obj["IXBRL_MODELS"]["Dei_Model"]
-                                                            ))
-        self.dei_model = self.dei_model.to(self.device)
-        
-        self.notes_model = AutoModelForTokenClassification.from_pretrained(os.path.abspath(
-                                                            yaml_obj["IXBRL_MODELS"]["Notes_Model"])
-                                                            )
-        self.notes_model = self.notes_model.to(self.device)
-
-
-    def predict_dei_tags(self, total_rows: List[List[str]]):
+        self.dei_tokenizer =  model_registry.get("tokenizer")
+        # torch or onnx backend, chosen in config.yaml
+        self.dei_backend   =  dei_backend or model_registry.get("dei_backend")
+        self.notes_backend =  notes_backend or model_registry.get("notes_backend")
+        # vocab arrays of registry backends are built once per process
+        self.dei_aligner   =  (TokenAligner(self.dei_tokenizer, dei_backend.id2label) if dei_backend
+                               else model_registry.get("dei_aligner"))
+        self.notes_aligner =  (TokenAligner(self.dei_tokenizer, notes_backend.id2label) if notes_backend
+                               else model_registry.get("notes_aligner"))
+
+    def _predict_token_classes(self, backend, aligner: TokenAligner, texts: List[str], max_length: int,
+                               batch_size: int):
+        """Runs token classification on `texts` in batches of `batch_size`.
+        Texts are sorted by token length so every batch holds rows of similar
+        length & is padded only to its longest row. Pad tokens are skipped by
+        TokenAligner, so the output is same as one row at a time.
+        returns reconstructed sentence & labels of its words for
+        every text, in the same order as `texts`"""
+        if not texts:
+            return []
+
+        encodings = self.dei_tokenizer(texts,
+                                       truncation=True,
+                                       max_length=max_length,
+                                       is_split_into_words= False,
+                                       )
+        # length buckets: indices of texts from shortest to longest
+        order = sorted(range(len(texts)), key=lambda index: len(encodings["input_ids"][index]))
+
+        results = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            new_inputs = self.dei_tokenizer.pad({key: [encodings[key][index] for index in batch_indices]
+                                                 for key in ("input_ids", "attention_mask")},
+                                                padding='longest',
+                                                return_tensors='np',
+                                                )
+
+            # predict
+            new_logits = backend.logits(new_inputs["input_ids"], new_inputs["attention_mask"])
+
+            new_predictions = np.argmax(new_logits, axis=2)
+            # words & labels of the whole batch
+            for index, result in zip(batch_indices, aligner.align(new_inputs["input_ids"], new_predictions)):
+                results[index] = result
+        return results
+
+    def predict_dei_tags(self, total_rows: List[List[str]], batch_size: int = None):
         """Function to predict DEI/Cover page entities
         and returns reconstructed input sentence with 
-        output  tags where each tag is output of each input word
+        output  tags where each tag is output of each input word.
+        All rows are encoded together, `batch_size` rows per forward pass.
         """
-        original_inputs, total_inputs, total_outputs = [],[],[]
-        for input_row in total_rows:
-            joined_text: str = " ".join(input_row)
-
-            new_inputs = self.dei_tokenizer(joined_text,
-                                            padding='max_length',
-                                            truncation=True,
-                                            max_length= 64,
-                                            return_tensors='pt',
-                                            is_split_into_words= False,
-                                            )
-            new_inputs = {key:val.to(self.device) for key,val in new_inputs.items()}
-
-            with torch.no_grad():
-                # predict
-                new_logits = self.dei_model(**new_inputs).logits
-
-            new_predictions = torch.argmax(new_logits, dim=2)
-            new_predicted_token_labels = [self.dei_model.config.id2label[t.item()] for t in new_predictions[0]]
-            decoded_string = self.dei_tokenizer.convert_ids_to_tokens(new_inputs["input_ids"][0])
-            reconstructed_row, reconstructed_predictions = post_process(decoded_string, new_predicted_token_labels)
-            
-            original_inputs.append(joined_text)
+        batch_size = batch_size or get_config()["INFERENCE"]["Dei_Batch_Size"]
+        original_inputs: List[str] = [" ".join(input_row) for input_row in total_rows]
+
+        total_inputs, total_outputs = [],[]
+        # only rows not seen before by this model go to the model
+        predictions = cached_predict(self.dei_backend.model_id, original_inputs,
+                                     lambda texts: self._predict_token_classes(self.dei_backend, self.dei_aligner, texts,
+                                                                               max_length=64, batch_size=batch_size))
+        for reconstructed_row, reconstructed_predictions in predictions:
             total_inputs.append(reconstructed_row)
-            total_outputs.append(reconstructed_predictions)
+            total_outputs.append(list(reconstructed_predictions))
 
         return original_inputs, total_inputs, total_outputs
     
-    def predict_notes_tags(self, total_rows: List[List[str]]):
+    def predict_notes_tags(self, total_rows: List[List[str]], batch_size: int = None):
         """Function to predict tags in the Notes section in Filings.
+        Paragraphs are bucketed by token length & predicted `batch_size`
+        at a time, results are returned in the order of `total_rows`.
         """
+        batch_size = batch_size or get_config()["INFERENCE"]["Notes_Batch_Size"]
+        joined_texts: List[str] = [" ".join(input_row) for input_row in total_rows]
+
         total_inputs, total_outputs = [],[]
-        for input_row in total_rows:
-            joined_text = " ".join(input_row)
-
-            new_inputs = self.dei_tokenizer(joined_text,
-                                            padding='max_length',
-                                            truncation=True,
-                                            max_length=128,
-                                            return_tensors='pt',
-                                            is_split_into_words= False,
-                                            )
-
-            new_inputs = {k:v.to(self.device) for k,v in new_inputs.items()}
-
-            with torch.no_grad():
-                new_logits = self.notes_model(**new_inputs).logits
-
-            new_predictions = torch.argmax(new_logits, dim=2)
-            new_predicted_token_class = [self.notes_model.config.id2label[t.item()] for t in new_predictions[0]]
-            decoded_string = self.dei_tokenizer.convert_ids_to_tokens(new_inputs["input_ids"][0])
-            reconstructed_sentence, reconstructed_labels = post_process(decoded_string, new_predicted_token_class)            
-            
+        predictions = cached_predict(self.notes_backend.model_id, joined_texts,
+                                     lambda texts: self._predict_token_classes(self.notes_backend, self.notes_aligner, texts,
+                                                                               max_length=128, batch_size=batch_size))
+        for reconstructed_sentence, reconstructed_labels in predictions:
             total_inputs.append(reconstructed_sentence)
-            total_outputs.append(reconstructed_labels)
+            total_outputs.append(list(reconstructed_labels))
 
-        return total_inputs, total_outputs
\ No newline at end of file
+        return total_inputs, total_outputs
@@ -13,17 +13,14 @@ Takeaways:
 Author: purnasai@soulpage
 Date: 10-10-2023
 """
-import bs4
-import nltk
 import logging
 import warnings
 
 from typing import List, Tuple
-from bs4 import BeautifulSoup
 from nltk.tokenize import sent_tokenize
-from .utils import ProcessText, get_text_outside_table
+from .utils import ProcessText
+from .document import FilingDocument
 
-nltk.download('punkt')
 warnings.filterwarnings("ignore")
 logger = logging.getLogger(__name__)
 
@@ -52,36 +49,21 @@ def process_text(paragraph: str) -> List:
 
     return ip_text
 
-def get_NER_Data(html_data: str) -> List[List[str]]:
-    """Takes html as input, finds html code of text outside tabels,
-    finds P/span tags, extract, cleans, splits the text."""
+def get_NER_Data(document: FilingDocument) -> List[List[str]]:
+    """Takes parsed html(or FilingStream) as input, finds P/span
+    tags outside tabels, extract, cleans, splits the text."""
     
     logger.info("3.1. Started collecting entire text, not just pages with notes heading..")
     total_ip_texts = []
 
-    # this eliminates tables in Notes section
-    text_content, html_content = get_text_outside_table(html_data)
-
-    # if Paragraph tags found
-    if html_content.find_all("p"):
-        for p in html_content.find_all("p"):
-            text: str = p.get_text()
-
-            ip_text = process_text(text)
-            if ip_text:
-                ip_text = " ".join(ip_text)
-                ip_text = processtext.clean_text(ip_text)
-                total_ip_texts.append(ip_text.split(" "))
-
-    else: # else if span tags found
-        for span in html_content.find_all("span"):
-            text: str = span.get_text()
-
-            ip_text = process_text(text)
-            if ip_text:
-                ip_text = " ".join(ip_text)
-                ip_text = processtext.clean_text(ip_text)
-                total_ip_texts.append(ip_text.split(" "))
+    # this skips tables in Notes section,
+    # Paragraph tags if found, else span tags
+    for text in document.text_blocks():
+        ip_text = process_text(text)
+        if ip_text:
+            ip_text = " ".join(ip_text)
+            ip_text = processtext.clean_text(ip_text)
+            total_ip_texts.append(ip_text.split(" "))
 
     return total_ip_texts
 
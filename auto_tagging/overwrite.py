@@ -8,12 +8,18 @@ Description:
 Takeaways:
     - we are using "search&replace" strategy of string replacing.
     - it is actually supposted to happen at HTML side from backend or frontend.
+    - all tags of a stage are replaced in one pass over the html, see
+      matching.PatternReplacer. ">value<" is replaced if value is a cell/tag
+      text on its own, else value is replaced wherever it is found.
+    - ">value<" tags are looked up for every text between tags, no scan per
+      value, see matching.CellReplacer.
     
 
 Author: purnasai@soulpage
 Date: 31-10-2023
 """
 
+import re
 import uuid
 import string
 import random
@@ -22,7 +28,21 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-from typing import Dict, List
+from typing import Dict, List, Set, Union
+from .matching import CellReplacer, PatternReplacer, pattern_replacer
+
+# cover page html is sliced from start of raw html, only the part
+# after <body> is tagged, <head>/<title> text is never replaced
+BODY_OPEN_TAG = re.compile(r"<body\b[^>]*>", re.IGNORECASE)
+
+
+def cell_replacement(value: str, markups: List[str]) -> str:
+    """">value<" with the <font> tags of value, tags given later go inside
+    earlier ones, same as replacing ">value<" with each tag one by one"""
+    replacement = ">" + value + "<"
+    for markup in markups:
+        replacement = replacement.replace(">" + value + "<", ">" + markup + "<")
+    return replacement
 
 
 class OverwriteHtml:
@@ -51,44 +71,53 @@ class OverwriteHtml:
 
         # sample
         # result = html_string.replace("10-Q", '<font id="dei:DocumentType">10-Q</font>')
-        html_string = html_string.replace("\n", " ")
-        placeholders = {}
-
+        body_start = BODY_OPEN_TAG.search(html_string)
+        head = html_string[:body_start.end()] if body_start else ""
+        body = html_string[len(head):].replace("\n", " ")
+        return head + self.replace_tags(body, ml_tags)
+
+    def tag_replacer(self, ml_tags: List[list], cell_values: Set[str] = (),
+                     fallback: bool = True) -> Union[CellReplacer, PatternReplacer]:
+        """all [value, tag, <font> tag html] rows as one replacer. ">value<" is
+        replaced for values in `cell_values`(or all values without `fallback`),
+        other values are replaced wherever they are in html."""
+        # <font> tags of each value, in order of rows
+        value_markups = {}
         for row in ml_tags:
-            replaced_string = html_string.replace(
-                ">" + row[0] + "<", ">" + row[2] + "<"
-            )
-            # Check if the string was modified by the first replacement
-            if replaced_string != html_string:
-                html_string = replaced_string
-            else:
-                # If the first replacement didn't work, apply the second replacement
-                # Directly replacing is conflicting with the html format.
-                # hence using place holder to replace all of them later.
-                placeholder = f"__placeholder_{random.randint(1000, 9999)}__"
-                html_string = html_string.replace(row[0], placeholder)
-                placeholders[placeholder] = row[2]
-
-        for placeholder, replacement in placeholders.items():
-            html_string = html_string.replace(placeholder, replacement)
-
-        return html_string
-
-    def modify_statement_tabels(self, second_half: str, Table_output: Dict):
-        """Function to use Table results, search for the value in html
-        and replace them with <font> tag"""
-        logger.info("4.1. Overwriting HTML with TABLE tags")
+            value_markups.setdefault(row[0], []).append(row[2])
 
+        replacements = {}
+        for value, markups in value_markups.items():
+            if not fallback or value in cell_values:
+                replacements[">" + value + "<"] = cell_replacement(value, markups)
+            else:
+                # value is replaced only once, by its first tag
+                replacements[value] = markups[0]
+        return pattern_replacer(replacements)
+
+    def replace_tags(self, html_string: str, ml_tags: List[list], cell_values: Set[str] = None,
+                     fallback: bool = True) -> str:
+        """replaces all rows in html in one pass, `cell_values` are found in html
+        if not given. Directly replacing is conflicting with the html format, so
+        values are only replaced in given html, never in <font> tags added for other values."""
+        if cell_values is None and fallback:
+            # values with ">value<" in html, found in one pass
+            cell_patterns = pattern_replacer({">" + row[0] + "<": "" for row in ml_tags})
+            cell_values = {pattern[1:-1] for pattern in cell_patterns.find(html_string)}
+        return self.tag_replacer(ml_tags, cell_values or (), fallback).replace(html_string)
+
+    def table_tags(self, Table_output: Dict) -> List[list]:
+        """unique [value, tag, <font> tag html] rows of Table results"""
         Table_output1 = [list(list(dict_item.items())[0]) for dict_item in Table_output]
         # this only check for unique pairs. removes if both values in 2 pairs are same
         unique_lists = set(tuple(sublist) for sublist in Table_output1)
         unique_Table_output1 = [list(sublist) for sublist in unique_lists]
 
         unique_Table_output2 = []
-        unique_vals = []
+        unique_vals = set()
         for pair in unique_Table_output1:
             if pair[0] not in unique_vals:
-                unique_vals.append(pair[0])
+                unique_vals.add(pair[0])
                 unique_Table_output2.append(pair)
 
         uuid_result = uuid.uuid1()
@@ -101,37 +130,25 @@ class OverwriteHtml:
             ]
             for row in unique_Table_output2
         ]
+        return Table_output1
 
+    def replace_table_tags(self, second_half: str, Table_output1: List[list], cell_values: Set[str] = None):
+        """replaces table values with their <font> tags in html. `cell_values`
+        are values found as >value< anywhere in the filing, needed when the
+        filing is overwritten page by page. if not given, checked in `second_half`"""
         second_half = second_half.replace("\n", " ")
+        return self.replace_tags(second_half, Table_output1, cell_values)
 
-        placeholders = {}
-        # for row in Table_output1:
-        #     second_half = second_half.replace(">"+row[0]+"<", ">"+row[2]+"<")
-        for row in Table_output1:
-            replaced_second_half = second_half.replace(
-                ">" + row[0] + "<", ">" + row[2] + "<"
-            )
-            if replaced_second_half != second_half:
-                second_half = replaced_second_half
-            else:
-                # replacing here itself might conflict with html like we had conflict in Coverpage
-                # So better to use placeholders.
-                placeholder = f'aa__placeholder_{str(random.randint(0, 9))+random.choice(string.ascii_letters)+str(random.randint(0, 9))+"-"+random.choice(string.ascii_letters)+"az"}__aa'
-                second_half = second_half.replace(row[0], placeholder)
-                placeholders[placeholder] = row[2]
-
-        for placeholder, replacement in placeholders.items():
-            second_half = second_half.replace(placeholder, replacement)
-
-        return second_half
-
-    def modify_notespages(
-        self, second_half: str, Notes_output: Dict, table_output_values: List
-    ):
-        """Function to use Notes results, search for the value in html
+    def modify_statement_tabels(self, second_half: str, Table_output: Dict):
+        """Function to use Table results, search for the value in html
         and replace them with <font> tag"""
-        logger.info("4.2. Overwriting HTML with NOTES tags")
+        logger.info("4.1. Overwriting HTML with TABLE tags")
+        return self.replace_table_tags(second_half, self.table_tags(Table_output))
 
+    def notes_tags(self, Notes_output: Dict, table_output_values: List) -> List[list]:
+        """[value, tag, <font> tag html] rows of Notes results,
+        values already tagged in tables are skipped"""
+        table_output_values = set(table_output_values)
         ml_tags1 = [tuple(t.items())[0] for t in Notes_output]
         ml_tags1 = [[row[0], "us-gaap:" + row[1]] for row in ml_tags1]
         uuid_result = uuid.uuid1()
@@ -145,7 +162,47 @@ class OverwriteHtml:
             for row in ml_tags1
             if row[0] not in table_output_values
         ]  # to avoid duplicating labels
+        return ml_tags1
+
+    def replace_notes_tags(self, second_half: str, ml_tags1: List[list]):
+        """only ">value<" is replaced for Notes tags"""
+        return self.replace_tags(second_half, ml_tags1, fallback=False)
 
-        for row in ml_tags1:
-            second_half = second_half.replace(">" + row[0] + "<", ">" + row[2] + "<")
-        return second_half
+    def modify_notespages(
+        self, second_half: str, Notes_output: Dict, table_output_values: List
+    ):
+        """Function to use Notes results, search for the value in html
+        and replace them with <font> tag"""
+        logger.info("4.2. Overwriting HTML with NOTES tags")
+        return self.replace_notes_tags(second_half, self.notes_tags(Notes_output, table_output_values))
+
+    def modify_filing_stream(self, filing, dest_path: str, coverpage_output: Dict,
+                             Table_output: Dict, Notes_output: Dict, table_output_values: List):
+        """Overwrites a FilingStream with Coverpage, Table & Notes tags one
+        page at a time, each page is written to `dest_path` once tagged.
+        same tags as the modify_* functions on the whole html."""
+        logger.info("4.0. Overwriting HTML page by page with COVERPAGE, TABLE & NOTES tags")
+        Table_output1 = self.table_tags(Table_output)
+        ml_tags1 = self.notes_tags(Notes_output, table_output_values)
+
+        # first read: table values found in a cell on any page after cover page
+        cell_patterns = pattern_replacer({">" + row[0] + "<": "" for row in Table_output1})
+        cell_values = set()
+        for number, html, page_break in filing.segments():
+            if number == 0 and filing.has_cover_page:
+                continue
+            html = (html + page_break).replace("\n", " ")
+            cell_values.update(pattern[1:-1] for pattern in cell_patterns.find(html))
+
+        # same replacers for every page
+        table_replacer = self.tag_replacer(Table_output1, cell_values)
+        notes_replacer = self.tag_replacer(ml_tags1, fallback=False)
+
+        # second read: tag & write every page
+        with open(dest_path, "w", encoding="utf-8") as file:
+            for number, html, page_break in filing.segments():
+                if number == 0 and filing.has_cover_page:
+                    file.write(self.modify_coverpage(html, coverpage_output) + page_break)
+                    continue
+                html = table_replacer.replace((html + page_break).replace("\n", " "))
+                file.write(notes_replacer.replace(html))
@@ -0,0 +1,129 @@
+"""
+Title:
+    Int8 Quantization
+
+Description:
+    Dynamic int8 quantization of the linear layers of DEI, Notes and Table
+    models for CPU, and an agreement report of int8 vs fp32 tags on a filing.
+
+Takeaways:
+    - Enabled with INFERENCE.Quantize in config.yaml, fp32 stays the default.
+    - Quantized weights are cached in INFERENCE.Quantized_Dir and quantized
+      again when the model checkpoint is newer than the cache.
+    - Always run the agreement report on a sample filing before enabling it.
+      python -m auto_tagging.quantization <html_path> --html-type 10-Q
+"""
+
+import os
+import json
+import torch
+import logging
+import argparse
+
+from typing import Dict, List
+from .utils import get_config
+from .backends import file_lock, get_source_mtime, write_atomically
+
+logger = logging.getLogger(__name__)
+
+
+def quantize_model(model):
+    """int8 dynamic quantization of all linear layers, runs only on cpu"""
+    model = model.to("cpu").eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized_model(name: str, model_path: str, build_model, load_fp32_model):
+    """loads int8 model from the cache in INFERENCE.Quantized_Dir.
+    if cache is missing or older than checkpoint at `model_path`, fp32
+    model is loaded, quantized and saved to the cache."""
+    cache_path = os.path.join(get_config()["INFERENCE"]["Quantized_Dir"], f"{name}.int8.pt")
+
+    def cache_is_fresh():
+        return os.path.exists(cache_path) and os.path.getmtime(cache_path) >= get_source_mtime(model_path)
+
+    # one worker process quantizes, others wait & load its cache
+    with file_lock(cache_path):
+        if not cache_is_fresh():
+            logger.info(f"Quantizing {name} to int8......")
+            model = quantize_model(load_fp32_model())
+            with write_atomically(cache_path) as tmp_path:
+                torch.save(model.state_dict(), tmp_path)
+            return model
+
+    logger.info(f"Loading int8 {name} from {cache_path}")
+    # quantize the untrained structure so packed int8 weights fit in
+    model = quantize_model(build_model())
+    model.load_state_dict(torch.load(cache_path, map_location="cpu", weights_only=False))
+    return model.eval()
+
+
+def compare_tags(fp32_tags: List, int8_tags: List) -> Dict:
+    """counts tags that are same in fp32 & int8 outputs. tags are
+    either list of labels per row or a single label per row"""
+    total_tags, agreeing_tags = 0, 0
+    for fp32_row, int8_row in zip(fp32_tags, int8_tags):
+        if isinstance(fp32_row, str):
+            fp32_row, int8_row = [fp32_row], [int8_row]
+        total_tags += len(fp32_row)
+        agreeing_tags += sum(fp32_tag == int8_tag for fp32_tag, int8_tag in zip(fp32_row, int8_row))
+
+    return {
+        "rows": len(fp32_tags),
+        "tags": total_tags,
+        "agreeing_tags": agreeing_tags,
+        "agreement": round(agreeing_tags / total_tags, 4) if total_tags else 1.0,
+    }
+
+
+def agreement_report(html_path: str, html_type: str = "10-Q") -> Dict:
+    """Runs DEI, Table and Notes models in fp32 and int8 on the
+    same extracted text of a sample filing and compares their tags."""
+    from .backends import TorchBackend
+    from .modelling import Xbrl_Tag
+    from .registry import MODEL_SPECS, get_model_path, model_registry
+    from .table_modelling import predict_table_tags
+    from .utils import ensure_nltk_data
+    from .document import FilingDocument
+    from .dei_utils import split_page_and_extract_text
+    from .notes_utils import get_NER_Data
+    from .table_utils import get_statement_tables, arrange_rows_with_context
+
+    ensure_nltk_data()
+    backends = {}
+    for name, spec in MODEL_SPECS.items():
+        backends[name] = {
+            "fp32": TorchBackend(model_registry.get(name)),
+            "int8": TorchBackend(load_quantized_model(name, get_model_path(name),
+                                                      spec["build"], spec["load"]), device="cpu"),
+        }
+
+    # extract text once, same inputs go to both models
+    document = FilingDocument.from_file(html_path)
+    dei_rows = split_page_and_extract_text(document)
+    table_data, _, _ = arrange_rows_with_context(get_statement_tables(document, html_type))
+    notes_rows = get_NER_Data(document)
+
+    outputs = {}
+    for precision in ("fp32", "int8"):
+        xbrl_tag = Xbrl_Tag(dei_backend=backends["dei_model"][precision],
+                            notes_backend=backends["notes_model"][precision])
+        _, _, dei_tags = xbrl_tag.predict_dei_tags(dei_rows)
+        _, notes_tags = xbrl_tag.predict_notes_tags(notes_rows)
+        _, table_tags = predict_table_tags(table_data, backend=backends["table_model"][precision])
+        outputs[precision] = {"dei": dei_tags, "table": table_tags, "notes": notes_tags}
+
+    report = {
+        stage: compare_tags(outputs["fp32"][stage], outputs["int8"][stage])
+        for stage in ("dei", "table", "notes")
+    }
+    logger.info(f"int8 vs fp32 agreement: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="int8 vs fp32 tag agreement on a filing")
+    parser.add_argument("html_path")
+    parser.add_argument("--html-type", default="10-Q")
+    args = parser.parse_args()
+    print(json.dumps(agreement_report(args.html_path, args.html_type), indent=2))
@@ -0,0 +1,245 @@
+"""
+Title:
+    Model Registry
+
+Description:
+    Process wide registry of ML models & tokenizers. Every model is loaded
+    once per process on first use and shared by all auto tagging jobs.
+
+Takeaways:
+    - Loading is lazy and thread safe, concurrent jobs wait for a single load.
+    - Load time and resident memory after every load are kept in `stats`.
+    - Tokenizers are not safe to call from many threads at once, so each
+      thread gets its own copy of the tokenizer loaded once.
+    - Nothing is loaded at import, call `warm_up` in tagging.py to load all.
+    - Prediction uses the `*_backend` entries, see backends.py.
+"""
+
+import os
+import copy
+import time
+import hashlib
+import logging
+import threading
+
+from typing import Callable, Dict, List
+from .utils import System, get_config
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Holds loader functions by name and the models they loaded.
+    `get(name)` loads the model on first call and returns the
+    same object for every later call from any thread."""
+
+    def __init__(self) -> None:
+        self._loaders: Dict[str, Callable] = {}
+        self._per_thread: Dict[str, bool] = {}
+        self._models: Dict = {}
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._thread_local = threading.local()
+
+    def register(self, name: str, loader: Callable, per_thread: bool = False):
+        """register a loader function, `per_thread` gives every thread
+        its own copy of the loaded object (used for tokenizers)."""
+        with self._lock:
+            self._loaders[name] = loader
+            self._per_thread[name] = per_thread
+            self._load_locks[name] = threading.Lock()
+
+    def get(self, name: str, thread_copy: bool = True):
+        """returns loaded model by name, loads it if not loaded yet.
+        `thread_copy=False` gives the shared object of per thread entries,
+        only for reading from it."""
+        if name not in self._loaders:
+            raise KeyError(f"No model registered with name '{name}'")
+
+        model = self._models.get(name)
+        if model is None:
+            model = self._load(name)
+
+        if self._per_thread[name] and thread_copy:
+            thread_models = self._thread_local.__dict__.setdefault("models", {})
+            if name not in thread_models:
+                thread_models[name] = copy.deepcopy(model)
+            model = thread_models[name]
+        return model
+
+    def _load(self, name: str):
+        with self._load_locks[name]:
+            # another thread might have loaded it while we waited
+            if name in self._models:
+                return self._models[name]
+
+            logger.info(f"Loading model '{name}'......")
+            start_time = time.perf_counter()
+            model = self._loaders[name]()
+            load_seconds = time.perf_counter() - start_time
+
+            self._models[name] = model
+            self._stats[name] = {
+                "load_seconds": round(load_seconds, 3),
+                "resident_memory_mb": System().get_resident_memory_mb(),
+            }
+            logger.info(f"Loaded model '{name}' {self._stats[name]}")
+        return model
+
+    def names(self) -> List[str]:
+        return list(self._loaders)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def stats(self) -> Dict[str, Dict]:
+        """load time & resident memory of the process after each load"""
+        return copy.deepcopy(self._stats)
+
+
+def load_tokenizer():
+    """same tokenizer used for Cover and Notes models"""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(get_config()["IXBRL_MODELS"]["Tokenizer"],
+                                         add_prefix_space= True,
+                                         do_lower_case = True
+                                         )
+
+
+def load_token_classifier(config_key: str):
+    """loads Cover/Notes token classification model to compute device"""
+    from transformers import AutoModelForTokenClassification
+
+    model = AutoModelForTokenClassification.from_pretrained(os.path.abspath(
+                                                            get_config()["IXBRL_MODELS"][config_key]
+                                                            ))
+    model = model.eval()
+    return model.to(System().get_device_to_compute())
+
+
+def build_token_classifier(config_key: str):
+    """Cover/Notes model structure from its config, without trained weights"""
+    from transformers import AutoConfig, AutoModelForTokenClassification
+
+    model_config = AutoConfig.from_pretrained(os.path.abspath(get_config()["IXBRL_MODELS"][config_key]))
+    return AutoModelForTokenClassification.from_config(model_config)
+
+
+def load_table_tokenizer():
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(get_config()["IXBRL_MODELS"]["Tokenizer"])
+
+
+def load_table_model():
+    """loads finbert weights of Table model checkpoint"""
+    from .table_modelling import load_table_model as load_checkpoint
+
+    return load_checkpoint(get_config()["IXBRL_MODELS"]["Table_Model"])
+
+
+def build_table_model():
+    from .table_modelling import build_table_model as build_structure
+
+    return build_structure()
+
+
+## how to load & build every model, used by the backends
+MODEL_SPECS = {
+    "dei_model": {
+        "config_key": "Dei_Model",
+        "load": lambda: load_token_classifier("Dei_Model"),
+        "build": lambda: build_token_classifier("Dei_Model"),
+        "token_level": True,
+    },
+    "notes_model": {
+        "config_key": "Notes_Model",
+        "load": lambda: load_token_classifier("Notes_Model"),
+        "build": lambda: build_token_classifier("Notes_Model"),
+        "token_level": True,
+    },
+    "table_model": {
+        "config_key": "Table_Model",
+        "load": load_table_model,
+        "build": build_table_model,
+        "token_level": False,
+    },
+}
+
+
+def get_model_path(name: str) -> str:
+    return get_config()["IXBRL_MODELS"][MODEL_SPECS[name]["config_key"]]
+
+
+def model_fingerprint(name: str, *settings) -> str:
+    """id of the model that changes whenever any file of its
+    checkpoint changes, or any of the `settings` it runs with"""
+    model_path = get_model_path(name)
+    if os.path.isdir(model_path):
+        files = sorted(os.path.join(path, file) for path, _, files in os.walk(model_path) for file in files)
+    else:
+        files = [model_path]
+
+    digest = hashlib.sha256(name.encode("utf-8"))
+    for file in files:
+        stat = os.stat(file)
+        digest.update(f"{os.path.relpath(file, model_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    for setting in settings:
+        digest.update(str(setting).encode("utf-8"))
+    return f"{name}-{digest.hexdigest()[:16]}"
+
+
+def load_backend(name: str, quantize: bool = None):
+    """returns model wrapped in backend chosen by INFERENCE.Backend, int8
+    quantized if INFERENCE.Quantize. only the plain pytorch model
+    is kept in the registry, onnx/int8 models are loaded separately."""
+    from .backends import TorchBackend, get_backend_name, load_onnx_backend
+    from .quantization import load_quantized_model
+
+    spec = MODEL_SPECS[name]
+    if quantize is None:
+        quantize = get_config()["INFERENCE"].get("Quantize", False)
+
+    backend_name = get_backend_name()
+    if backend_name == "onnx":
+        backend = load_onnx_backend(name,
+                                    get_model_path(name),
+                                    spec["load"],
+                                    token_level=spec["token_level"],
+                                    quantize=quantize,
+                                    )
+    elif quantize:
+        model = load_quantized_model(name, get_model_path(name), spec["build"], spec["load"])
+        backend = TorchBackend(model, device="cpu")
+    else:
+        backend = TorchBackend(model_registry.get(name))
+
+    # fingerprint of checkpoint when it was loaded, keys the prediction cache
+    backend.model_id = model_fingerprint(name, backend_name, quantize,
+                                         get_config()["IXBRL_MODELS"]["Tokenizer"])
+    return backend
+
+
+def load_token_aligner(backend_name: str):
+    """TokenAligner keeps only arrays built from the vocab, not the tokenizer"""
+    from .utils import TokenAligner
+
+    return TokenAligner(model_registry.get("tokenizer", thread_copy=False), model_registry.get(backend_name).id2label)
+
+
+model_registry = ModelRegistry()
+model_registry.register("tokenizer", load_tokenizer, per_thread=True)
+model_registry.register("table_tokenizer", load_table_tokenizer, per_thread=True)
+for model_name, model_spec in MODEL_SPECS.items():
+    model_registry.register(model_name, model_spec["load"])
+
+# models wrapped in the configured inference backend, used for prediction
+model_registry.register("dei_backend", lambda: load_backend("dei_model"))
+model_registry.register("notes_backend", lambda: load_backend("notes_model"))
+model_registry.register("table_backend", lambda: load_backend("table_model"))
+
+# vocab arrays of tokenizer & labels of each backend, shared by all threads
+model_registry.register("dei_aligner", lambda: load_token_aligner("dei_backend"))
+model_registry.register("notes_aligner", lambda: load_token_aligner("notes_backend"))
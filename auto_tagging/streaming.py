@@ -0,0 +1,190 @@
+"""
+Title:
+    Streaming Filing Reader
+
+Description:
+    Reads very large filings(10-K with exhibits) in chunks from disk and
+    parses one page at a time, instead of keeping the whole html & its
+    parsed tree in memory. Enabled with STREAMING.Enabled in config.yaml.
+
+Takeaways:
+    - FilingStream has the same methods as FilingDocument that Cover page,
+      Table and Notes stages use, so stages run unchanged on it.
+    - Page breaks are found with an incremental scan, a page break cut
+      between two chunks is found once the next chunk is read.
+    - Every page is parsed only once, texts of pages read by an earlier
+      stage are kept for Notes stage, their parsed trees are not.
+    - Tagged output is written page by page, see OverwriteHtml.modify_filing_stream
+    - Pages are parsed from raw html slices, like PageIndex, so page breaks
+      nested inside other tags can give a slightly different split than
+      FilingDocument.
+    - Only one page is held in memory, a filing without page breaks is one
+      page. Chunks are scanned once, only an unclosed comment/tag is kept
+      & scanned again with the next chunk.
+    - Memory is traded for reads: filing is read from disk for page break
+      type & cover page(both stop at first page break), for table pages,
+      for notes text and twice for overwriting, about 5 reads per filing.
+"""
+
+import re
+import logging
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from bs4 import BeautifulSoup
+from .utils import get_config
+from .document import PAGE_BREAK_COMMENT, Page, collect_text_blocks
+
+logger = logging.getLogger(__name__)
+
+## same as PAGE_BREAK_PATTERN in document.py, with a group for
+## comment that is not closed yet in the html read so far
+STREAM_PAGE_BREAK_PATTERN = re.compile(
+    r"<!--(?P<comment>.*?)-->|(?P<open><!--)|(?P<hr><hr\b[^>]*>)", re.IGNORECASE | re.DOTALL
+)
+
+
+def _scan(buffer: str, scan_from: int, final: bool):
+    """matches of comments & <hr> tags in buffer from `scan_from`.
+    returns matches & the position until which buffer is scanned,
+    a comment or tag that may continue in next chunk is not scanned"""
+    matches, scanned = [], scan_from
+    for match in STREAM_PAGE_BREAK_PATTERN.finditer(buffer, scan_from):
+        if match.group("open"):
+            if final:
+                continue
+            return matches, match.start()
+        matches.append(match)
+        scanned = match.end()
+
+    if not final:
+        tag_start = buffer.rfind("<", scanned)
+        if tag_start != -1 and buffer.find(">", tag_start) == -1:
+            return matches, tag_start
+    return matches, len(buffer)
+
+
+def scan_page_breaks(chunks: Iterable[str]) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """Incremental version of PageIndex scan over html read in `chunks`.
+    yields (html before page break, page break, "comment" or "hr") for every
+    page break comment & <hr> tag, then (remaining html, "", None)."""
+    # html scanned since last page break, kept as parts & joined once per page
+    page_parts: List[str] = []
+    # html not scanned yet: an open comment or a tag cut by the chunk
+    tail = ""
+    for chunk, final in _with_final(chunks):
+        text = tail + chunk
+        matches, scanned = _scan(text, 0, final)
+
+        start = 0
+        for match in matches:
+            if match.group("hr"):
+                kind = "hr"
+            elif PAGE_BREAK_COMMENT in match.group("comment"):
+                kind = "comment"
+            else:
+                continue
+            page_parts.append(text[start:match.start()])
+            yield "".join(page_parts), match.group(0), kind
+            page_parts, start = [], match.end()
+
+        page_parts.append(text[start:scanned])
+        tail = text[scanned:]
+    yield "".join(page_parts) + tail, "", None
+
+
+def _with_final(chunks: Iterable[str]) -> Iterator[Tuple[str, bool]]:
+    for chunk in chunks:
+        yield chunk, False
+    yield "", True
+
+
+class FilingStream:
+    """Filing read in chunks from disk, holds & parses only one page at a time."""
+
+    def __init__(self, html_path: str, chunk_size: int = None) -> None:
+        self.html_path = html_path
+        self.chunk_size = chunk_size or int(get_config()["STREAMING"]["Chunk_Size_KB"] * 1024)
+        # segment number -> (paragraph texts, span texts) of pages already parsed
+        self._text_blocks: Dict[int, Tuple[List[str], List[str]]] = {}
+        self.page_break_type, self.has_cover_page = self._find_page_break_type()
+        logger.info(f"Streaming filing, page breaks of type {self.page_break_type}")
+
+    def read_chunks(self) -> Iterator[str]:
+        """filing html in chunks of `chunk_size` characters,
+        decoded same as FileManager.read_html_file"""
+        with open(self.html_path, "r", encoding="unicode-escape") as file:
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _find_page_break_type(self) -> Tuple[Optional[str], bool]:
+        """comments are page breaks if filing has any, else <hr> tags.
+        scan stops at first page break comment, so whole filing is
+        read only when it has no page break comments"""
+        hr_count = 0
+        for _, _, kind in scan_page_breaks(self.read_chunks()):
+            if kind == "comment":
+                return "comment", True
+            if kind == "hr":
+                hr_count += 1
+        if hr_count:
+            return "hr", hr_count > 1
+        return None, False
+
+    def segments(self) -> Iterator[Tuple[int, str, str]]:
+        """(segment number, html, page break after it) of cover page, of
+        every page & of html after last page break(with empty page break).
+        whole filing is one segment if it has no page breaks"""
+        html_parts, number = [], 0
+        for html, page_break, kind in scan_page_breaks(self.read_chunks()):
+            if kind is not None and kind != self.page_break_type:
+                # <hr> tags in a filing with page break comments are just html
+                html_parts.extend([html, page_break])
+                continue
+            html_parts.append(html)
+            yield number, "".join(html_parts), page_break
+            html_parts, number = [], number + 1
+
+    def _parse_page(self, number: int, html: str) -> Page:
+        soup = BeautifulSoup(html, "lxml")
+        # text is kept for notes, so the page is not parsed again
+        self._text_blocks.setdefault(number, collect_text_blocks(soup))
+        return Page(list(soup.body.contents) if soup.body else [])
+
+    def cover_page(self) -> Optional[Page]:
+        """html before the first page break, only this part of filing is read"""
+        if not self.page_break_type:
+            return None
+        number, html, _ = next(self.segments())
+        return self._parse_page(number, html)
+
+    def pages(self, max_page_breaks: int = None) -> Iterator[Page]:
+        """pages between every pair of page breaks, parsed one at a time.
+        only first `max_page_breaks` page breaks are used if given"""
+        if not self.page_break_type:
+            return
+        for number, html, page_break in self.segments():
+            if number == 0:
+                continue
+            if not page_break or (max_page_breaks is not None and number >= max_page_breaks):
+                break
+            yield self._parse_page(number, html)
+
+    def text_blocks(self) -> List[str]:
+        """text of every paragraph outside tables, or of every
+        span if the filing has no paragraphs outside tables"""
+        paragraphs, spans = [], []
+        for number, html, _ in self.segments():
+            if number in self._text_blocks:
+                page_paragraphs, page_spans = self._text_blocks.pop(number)
+            else:
+                page_paragraphs, page_spans = collect_text_blocks(BeautifulSoup(html, "lxml"))
+            paragraphs.extend(page_paragraphs)
+            # spans are used only if whole filing has no paragraphs
+            if paragraphs:
+                spans = []
+            else:
+                spans.extend(page_spans)
+        return paragraphs or spans
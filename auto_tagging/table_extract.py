@@ -0,0 +1,208 @@
+"""
+Title:
+    Statement Table Extractor
+
+Description:
+    Reads a statement html table in a single walk over its <tr>/<td> tags,
+    and builds the same dataframe that pd.read_html & the pandas cleaning
+    functions in table_utils.py(get_table .. clean_duplicate_columns) build,
+    on plain python lists instead of a chain of DataFrame operations.
+
+Takeaways:
+    - cell texts & colspans are read the way pd.read_html reads them, and typed
+      with the same TextParser, so numbers, nan values and thousands "," match.
+    - every cleaning step keeps the quirks of the pandas function it replaces,
+      ex: "$", ")" removed only from text cells, columns merged by their max
+      when one column name is part of another.
+    - tables with <th>, <thead>, <tfoot>, rowspan, nested tables or hidden cells,
+      and tables too small to have a header & body return None. table_utils
+      uses pd.read_html & pandas functions for them.
+"""
+
+import re
+import math
+import logging
+
+import numpy as np
+import pandas as pd
+
+from typing import List, Optional
+from bs4 import NavigableString
+from bs4.element import PreformattedString
+from pandas.api.types import infer_dtype
+from pandas.io.parsers import TextParser
+
+logger = logging.getLogger(__name__)
+
+## same white space cleaning as pd.read_html
+WHITESPACE_PATTERN = re.compile(r"[\r\n]+|\s{2,}")
+## get_table: "$", "," & ")" removed, "(" to "-"
+NUMBER_CLEANUP = str.maketrans({"$": None, ",": None, ")": None, "(": "-"})
+## tags pd.read_html reads differently than a plain <tr>/<td> table
+UNSUPPORTED_TAGS = {"table", "thead", "tfoot", "th"}
+## inferred types pandas .str accessor works on
+STRING_TYPES = {"string", "empty", "bytes", "mixed", "mixed-integer"}
+
+
+def is_nan(value) -> bool:
+    return isinstance(value, float) and value != value
+
+
+def is_hidden(tag) -> bool:
+    return "display:none" in tag.get("style", "").replace(" ", "")
+
+
+def cell_text(td) -> str:
+    """text of a cell like lxml text_content(), with <br> as new line"""
+    parts = []
+    for element in td.descendants:
+        if isinstance(element, NavigableString):
+            # comments are not text
+            if not isinstance(element, PreformattedString):
+                parts.append(element)
+        elif element.name == "br":
+            parts.append("\n")
+    return WHITESPACE_PATTERN.sub(" ", "".join(parts).strip())
+
+
+def read_table_rows(html_table) -> Optional[List[List[str]]]:
+    """cell texts of every row, each cell repeated colspan times and rows
+    filled with "" to same length. None if pd.read_html reads it differently"""
+    if is_hidden(html_table):
+        return None
+    for tag in html_table.find_all(True):
+        if tag.name in UNSUPPORTED_TAGS or is_hidden(tag):
+            return None
+
+    # rows in <tbody> and rows directly in <table>
+    table_rows = [tr for tbody in html_table.find_all("tbody") for tr in tbody.find_all("tr")]
+    table_rows += html_table.find_all("tr", recursive=False)
+
+    rows = []
+    for table_row in table_rows:
+        row = []
+        for td in table_row.find_all("td", recursive=False):
+            colspan = td.get("colspan") or "1"
+            rowspan = td.get("rowspan") or "1"
+            if not (colspan.isascii() and colspan.isdigit()) or rowspan != "1":
+                return None
+            row.extend([cell_text(td)] * int(colspan))
+        rows.append(row)
+
+    # pd.read_html takes a first row without cells as header
+    if not rows or not rows[0] or not any(text for row in rows for text in row):
+        return None
+    width = max(len(row) for row in rows)
+    return [row + [""] * (width - len(row)) for row in rows]
+
+
+def rows_to_dataframe(rows: List[List[str]]) -> pd.DataFrame:
+    """table rows as dataframe, same as pd.read_html(table)[0]"""
+    return TextParser(rows, header=None, skiprows=0, thousands=",").read()
+
+
+def row_max(values: list):
+    """max of text values in a row like DataFrame.max(axis=1)"""
+    if all(is_nan(value) for value in values):
+        return math.nan
+    if any(is_nan(value) for value in values):
+        # nan is compared as -inf
+        raise TypeError("'>' not supported between instances of 'float' and 'str'")
+    return max(values)
+
+
+def _frame(columns: List[list], labels: pd.Index, index: pd.Index) -> pd.DataFrame:
+    values = np.array(columns, dtype=object).T.reshape(len(index), len(labels))
+    return pd.DataFrame(values, columns=labels, index=index)
+
+
+def build_statement_table(table_df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """statement table of a table read by rows_to_dataframe, same as
+    table_utils.clean_statement_table. None for tables without enough
+    rows & columns, they are left to clean_statement_table"""
+    # get_table: clean text cells, drop empty columns & rows
+    columns = []
+    for column in table_df.columns:
+        values = table_df[column].tolist()
+        if table_df[column].dtype == object:
+            values = [
+                value.translate(NUMBER_CLEANUP) or math.nan if isinstance(value, str) else value
+                for value in values
+            ]
+        if not all(is_nan(value) for value in values):
+            columns.append(values)
+    if not columns:
+        return None
+
+    row_indexes = [i for i in range(len(columns[0])) if not all(is_nan(values[i]) for values in columns)]
+    if len(row_indexes) < 2:
+        return None
+    columns = [[values[i] for i in row_indexes] for values in columns]
+    # columns with only first row filled
+    columns = [values for values in columns if not all(is_nan(value) for value in values[1:])]
+    if not columns:
+        return None
+    columns = [["" if is_nan(value) else value for value in values] for values in columns]
+
+    # get_column_df: rows above first text in first column are header
+    target_row = 0
+    for row_index, value in enumerate(columns[0]):
+        if value != "":
+            target_row = row_index
+            break
+    target_row += 1
+    header = [" ".join(values[:target_row]) or math.nan for values in columns]
+    body = [values[target_row:] for values in columns]
+    if not body[0]:
+        return None
+
+    # merge_df & drop_empty_cols
+    if not all(is_nan(value) for value in header):
+        body = [[name] + values for name, values in zip(header, body)]
+    dropped = [i for i, values in enumerate(body) if sum(len(str(value)) > 1 for value in values) in (1, 2)]
+    labels = pd.RangeIndex(len(body)).delete(dropped)
+    body = [values for i, values in enumerate(body) if i not in dropped]
+    if not body or len(body[0]) < 2:
+        return None
+
+    # create_header fails when a column has no text
+    if any(infer_dtype(np.array(values[1:], dtype=object), skipna=True) not in STRING_TYPES for values in body):
+        return _frame(body, labels, pd.RangeIndex(len(body[0])))
+
+    names = [values[0] for values in body]
+    if not isinstance(names[0], str):
+        return None
+    body = [[value.replace("-", "") if isinstance(value, str) else math.nan for value in values[1:]] for values in body]
+    body = [["" if value == "—" else value for value in values] for values in body]
+    names = ["index" if name == names[0] else name for name in names]
+    n_rows = len(body[0])
+
+    # clean_duplicate_columns: drop columns with same values
+    seen, columns, labels = set(), [], []
+    for name, values in zip(names, body):
+        key = tuple(None if is_nan(value) else value for value in values)
+        if key not in seen:
+            seen.add(key)
+            columns.append(values)
+            labels.append(name)
+
+    try:
+        # merge columns whose name has another column name in it
+        for column in list(labels):
+            same_columns = [label for label in labels if column in label]
+            if len(same_columns) > 1:
+                selected = [values for label, values in zip(labels, columns) if label in same_columns]
+                max_values = [row_max(row) for row in zip(*selected)]
+                columns = [values for label, values in zip(labels, columns) if label not in same_columns]
+                labels = [label for label in labels if label not in same_columns]
+                columns.append(max_values)
+                labels.append(column)
+    except TypeError:
+        # first 2 rows as header
+        try:
+            new_header = [" ".join(values[:2]) for values in columns]
+        except TypeError:
+            return _frame(body, pd.Index(names, dtype=object, name=0), pd.RangeIndex(1, n_rows + 1))
+        return _frame([values[2:] for values in columns], pd.Index(new_header, dtype=object),
+                      pd.RangeIndex(max(n_rows - 2, 0)))
+    return _frame(columns, pd.Index(labels, dtype=object, name=0), pd.RangeIndex(1, n_rows + 1))
@@ -1,220 +1,128 @@
 """
 Title: 
-    Table Pretrained Model class
+    Table Model inference
 
 Description:
-    This file has the Pretrained model class used in training time.
+    This file loads the trained Table model checkpoint and predicts table tags.
 
 Takeaways:
-    - Since this is pytorch_lightning, we need the same class to test/predict.
-    - Can modify it to Huggingface structure to future scope.
+    - Model was trained with pytorch_lightning class in table_training.py.
+    - Only the finbert weights of the checkpoint are needed to predict, so
+      lightning/torchmetrics are not imported here.
+    - Trained checkpoint is loaded once per process through registry.py
 
 Author: purnasai@soulpage
 Date: 10-10-2023
 """
 
 import torch
-import pandas as pd
-import lightning.pytorch as pl
+import logging
+import numpy as np
 from ast import literal_eval
+from functools import lru_cache
 
 from typing import List, Dict, Tuple
-from .utils import System, FileManager
-from torchmetrics.classification import F1Score
-from torchmetrics import ConfusionMatrix, Precision
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from .utils import System, FileManager, get_config
+from .cache import cached_predict
+from .registry import model_registry
 
-import logging
 logger = logging.getLogger(__name__)
 
 SEED= 33
 System().set_seed(SEED)
 device = System().get_device_to_compute()
 
-CONFIG_PATH = "config.yaml"
-yaml_obj = FileManager().load_yaml(CONFIG_PATH)
-
-## list of table tags/labels we used at train time in the proper order
-data = FileManager().read_text_file(yaml_obj["LABLES"]["Filepath"])
-labels: List[str] = literal_eval(data)
-
-print("Predefined Table labels:", len(labels))
-label2id: Dict = {lable: idx for idx, lable in enumerate(labels)}
-id2label: Dict = {index: label for label, index in label2id.items()}
-
-
-class NameMappingModel(pl.LightningModule):
-    """Class for ML model realted to Tables,
-    this is a pytorch lightning class. this needs
-    forward, training_step, validation_step and test_step
-    functions.
-
-    This is the exact class used for training as well. same class is
-    initiated once again to load trained model."""
-
-    def __init__(self, labels, label2id, id2label):
-        super().__init__()
-        self.all_test_labels = []
-        self.all_test_preds = []
-        self.labels = labels
-        self.finbert = AutoModelForSequenceClassification.from_pretrained(
-            yaml_obj["IXBRL_MODELS"]["Tokenizer"],
-            num_labels=len(labels),
-            # problem_type="multi_class_classification",
-            label2id=label2id,
-            id2label=id2label,
-            ignore_mismatched_sizes=True,
-        )
-        self.f1 = F1Score(task="multiclass", num_classes=len(labels))
-        self.Conf_matrix = ConfusionMatrix(task="multiclass", num_classes=len(labels))
-        self.macro_precision = Precision(
-            task="multiclass", average="macro", num_classes=len(labels)
-        )
-        self.micro_precision = Precision(
-            task="multiclass", average="micro", num_classes=len(labels)
-        )
-        # precion-recall curve for multiclass doesn't plot well in the figure, so avoiding it.
-
-    def forward(self, x, y):
-        output = self.finbert(**x, labels=y)
-        return output
-
-    def training_step(self, batch, batch_idx):
-        data, labels = batch
-        # outputs = self.finbert(**data, labels = labels)
-        outputs = self.forward(x=data, y=labels)
-        loss = outputs.loss
-        logits = outputs.logits
-        preds = torch.argmax(logits, dim=1)
-        train_f1_score = self.f1(preds, labels)
-        train_macro_precision = self.macro_precision(preds, labels)
-        train_micro_precision = self.micro_precision(preds, labels)
-
-        self.log("train_loss", loss, on_step=True, on_epoch=True, prog_bar=True)
-        self.log("train_f1", train_f1_score)
-        self.log("train_macro_precision", train_macro_precision)
-        self.log("train_micro_precision", train_micro_precision)
-        return loss
-
-    def validation_step(self, batch, batch_idx):
-        data, labels = batch
-        # outputs = self.finbert(**data, labels = labels)
-        outputs = self.forward(x=data, y=labels)
-        loss = outputs.loss
-        logits = outputs.logits
-        preds = torch.argmax(logits, dim=1)
-        val_f1_score = self.f1(preds, labels)
-        val_macro_precision = self.macro_precision(preds, labels)
-        val_micro_precision = self.micro_precision(preds, labels)
-
-        self.log("val_loss", loss, on_step=True, on_epoch=True, prog_bar=True)
-        self.log("val_f1", val_f1_score)
-        self.log("val_macro_precision", val_macro_precision)
-        self.log("val_micro_precision", val_micro_precision)
-        return loss
-
-    def test_step(self, batch, batch_idx):
-        data, labels = batch
-        # outputs = self.finbert(**data, labels = labels)
-        outputs = self.forward(x=data, y=labels)
-        loss = outputs.loss
-        logits = outputs.logits
-        preds = torch.argmax(logits, dim=1)
-
-        self.all_test_labels.append(labels)
-        self.all_test_preds.append(preds)
-
-        test_f1_score = self.f1(preds, labels)
-
-        test_macro_precision = self.macro_precision(preds, labels)
-        test_micro_precision = self.micro_precision(preds, labels)
-
-        self.log("test_loss", loss, on_step=True, on_epoch=True, prog_bar=True)
-        self.log("test_f1", test_f1_score)
-        self.log("test_macro_precision", test_macro_precision)
-        self.log("test_micro_precision", test_micro_precision)
-        return loss
-
-    def on_test_epoch_end(self):
-        labels = torch.cat(self.all_test_labels)
-        preds = torch.cat(self.all_test_preds)
-
-        test_final_f1_score = self.f1(preds, labels)
-        self.log("test_final_f1_score:", test_final_f1_score)
-
-        conf_mat = self.Conf_matrix(preds, labels)
-        computed_confusion = conf_mat.detach().cpu().numpy().astype(int)
-        df_cm = pd.DataFrame(computed_confusion, index=self.labels, columns=self.labels)
-        df_cm.to_excel("confusion_matrix.xlsx")
-
-    def predict_step(self, batch, batch_idx):
-        # this is acting same as test_step in our case
-        # we dont need this anymore
-        data, label = batch
-        outputs = self.forward(x=data, y=label)
-        logits = outputs.logits
-        predicted_labels = torch.argmax(logits, dim=1)
-        result = [id2label[pred_label.item()] for pred_label in predicted_labels]
-        return result
-
-    def configure_optimizers(self):
-        return torch.optim.AdamW(self.parameters(), lr=1e-5)
-
-
-modeleval = NameMappingModel.load_from_checkpoint(
-    checkpoint_path="Models1/Table_Inline_Model/SECtag_RarelabelModel-epoch=39-val_loss=0.26.ckpt",
-    labels=labels,
-    label2id=label2id,
-    id2label=id2label,
-    map_location=device,
-    strict=False,
-)
-
-# disable dropout, etc... with eval mode
-modeleval = modeleval.eval()
-modeleval = modeleval.to(device)
-tokenizer = AutoTokenizer.from_pretrained(
-    "soleimanian/financial-roberta-large-sentiment"
-)
-
-
-def predict_table_tags(data) -> Tuple[List, List]:
-    """function to predict table tags"""
+## prefix of the finbert weights in pytorch lightning checkpoint
+CHECKPOINT_PREFIX = "finbert."
+
+
+@lru_cache(maxsize=None)
+def load_table_labels() -> Tuple[List[str], Dict, Dict]:
+    """list of table tags/labels we used at train time in the proper order"""
+    data = FileManager().read_text_file(get_config()["LABLES"]["Filepath"])
+    labels: List[str] = literal_eval(data)
+
+    logger.info(f"Predefined Table labels: {len(labels)}")
+    label2id: Dict = {lable: idx for idx, lable in enumerate(labels)}
+    id2label: Dict = {index: label for label, index in label2id.items()}
+    return labels, label2id, id2label
+
+
+def build_table_model():
+    """finbert sequence classifier with table labels, without trained weights"""
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+
+    labels, label2id, id2label = load_table_labels()
+    model_config = AutoConfig.from_pretrained(
+        get_config()["IXBRL_MODELS"]["Tokenizer"],
+        num_labels=len(labels),
+        label2id=label2id,
+        id2label=id2label,
+    )
+    return AutoModelForSequenceClassification.from_config(model_config)
+
+
+def load_table_model(checkpoint_path: str):
+    """Builds finbert sequence classifier from config and loads only
+    its weights from pytorch lightning checkpoint, i.e same as
+    NameMappingModel.load_from_checkpoint(...).finbert"""
+    model = build_table_model()
+
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    state_dict = {
+        key[len(CHECKPOINT_PREFIX):]: value
+        for key, value in checkpoint["state_dict"].items()
+        if key.startswith(CHECKPOINT_PREFIX)
+    }
+    missing_keys, _ = model.load_state_dict(state_dict, strict=False)
+    if missing_keys:
+        logger.warning(f"Table model weights missing in checkpoint: {missing_keys}")
+
+    # disable dropout, etc... with eval mode
+    model = model.eval()
+    return model.to(device)
+
+
+def predict_table_tags(data, batch_size: int = None, backend=None) -> Tuple[List, List]:
+    """function to predict table tags, inference only.
+    All rows are tokenized together & passed to the finbert head
+    `batch_size` rows at a time without labels, so no loss is computed.
+    finbert runs with the backend chosen in config.yaml unless `backend` given"""
     
     logger.info("2.4. Predicting table tags......")
+    batch_size = batch_size or get_config()["INFERENCE"]["Table_Batch_Size"]
+    _, _, id2label = load_table_labels()
     texts = []
-    predicted_labels = []
-    
-    # predict with the model
-    with torch.no_grad():
-        for table_data in data:
-            for row in table_data:
-                text, tag = row.split("==")
-                inputs = tokenizer(
-                    text,
-                    padding="max_length",
-                    truncation=True,
-                    max_length=32,
-                    return_tensors="pt",
-                )
-
-                # random tag just to pass to model to match with syntax
-                tag = "us-gaap:StockholdersEquity"
-                y = label2id[tag]
-                y = torch.tensor(y).squeeze()
-                y = y.to(device)
-
-                for key in inputs:
-                    inputs[key] = inputs[key].to(device)
-
-                outputs = modeleval(inputs, y)
-                logits = outputs.logits
-                preds = torch.argmax(logits, dim=1)
-
-                # truelabels = [id2label[label.item()] for label in labels]
-                predlabels = [id2label[label.item()] for label in preds][0]
-
-                texts.append(text)
-                predicted_labels.append(predlabels)
+    for table_data in data:
+        for row in table_data:
+            text, _ = row.split("==")
+            texts.append(text)
+
+    # loaded once per process, shared by all jobs. torch or onnx backend
+    backend = backend or model_registry.get("table_backend")
+    tokenizer = model_registry.get("table_tokenizer")
+
+    # position in the array is the label id, same as id2label
+    id2label_array = np.array([id2label[index] for index in range(len(id2label))])
+
+    def predict(batch_texts: List[str]) -> List[str]:
+        predicted_ids = []
+        for start in range(0, len(batch_texts), batch_size):
+            inputs = tokenizer(
+                batch_texts[start:start + batch_size],
+                padding="longest",
+                truncation=True,
+                max_length=32,
+                return_tensors="np",
+            )
+            logits = backend.logits(inputs["input_ids"], inputs["attention_mask"])
+            predicted_ids.append(np.argmax(logits, axis=1))
+
+        if not predicted_ids:
+            return []
+        return id2label_array[np.concatenate(predicted_ids)].tolist()
+
+    # repeated line items are predicted once, see cache.py
+    predicted_labels = cached_predict(backend.model_id, texts, predict)
 
     return texts, predicted_labels
@@ -10,6 +10,9 @@ Takeaways:
     - one should run these functionalities alone in jupyter notebook with debug statements for better understanding.
     - remove empty columns, cleaning existing columns, remvoing double span column names.
     - stripping "," from values to normalize them.
+    - statement tables are passed between functions as in-memory TableRecords,
+      they are written to disk only as a debug dump(TABLES.Debug_Dump_Dir in config.yaml).
+    - html tables are read by table_extract.py, pd.read_html is used only for tables it doesn't support.
 
 Author: purnasai@soulpage
 Date: 10-10-2023
@@ -18,7 +21,6 @@ Date: 10-10-2023
 
 import os
 import re
-import nltk
 import shutil
 import warnings
 import logging
@@ -26,10 +28,13 @@ import logging
 import pandas as pd
 import numpy as np
 
-from bs4 import BeautifulSoup, Comment
-from .utils import HtmlContent, FileManager, get_text_outside_table
+from typing import List, Optional
+from pandas.api.types import is_bool, is_float, is_integer, is_scalar
+from pandas.io.parsers import TextParser
+from .utils import FileManager
+from .document import FilingDocument
+from .table_extract import build_statement_table, read_table_rows, rows_to_dataframe
 
-nltk.download("punkt")
 warnings.filterwarnings("ignore")
 logger = logging.getLogger(__name__)
 
@@ -187,9 +192,9 @@ def clean_duplicate_columns(final_df):
     return final_df
 
 
-def get_excel_statements_tables(html_table):
-    """function that combines all above functionalities"""
-    tables = pd.read_html(str(html_table))
+def clean_statement_table(tables):
+    """cleans the first table read by pd.read_html
+    in to statement table, with all above functionalities"""
     financial_statements = get_table(tables)
     column_df, target_row = get_column_df(financial_statements)
 
@@ -208,6 +213,21 @@ def get_excel_statements_tables(html_table):
     return final_df
 
 
+def get_excel_statements_tables(html_table):
+    """Statement table of a html table. read & cleaned in a single walk by
+    table_extract.py, tables it doesn't support are read with pd.read_html
+    and cleaned by clean_statement_table, both give same table."""
+    rows = read_table_rows(html_table)
+    if rows is None:
+        return clean_statement_table(pd.read_html(str(html_table)))
+
+    table_df = rows_to_dataframe(rows)
+    final_df = build_statement_table(table_df)
+    if final_df is None:
+        final_df = clean_statement_table([table_df])
+    return final_df
+
+
 def get_rows_in_table(html_table):
     total_rows = []
 
@@ -298,64 +318,45 @@ def align_context_and_columns_to_data(text, dataframe, statement_name):
     dataframe: dataframe here is actual table in html filing retaining 0's, space's.
 
     statement_name: is the Name of Table in html filing.
+
+    every cell is converted & looked up in a set of all tagged values once,
+    so it takes linear time in table size.
     """
     statement_name = statement_name.lower()
+
+    # all table values with tags in text, as a set for lookups
+    entire_table_vals = {val for text_row in text for tag_item in text_row[1] for val in tag_item}
+
+    # we have float values in Dataframe after reading as dataframe
+    # trying to convert every cell into integer, so we get table values
+    # from float to int converted. each distinct value is converted once.
+    converted = {}
+    values = []
+    for row in dataframe.to_numpy(dtype=object).tolist():
+        row_values = []
+        for val in row:
+            key = (type(val), val)
+            if key not in converted:
+                converted[key] = str(convert_float_to_int(val))
+            row_values.append(converted[key])
+        values.append(row_values)
+
+    us_gaap_tag = "Others"
+    column_names = list(dataframe.columns)
     total_df_context_rows = []
     total_table_columns = []
-
-    entire_table_vals = []
-    for text_row in text:
-        # get all table values in to a list
-        tags = text_row[1]
-        vals = [val for tag_item in tags for val, tag in tag_item.items()]
-        entire_table_vals.extend(vals)
-
-    for df_row_index in range(dataframe.shape[0]):
-        # loop to iterate over row in DataFrame
-
-        # we have float values in Dataframe after reading as dataframe
-        # trying to convert every cell into integer, so we get table values
-        # from float to int converted.
-        df_row_text = " ".join(
-            [
-                str(convert_float_to_int(val))
-                for val in dataframe.iloc[df_row_index].values
-            ]
-        )
-        df_row_text = re.sub(r"[,():\-]", "", df_row_text)
-        df_row_text = " ".join(df_row_text.split())
-        
-        logger.info(f"df text: {df_row_text}")
-        match_record = dataframe.iloc[df_row_index]
-        # retrieve the entire row
-
-        columns = []
-        contexts = []
+    for row_values in values:
+        logger.info(f"df text: {' '.join(row_values)}")
         context = " "
-        for column_name, value in match_record.items():
-            value = str(convert_float_to_int(value))
-
+        for column_name, value in zip(column_names, row_values):
             if value not in entire_table_vals:
                 # if the value has no tag, then it must be context
                 context = value
-            else:  # tags.get(value) != None:
-                us_gaap_tag = "Others"
-                context1 = (
-                    context
-                    + " "
-                    + column_name
-                    + " "
-                    + value
-                    + "=="
-                    + us_gaap_tag
+            else:
+                total_df_context_rows.append(
+                    context + " " + column_name + " " + value + "==" + us_gaap_tag
                 )
-                if context1:
-                    contexts.append(context1)
-                    columns.append(column_name)
-
-        if contexts and columns:
-            total_df_context_rows.extend(contexts)
-            total_table_columns.extend(columns)
+                total_table_columns.append(column_name)
 
     total_df_context_rows = [
         " ".join([statement_name, row]) for row in total_df_context_rows
@@ -363,240 +364,188 @@ def align_context_and_columns_to_data(text, dataframe, statement_name):
     return total_df_context_rows, total_table_columns
 
 
-def save_html_statements_tables(html_data, save_path, type="10-Q"):
-    """This function Detects Those statements table we want,
-    and process them, saves them to the folder 'save_path'.
-    """
-    # create folder if not exists
-    if os.path.exists(save_path):
-        shutil.rmtree(save_path)
+## characters openpyxl can't write to an Excel sheet
+ILLEGAL_EXCEL_CHARACTERS = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+EXCEL_ERROR_CODES = ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+
+
+def excel_cell_value(value):
+    """value of a dataframe cell as it used to be read back from the
+    statement xlsx file, after `to_excel` with openpyxl & `pd.read_excel`"""
+    if is_scalar(value) and pd.isna(value):
+        return ""
+    if is_float(value) and np.isinf(value):
+        value = "inf" if value > 0 else "-inf"
+    if is_integer(value):
+        return int(value)
+    if is_float(value):
+        # whole numbers are read back as int
+        value = float(value)
+        return int(value) if value.is_integer() else value
+    if is_bool(value):
+        return bool(value)
+
+    value = str(value)[:32767]
+    if ILLEGAL_EXCEL_CHARACTERS.search(value):
+        raise ValueError(f"{value} cannot be used in worksheets.")
+    if len(value) > 1 and value.startswith("="):
+        # saved as a formula, read back without value
+        return ""
+    if value in EXCEL_ERROR_CODES:
+        return np.nan
+    return value
+
+
+def excel_round_trip(final_df):
+    """dataframe as `pd.read_excel` read it from the xlsx file `final_df`
+    was saved to, without writing the file. the sheet rows go through the
+    same TextParser as read_excel, so nan values, dtypes & column names
+    ("Unnamed: 1", "Total.1") are the same."""
+    sheet = [[excel_cell_value(value) for value in final_df.columns]]
+    sheet.extend(
+        [excel_cell_value(value) for value in row]
+        for row in final_df.itertuples(index=False, name=None)
+    )
 
-    os.makedirs(save_path)
+    # trailing empty cells & rows are not in the sheet
+    data = []
+    for row in sheet:
+        while row and row[-1] == "":
+            row.pop()
+        data.append(row)
+    while data and not data[-1]:
+        data.pop()
+    if not data:
+        return pd.DataFrame()
+
+    max_width = max(len(row) for row in data)
+    data = [row + [""] * (max_width - len(row)) for row in data]
+    dataframe = TextParser(data, header=0, skip_blank_lines=False).read()
+    return dataframe.replace(np.nan, "", regex=True)
+
+
+class TableRecord:
+    """A detected statement table, with its Excel like dataframe
+    and rows with tags, passed in memory to arrange_rows_with_context."""
+
+    def __init__(self, file_name: str, html_table, dataframe: pd.DataFrame, rows_and_tags: List[list]) -> None:
+        # ex: page_comment_CONDENSED CONSOLIDATED BALANCE SHEETS_0
+        self.file_name = file_name
+        self.html_table = html_table
+        self.dataframe = dataframe
+        self.rows_and_tags = rows_and_tags
+
+    def __repr__(self) -> str:
+        return f"TableRecord({self.file_name!r}, shape={self.dataframe.shape}, rows={len(self.rows_and_tags)})"
+
+    def save(self, save_path: str):
+        """debug dump of the table as html, xlsx & txt files, xlsx
+        has the dataframe as arrange_rows_with_context reads it"""
+        html_file_path = os.path.join(save_path, f"{self.file_name}.html")
+        FileManager().save_html_file(html_file_path, self.html_table)
+        self.dataframe.to_excel(html_file_path.replace(".html", ".xlsx"), index=False)
+        save_rows_and_tags(self.rows_and_tags, html_file_path.replace(".html", ".txt"))
+        logger.info(f"{self.file_name} html, xlsx & txt files saved to {save_path}")
+
+
+def get_statement_table(html_table, file_name: str) -> Optional[TableRecord]:
+    """TableRecord of a html table, None if it couldn't be processed"""
+    try:
+        final_df = get_excel_statements_tables(html_table)
+        dataframe = excel_round_trip(final_df)
+
+        rows_only = get_rows_in_table(html_table)
+        rows_and_tags = clean_rows_and_tags(rows_only)
+    except Exception:
+        logger.info(f"Couldn't process {file_name} table... Please check")
+        return None
+    return TableRecord(file_name, html_table, dataframe, rows_and_tags)
 
+
+def get_statement_tables(document: FilingDocument, type="10-Q", debug_path: str = None) -> List[TableRecord]:
+    """This function Detects Those statements table we want,
+    and process them in to TableRecords, in the order they are in filing.
+    `document` is FilingDocument or FilingStream. tables are also saved to
+    the folder `debug_path` if given.
+    """
+    table_records = []
     table_indx = 0
-    soup = BeautifulSoup(html_data, "lxml")
 
     """idea is to split the Entire HTML in to pages using 
     Comments and page-header tags, since parsing through 
     entire html makes it complex"""
-    # Find all <!-- Field: Page; Sequence> tags
-    comments = soup.find_all(
-        string=lambda text: isinstance(text, Comment) and "Field: Page;" in text
-    )
-
-    # split html page by comments
-    if comments:
+    if document.page_break_type == "comment":
         logger.info("2.1 Comment tags found...")
+        file_prefix = "page_comment"
+    elif document.page_break_type == "hr":
+        # looking for page-break if not comments found
+        logger.info("2.1 Header tags found...")
+        file_prefix = "page_headertag"
+    else:
+        return table_records
 
-        if type == "10-K":
-            logger.info("2.1.0. 10-K FILE, Using all Comments splits...")
-            comments = comments[:]
-        else:
-            logger.info("2.1.1. 10-Q FILE, Using Only First 15 Comments splits...")
-            comments = comments[:15]
-        
-        # Get the content between each pair of comments
-        for i in range(
-            len(comments) - 1
-        ):  # looks only in the first 15 pages, since 10q
-            start_comment = comments[i]
-            end_comment = comments[i + 1]
-
-            # get the contents in a page
-            content_between_comments = HtmlContent().extract_between_comments(
-                start_comment, end_comment
-            )
-
-            # get all tables in an html
-            html_tables = BeautifulSoup(content_between_comments, "lxml").find_all(
-                "table"
-            )
-
-            # if tables found, get their headings
-            if html_tables:
-                text_outside_tables,_  = get_text_outside_table(content_between_comments)
-                table_name = parse_text(text_outside_tables)
-                minimal_text = len(text_outside_tables)
-
-                # should have atleast some text and less than 500 characters
-                if minimal_text > 10 and minimal_text < 500:
-                    logger.info(f"Found {table_name} ......")
-
-                    # if table name is shareholders, then look for 2 tables & iterate,save. 
-                    if (
-                        table_name
-                        == "CONSOLIDATED STATEMENTS OF CHANGES IN SHAREHOLDERS’ EQUITY"
-                    ):
-                        for html_table in html_tables:
-                            # save that html table page as html file
-                            html_filename = (
-                                f"page_comment_{table_name}_{table_indx}.html"
-                            )
-                            html_file_path = os.path.join(save_path, html_filename)
-                            FileManager().save_html_file(html_file_path, html_table)
-                            logger.info(
-                                f"page_comment_{table_name}_{table_indx}.html is saved"
-                            )
-                            table_indx += 1
-
-                            try:
-                                # save the same html table to Excel sheet                            
-                                excel_file_path = html_file_path.replace(
-                                    ".html", ".xlsx"
-                                )
-                                final_df = get_excel_statements_tables(html_table)
-                                final_df.to_excel(excel_file_path, index=False)
-                                logger.info(f"{excel_file_path} is saved")
-
-                                # save the same html table to text file as well
-                                rows_only = get_rows_in_table(html_table)
-                                rows_and_tags = clean_rows_and_tags(rows_only)
-                                save_rows_and_tags(
-                                    rows_and_tags,
-                                    html_file_path.replace(".html", ".txt"),
-                                )
-                                logger.info("txt file saved too....")
-                            except Exception:
-                                logger.info("Couldn't Save TEXT and XLSX file... Please check")
-                                pass
-
-                    # if table name is other than shareholders
-                    elif table_name:
-                        html_filename = f"page_comment_{table_name}_{table_indx}.html"
-                        html_file_path = os.path.join(save_path, html_filename)
-                        # get only first table, as in most cases we will only have one table
-                        FileManager().save_html_file(html_file_path, html_tables[0])
-                        logger.info(
-                            f"page_comment_{table_name}_{table_indx}.html is saved"
-                        )
-                        table_indx += 1
-
-                        try:
-                            # save the same html table to Excel sheet
-                            excel_file_path = html_file_path.replace(".html", ".xlsx")
-                            final_df = get_excel_statements_tables(html_tables[0])
-                            final_df.to_excel(excel_file_path, index=False)
-                            logger.info(f"{excel_file_path} file saved")
-
-                            # save the same html table to text file as well
-                            rows_only = get_rows_in_table(html_tables[0])
-                            rows_and_tags = clean_rows_and_tags(rows_only)
-                            save_rows_and_tags(
-                                rows_and_tags, html_file_path.replace(".html", ".txt")
-                            )
-                            logger.info("txt file saved too")
-                        except Exception:
-                            logger.info("Couldn't Save TEXT and XLSX file... Please check")
-                            pass
-
-    # looking for page-break if not comments found     
+    if type == "10-K":
+        logger.info("2.1.0. 10-K FILE, Using all page breaks...")
+        pages = document.pages()
     else:
-        # find all <hr style="page-break-after:always;"/>
-        # page_breaks_divss = soup.find_all('div')
-        page_break_tags = soup.find_all(re.compile("^hr"))
-        if page_break_tags:
-            logger.info("2.1 Header tags found...")
-           
-            # get the content between each paif of page_break_tags
-            if type == "10-K":
-                logger.info("2.1.2. 10-K FILE, Using all page breaks...")
-                page_break_tags = page_break_tags[:]
-            else:
-                logger.info("2.1.3. 10-Q FILE, Using only First 15 Pages.....")
-                page_break_tags = page_break_tags[:15]
-            
-            # iterate through every page, look for tables
-            for i in range(len(page_break_tags) - 1):
-                start_page_break = page_break_tags[i]
-                end_page_break = page_break_tags[i + 1]
-
-                content_between_page_breaks = HtmlContent().extract_between_comments(
-                    start_page_break, end_page_break
-                )
-                html_tables = BeautifulSoup(content_between_page_breaks).find_all(
-                    "table"
-                )
+        logger.info("2.1.1. 10-Q FILE, Using Only First 15 page breaks...")
+        pages = document.pages(max_page_breaks=15)
+
+    # iterate through every page, look for tables
+    for page in pages:
+        # get all tables in a page
+        html_tables = page.tables
+
+        # if tables found, get their headings
+        if html_tables:
+            text_outside_tables = page.text_outside_tables()
+            table_name = parse_text(text_outside_tables)
+            minimal_text = len(text_outside_tables)
+
+            # should have atleast some text and less than 500 characters,
+            # pages split by header tags need no minimum text
+            if minimal_text < 500 and (minimal_text > 10 or document.page_break_type == "hr"):
+                logger.info(f"Found {table_name} ......")
+
+                # if table name is shareholders, then look for 2 tables & iterate. 
+                if (
+                    table_name
+                    == "CONSOLIDATED STATEMENTS OF CHANGES IN SHAREHOLDERS’ EQUITY"
+                ):
+                    statement_tables = html_tables
+                # if table name is other than shareholders,
+                # get only first table, as in most cases we will only have one table
+                elif table_name:
+                    statement_tables = html_tables[:1]
+                else:
+                    statement_tables = []
+
+                for html_table in statement_tables:
+                    table_record = get_statement_table(html_table, f"{file_prefix}_{table_name}_{table_indx}")
+                    if table_record is not None:
+                        table_records.append(table_record)
+                    table_indx += 1
+
+    if debug_path:
+        save_statement_tables(table_records, debug_path)
+    return table_records
+
+
+def save_statement_tables(table_records: List[TableRecord], save_path: str):
+    """saves every table record to folder 'save_path', for debugging"""
+    # create folder if not exists
+    if os.path.exists(save_path):
+        shutil.rmtree(save_path)
+
+    os.makedirs(save_path)
+    for table_record in table_records:
+        try:
+            table_record.save(save_path)
+        except Exception:
+            logger.info(f"Couldn't Save {table_record.file_name} files... Please check")
+
 
-                # if tables found, get their headings
-                if html_tables:
-                    text_outside_tables = get_text_outside_table(
-                        content_between_page_breaks
-                    )
-                    table_name = parse_text(text_outside_tables)
-
-                    minimal_text = len(text_outside_tables)
-                    # should have atleast some text and less than 500 characters
-                    if minimal_text < 500:
-                        logger.info(f"Found {table_name} ......")
-                        if (
-                            table_name
-                            == "CONSOLIDATED STATEMENTS OF CHANGES IN SHAREHOLDERS’ EQUITY"
-                        ):
-                            for html_table in html_tables:
-                                html_filename = (
-                                    f"page_headertag_{table_name}_{table_indx}.html"
-                                )
-                                html_file_path = os.path.join(save_path, html_filename)
-                                FileManager().save_html_file(html_file_path, html_table)
-                                logger.info(f"{html_filename} is saved")
-                                table_indx += 1
-
-                                try:
-                                    # save the same html table to Excel sheet
-                                    excel_file_path = html_file_path.replace(
-                                        ".html", ".xlsx"
-                                    )
-                                    final_df = get_excel_statements_tables(html_table)
-                                    final_df.to_excel(excel_file_path, index=False)
-                                    logger.info(f"{excel_file_path} file saved")
-
-                                    # save the same html table to text file as well
-                                    rows_only = get_rows_in_table(html_table)
-                                    rows_and_tags = clean_rows_and_tags(rows_only)
-                                    save_rows_and_tags(
-                                        rows_and_tags,
-                                        html_file_path.replace(".html", ".txt"),
-                                    )
-                                    logger.info("txt file saved too")
-                                except Exception:
-                                    logger.info("Couldn't Save TEXT and XLSX file... Please check")
-                                    pass
-
-                        # if table name is other than shareholders
-                        elif table_name:
-                            html_filename = (
-                                f"page_headertag_{table_name}_{table_indx}.html"
-                            )
-                            html_file_path = os.path.join(save_path, html_filename)
-                            # get only first table, as in most cases we will only have one table
-                            FileManager().save_html_file(html_file_path, html_tables[0])
-                            logger.info(f"{html_filename} is saved")
-                            table_indx += 1
-
-                            try:
-                                # save the same html table to Excel sheet
-                                excel_file_path = html_file_path.replace(
-                                    ".html", ".xlsx"
-                                )
-                                final_df = get_excel_statements_tables(html_tables[0])
-                                final_df.to_excel(excel_file_path, index=False)
-                                logger.info(f"{excel_file_path} file saved")
-
-                                # save the same html table to text file as well
-                                rows_only = get_rows_in_table(html_tables[0])
-                                rows_and_tags = clean_rows_and_tags(rows_only)
-                                save_rows_and_tags(
-                                    rows_and_tags,
-                                    html_file_path.replace(".html", ".txt"),
-                                )
-                                logger.info("txt file saved too...")
-                            except Exception:
-                                logger.info("Couldn't Save TEXT and XLSX file... Please check")
-                                pass
-                        print("\n")
-
-
-def arrange_rows_with_context(save_folder):
+def arrange_rows_with_context(table_records: List[TableRecord]):
     """this function process table rows such it adds
     the context+columnname+value in to a single row
     """
@@ -604,58 +553,33 @@ def arrange_rows_with_context(save_folder):
     all_tables_data = []
     all_tables_columns = []
     table_names = []
-    # iterate through all files
-    for path, folders, files in os.walk(save_folder):
-        if files:
-            for file in files:
-                if file.endswith(".html"):
-                    html_file_path = os.path.join(path, file)
-                    excel_file_path = html_file_path.replace(".html", ".xlsx")
-                    text_file_path = html_file_path.replace(".html", ".txt")
-
-                    if (
-                        os.path.exists(excel_file_path)
-                        and os.path.exists(html_file_path)
-                        and os.path.exists(text_file_path)
-                    ):
-                        if (
-                            os.path.getsize(excel_file_path)
-                            and os.path.getsize(html_file_path)
-                            and os.path.getsize(text_file_path)
-                        ):
-                            for statement_name in statement_names:
-                                if statement_name in html_file_path:
-                                    logger.info(
-                                        f"2.3 Processing: {statement_name}, in {html_file_path}"
-                                    )
-                                    dataframe = pd.read_excel(excel_file_path)
-                                    dataframe = dataframe.replace(
-                                        np.nan, "", regex=True
-                                    )
-
-                                    text = FileManager().read_text_file_lines(text_file_path)
-                                    logger.info(
-                                        f"2.3.1 printing text, dataframe and table names {text},{dataframe},{statement_name}"
-                                    )
-                                    data, columns = align_context_and_columns_to_data(
-                                        text, dataframe, statement_name
-                                    )
-                                    logger.info(
-                                        f"2.3.1.1 check data and columns {data}, {columns}")
-
-                                    all_tables_data.append(data)
-                                    table_names.extend(
-                                        [statement_name.lower()] * len(data)
-                                    )
-                                    all_tables_columns.extend(columns)
-                        else:
-                            logger.warning(
-                                f"Empty files found, No content found for {statement_name} in {save_folder}"
-                            )
-                    else:
-                        logger.warning(
-                            f"All 3 Excel, html, text files not generate in {save_folder}"
-                        )
-        else:
-            logger.warning(f"No File found in folder '{save_folder}'.")
-    return all_tables_data, all_tables_columns, table_names
\ No newline at end of file
+    if not table_records:
+        logger.warning("No statement tables found.")
+
+    for table_record in table_records:
+        if not table_record.rows_and_tags:
+            logger.warning(f"No content found for {table_record.file_name}")
+            continue
+
+        for statement_name in statement_names:
+            if statement_name in table_record.file_name:
+                logger.info(
+                    f"2.3 Processing: {statement_name}, in {table_record.file_name}"
+                )
+                dataframe = table_record.dataframe
+                text = table_record.rows_and_tags
+                logger.info(
+                    f"2.3.1 printing text, dataframe and table names {text},{dataframe},{statement_name}"
+                )
+                data, columns = align_context_and_columns_to_data(
+                    text, dataframe, statement_name
+                )
+                logger.info(
+                    f"2.3.1.1 check data and columns {data}, {columns}")
+
+                all_tables_data.append(data)
+                table_names.extend(
+                    [statement_name.lower()] * len(data)
+                )
+                all_tables_columns.extend(columns)
+    return all_tables_data, all_tables_columns, table_names
@@ -1,7 +1,4 @@
 import os
-import copy
-import nltk
-import shutil
 import logging
 import datetime
 
@@ -10,8 +7,8 @@ from .overwrite import OverwriteHtml
 
 # utility imports
 from .utils import (
-    FileManager,
-    HtmlContent,
+    get_config,
+    ensure_nltk_data,
     process_table_results,
     process_notes_results,
 )
@@ -23,18 +20,20 @@ from .dei_utils import (
     format_processed_result,
 )
 from .table_utils import (
-    save_html_statements_tables,
+    get_statement_tables,
     arrange_rows_with_context,
     clean_results,
 )
 from .notes_utils import get_NER_Data, clean_notes_outputs
+from .document import FilingDocument
+from .streaming import FilingStream
 
 # ml model imports
 from .modelling import Xbrl_Tag
+from .cache import ResultCache, file_sha256, get_prediction_cache, get_result_cache
+from .registry import model_registry
 from .table_modelling import predict_table_tags
 
-nltk.download("punkt")
-
 # get current date
 current_date = datetime.date.today()
 current_date = current_date.strftime("%d-%m-%Y")
@@ -49,25 +48,77 @@ logging.basicConfig(
 )
 
 overwritehtml = OverwriteHtml()
-def auto_tagging(html_file, html_type):
+
+# registry entries used to predict, loaded by warm up
+WARM_UP_MODELS = ["tokenizer", "table_tokenizer", "dei_backend", "notes_backend", "table_backend",
+                  "dei_aligner", "notes_aligner"]
+
+
+def warm_up():
+    """Loads nltk data & every model in the registry before the first job,
+    instead of at import time. returns load time & memory of each model."""
+    logging.info("Warming up: loading nltk data & models.......")
+    ensure_nltk_data()
+    for name in WARM_UP_MODELS:
+        model_registry.get(name)
+    return model_registry.stats()
+
+
+def result_cache_key(html_file, html_type, source_sha256=None):
+    """source html, html type, every model & settings that change tagged html"""
+    model_ids = [model_registry.get(name).model_id for name in ["dei_backend", "notes_backend", "table_backend"]]
+    model_ids.append(f"streaming={get_config()['STREAMING']['Enabled']}")
+    return ResultCache.make_key(source_sha256 or file_sha256(html_file), html_type, model_ids)
+
+
+def auto_tagging(html_file, html_type, source_sha256=None):
+    """tags html file & returns path of tagged html. `source_sha256` of
+    html file is used for result cache if given, else computed."""
+    # only warm_up downloads nltk data, jobs never go to network
+    missing_nltk_data = ensure_nltk_data(download=False)
+    if missing_nltk_data:
+        # checked again by next call, after warm_up downloaded it
+        ensure_nltk_data.cache_clear()
+        raise RuntimeError(f"nltk data {list(missing_nltk_data)} is missing in "
+                           f"{get_config()['NLTK']['Data_Dir']}, run warm_up first")
+    # models are shared by all jobs, loaded only by the first job
     xbrl_tag = Xbrl_Tag()
+    logging.info(f"Loaded models: {model_registry.stats()}")
     html_path = html_file
     parent_dir = os.path.dirname(html_path)
-    dest_path = os.path.join(parent_dir, "copied_html.html")
-    shutil.copy(html_path, dest_path)
     logging.info(f"0. FIle type received is {html_type}")
     logging.info(f"0.1. File:{html_file}")
+    dest_path = os.path.join(parent_dir, f"auto_tagging_{os.path.basename(html_file)}")
+
+    # same filing tagged before with same models
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        cache_key = result_cache_key(html_file, html_type, source_sha256)
+        tags = result_cache.get(cache_key, dest_path)
+        if tags is not None:
+            logging.info("0.2. Tagged HTML read from result cache, TOTAL TAGS:\n" + "\n".join(
+                f"{name} results length: {len(results)}" for name, results in tags.items()))
+            logging.shutdown()
+            return dest_path
+
+    streaming = get_config()["STREAMING"]["Enabled"]
+    if streaming:
+        # very large filings, pages are read & parsed one at a time
+        document = FilingStream(html_path)
+    else:
+        # filing is parsed only once, all below stages read from it
+        document = FilingDocument.from_file(html_path)
 
     ### 1.COVERPAGE
     logging.info("1. Processing Cover page...............")
-    total_rows = split_page_and_extract_text(html_path)
+    total_rows = split_page_and_extract_text(document)
 
     logging.info("1.1. Started predicting DEI tags.....")
     original_inputs, inputs, outputs = xbrl_tag.predict_dei_tags(total_rows)
-    inputs, outputs = remove_unpredicted_rows(inputs, outputs)
+    inputs, outputs, input_rows = remove_unpredicted_rows(inputs, outputs)
     logging.info("1.2. Started Post processing DEI Tags.....")
-    processed_result = post_process_tags(inputs, outputs)
-    coverapge_results = format_processed_result(processed_result, original_inputs)
+    processed_result, result_rows = post_process_tags(inputs, outputs, input_rows)
+    coverapge_results = format_processed_result(processed_result, original_inputs, result_rows)
     logging.info(f"Coverpage results Count:, {len(coverapge_results)}")
     logging.info("1.3. Completed DEI tags sucessfully")
     logging.info(f"{coverapge_results}")
@@ -78,14 +129,12 @@ def auto_tagging(html_file, html_type):
     file_name = os.path.basename(normalized_path)
     folder, _ = file_name.split(".")
 
-    # folder to save
-    save_folder = "Table_raw_results"
-    html_data = FileManager().read_html_file(html_path)
-    save_path = os.path.join(save_folder, folder)
+    # statement tables are saved to folder only for debugging
+    debug_folder = get_config()["TABLES"]["Debug_Dump_Dir"]
+    debug_path = os.path.join(debug_folder, folder) if debug_folder else None
 
-    # save statement tables to folder
-    save_html_statements_tables(html_data, save_path, html_type)
-    data, columns, table_names = arrange_rows_with_context(save_path)
+    table_records = get_statement_tables(document, html_type, debug_path)
+    data, columns, table_names = arrange_rows_with_context(table_records)
     logging.info(f"{data, columns, table_names}")
 
     inputs, outputs = predict_table_tags(data)
@@ -102,8 +151,7 @@ def auto_tagging(html_file, html_type):
     logging.info("3.0.Processing Entire HTML instead of NOTES Sections.")
     # TODO: Should only run Notes section instead of Entire HTML.
 
-    html_data: str = FileManager().read_html_file(html_path)
-    input_data: list = get_NER_Data(html_data)
+    input_data: list = get_NER_Data(document)
 
     logging.info("3.2. starting predicting Notes tags....")
     inputs, outputs = xbrl_tag.predict_notes_tags(input_data)
@@ -120,17 +168,22 @@ def auto_tagging(html_file, html_type):
     # #########Overwrite HTML file###########################
     # #######################################################
     logging.info("4. Overwriting HTML File with ML Model Results..")
-    coverapge, other_pages = HtmlContent().split_page(dest_path)
-    html_string, other_pages1 = copy.deepcopy(coverapge), copy.deepcopy(other_pages)
-
-    html_string = overwritehtml.modify_coverpage(html_string, coverapge_results)
-    other_pages2 = overwritehtml.modify_statement_tabels(other_pages1, table_outputs)
-    other_pages3 = overwritehtml.modify_notespages(other_pages2, Notes_outputs, table_output_values)
-
-    print(len(html_string), len(other_pages3))
-    final_result = html_string + other_pages3
-    print(len(final_result))
-    final_result = BeautifulSoup(final_result)
+    if streaming:
+        # tagged pages are written to file one by one
+        overwritehtml.modify_filing_stream(document, dest_path, coverapge_results,
+                                           table_outputs, Notes_outputs, table_output_values)
+    else:
+        html_string, other_pages = document.split_cover_page()
+
+        html_string = overwritehtml.modify_coverpage(html_string, coverapge_results)
+        other_pages2 = overwritehtml.modify_statement_tabels(other_pages, table_outputs)
+        other_pages3 = overwritehtml.modify_notespages(other_pages2, Notes_outputs, table_output_values)
+
+        final_result = html_string + other_pages3
+        final_result = BeautifulSoup(final_result)
+
+        with open(dest_path, "wb") as file:
+            file.write(final_result.encode("utf-8"))
     
     logging.info("4.3 Printing predicted Tags summary before SAVING HTML...")
     logging.info("TOTAL TAGS:\nCoverpage results length: {}\nTable results length: {}\nNotes results length: {}".format(
@@ -138,10 +191,12 @@ def auto_tagging(html_file, html_type):
                                                                         len(table_outputs),
                                                                         len(Notes_outputs),
                                                                         ))
+    if get_prediction_cache() is not None:
+        logging.info(f"Prediction cache: {get_prediction_cache().stats()}")
+    if result_cache is not None:
+        tags = {"Coverpage": coverapge_results, "Table": table_outputs, "Notes": Notes_outputs}
+        result_cache.put(cache_key, dest_path, tags)
 
-    dest_path = os.path.join(parent_dir, f"auto_tagging_{os.path.basename(html_file)}")
-    with open(dest_path, "wb") as file:
-        file.write(final_result.encode("utf-8"))
     logging.info("5. Finally FILE Saved")
     logging.shutdown()
     return dest_path
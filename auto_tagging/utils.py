@@ -3,7 +3,8 @@ Title:
     General Utils
 
 Description:
-    All the General util functions, file processing, html page splitting functions here.
+    All the General util functions, file processing, text processing functions here.
+    html page splitting is in document.py
 
 Takeaways:
     - currently as of date, search and replace technique is used to overwrite the html file.
@@ -14,8 +15,9 @@ Date: 10-10-2023
 """
 
 
+import os
 import re
-import bs4
+import sys
 import yaml
 import torch
 import random
@@ -23,8 +25,7 @@ import warnings
 import numpy as np
 
 from ast import literal_eval
-from bs4 import BeautifulSoup, Comment
-from typing import Tuple
+from functools import lru_cache
 
 warnings.filterwarnings("ignore")
 
@@ -34,6 +35,49 @@ with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=DeprecationWarning)
     from cleantext import clean
 
+CONFIG_PATH = "config.yaml"
+
+## nltk resources used in text processing: path inside nltk_data -> package name
+NLTK_RESOURCES = {
+    "tokenizers/punkt": "punkt",
+}
+
+## "\\" & "&" are decoded by cleantext(escapes, html entities), so not in here
+FAST_CLEAN_ASCII = r"\t\x20-\x25\x27-\x5b\x5d-\x7e"
+## common non ascii characters of filings: quotes, spaces, dashes & symbols.
+## what clean() makes of them depends on `unidecode` being installed, so
+## the table is built by cleaning each of them at import.
+FAST_CLEAN_CHARACTERS = (
+    "`\u2018\u2019\u201c\u201d\xa0\xad\xa7\xb0\xb6\xb7\u2002\u2003\u2009\u200b\ufeff"
+    "\u2010\u2011\u2013\u2014\u2022\u2026\u25a0\u25a1\u2610\u2612\u2713"
+)
+
+
+def build_fast_clean_table(characters):
+    """translate table of characters clean(lower=False) changes the same way
+    in any text, to ascii text or nothing. others are left to clean()"""
+    table = {}
+    for char in characters:
+        cleaned = clean(f"a{char}b", lower=False)
+        if not (cleaned.startswith("a") and cleaned.endswith("b")):
+            continue
+        replacement = cleaned[1:-1]
+        if not re.fullmatch(f"[{FAST_CLEAN_ASCII}]*", replacement):
+            continue
+        if clean(f"a {char} b", lower=False) != " ".join(f"a {replacement} b".split()):
+            continue
+        table[ord(char)] = replacement
+    return table
+
+
+FAST_CLEAN_TABLE = build_fast_clean_table(FAST_CLEAN_CHARACTERS)
+## text with only these & plain ascii characters is cleaned without cleantext.
+FAST_CLEAN_TEXT = re.compile(
+    f"[{FAST_CLEAN_ASCII}" + "".join(chr(code) for code in FAST_CLEAN_TABLE) + "]*"
+)
+## ":name:" is turned into emoji by cleantext
+EMOJI_NAME = re.compile(r":[^\s:]+:")
+
 
 class System:
     def __init__(self):
@@ -51,6 +95,24 @@ class System:
         torch.backends.cudnn.deterministic = True
         torch.backends.cudnn.benchmark = False
 
+    def get_resident_memory_mb(self):
+        """current resident memory(RSS) of this process in MB,
+        falls back to peak RSS where /proc is not available"""
+        try:
+            with open("/proc/self/status", "r") as fp:
+                for line in fp:
+                    if line.startswith("VmRSS:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        import resource
+
+        # ru_maxrss is KB on linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            max_rss = max_rss / 1024
+        return round(max_rss / 1024, 1)
+
 
 class FileManager:
     def __init__(self) -> None:
@@ -87,73 +149,45 @@ class FileManager:
             f.write(str(html_table_script))
 
 
-class HtmlContent:
-    def __init__(self) -> None:
-        pass
+@lru_cache(maxsize=None)
+def get_config(config_path=CONFIG_PATH):
+    """config yaml file is read only once per process"""
+    return FileManager().load_yaml(config_path)
 
-    def extract_until_comments(self, start_comment):
-        """function to get html code until the page break"""
-        content = ""
-        curr = start_comment.find_previous_sibling()
-        while curr:
-            content = str(curr) + content
-            if curr.name == "comment":
-                break
-            curr = curr.find_previous_sibling()
-        return content
-
-    def extract_between_comments(self, start_comment, end_comment):
-        """fucntion to get html code from one page start to same page end"""
-        content = ""
-        curr = start_comment.next_sibling
-        while curr and curr != end_comment:
-            content += str(curr)
-            curr = curr.next_sibling
-        return content
-
-    def split_page(self, html_path):
-        """this is to split the input html that user uploads in to platform.
-        the same html is overwrittern with output tags. Simple split is used,
-        rather than the complex split we did in fucntions below
-        - split_page_and_extract_text
-        - collect_tokens
-        in dei_utils.py file"""
-        html_data = FileManager().read_html_file(html_path)
-        soup = BeautifulSoup(html_data, "lxml")
-
-        # Find all <!-- Field: Page; Sequence> tags
-        comments = soup.find_all(
-            string=lambda text: isinstance(text, Comment) and "Field: Page;" in text
-        )
-
-        # split html page by comments
-        if comments:
-            # print("Comments found")
-            for i in range(len(comments[:1])):  # all pages, not slicing
-                start_comment = comments[i]
-
-                content_between_comments = self.extract_until_comments(start_comment)
-                second_half = self.extract_between_comments(start_comment, None)
-                page_html_data = content_between_comments
-
-        elif soup.find_all(re.compile("^hr")):
-            page_break_tags = soup.find_all(re.compile("^hr"))
-            # print("PAGE BREAK found", len(page_break_tags))
-            if len(page_break_tags) > 1:
-                for i in range(len(page_break_tags[:1])):  # all pages, not slicing
-                    start_page_break = page_break_tags[i]
-
-                    content_between_page_breaks = self.extract_until_comments(
-                        start_page_break
-                    )  # , end_page_break)
-                    second_half = self.extract_between_comments(start_page_break, None)
-                    page_html_data = content_between_page_breaks
 
-        else:
-            second_half = None
-            page_html_data = None
+@lru_cache(maxsize=None)
+def ensure_nltk_data(download=True):
+    """Adds the bundled nltk_data folder from config.yaml to nltk search path.
+    Missing resources are downloaded in to that folder only if `download`,
+    so importing modules never goes to network. returns missing resources."""
+    import nltk
 
-        return page_html_data, second_half
+    data_dir = os.path.abspath(get_config()["NLTK"]["Data_Dir"])
+    if data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+
+    missing = []
+    for resource_path, package in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource_path)
+        except LookupError:
+            if download:
+                nltk.download(package, download_dir=data_dir, quiet=True)
+            else:
+                missing.append(package)
+    return tuple(missing)
+
+
+@lru_cache(maxsize=2**16)
+def normalize_text(text):
+    """same as clean(text, lower=False) of cleantext, common
+    ascii text is cleaned with a translate & whitespace split,
+    see FAST_CLEAN_TABLE. results are cached, tokens repeat a lot in filings."""
+    if FAST_CLEAN_TEXT.fullmatch(text):
+        fast_text = " ".join(text.translate(FAST_CLEAN_TABLE).split())
+        if not EMOJI_NAME.search(fast_text):
+            return fast_text
+    return clean(text, lower=False)
 
 
 class ProcessText:
@@ -165,7 +199,7 @@ class ProcessText:
         special symbols and new line characters"""
         # text = text.encode('utf-8').decode('utf-8')
         text = text.replace("\n", " ")
-        text = clean(text, lower=False)
+        text = normalize_text(text)
         return text
 
     def add_commas(self, text):
@@ -212,6 +246,55 @@ def post_process(decoded_string, predictions):
     return reconstructed_sentence, reconstructed_labels
 
 
+class TokenAligner:
+    """same as post_process, for a whole batch at once. token text, word
+    start & pad flags are numpy arrays indexed by token id, built once
+    from the tokenizer vocab, so no token is decoded one by one."""
+
+    def __init__(self, tokenizer, id2label):
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        self.is_pad = np.array([token == "<pad>" for token in tokens], dtype=bool)
+        self.is_word_start = np.array([token in ["<s>", "</s>"] or token.startswith("Ġ") for token in tokens],
+                                      dtype=bool)
+        # words start with a space, rest of subtokens are added to the word
+        self.token_text = np.array([" " + token.replace("Ġ", "") if is_word_start else token
+                                    for token, is_word_start in zip(tokens, self.is_word_start)], dtype=object)
+        self.labels = np.array([id2label[label_id] for label_id in range(len(id2label))], dtype=object)
+
+    def align(self, input_ids: np.ndarray, predictions: np.ndarray):
+        """reconstructed sentence & labels of its words for each row of
+        the batch, pad tokens are skipped"""
+        keep = ~self.is_pad[input_ids]
+        word_starts = keep & self.is_word_start[input_ids]
+        token_texts = self.token_text[input_ids]
+        labels = self.labels[predictions]
+        return [("".join(row_texts[row_keep].tolist()), row_labels[row_starts].tolist())
+                for row_texts, row_labels, row_keep, row_starts in zip(token_texts, labels, keep, word_starts)]
+
+
+def decode_bio_spans(tokens, tags, return_starts=False):
+    """BIO/IOB tags of tokens to (text, label) entity spans, same spans as
+    nltk conlltags2tree gives, without pos tags & building a tree.
+    "I-" tag not after same label starts a new span, "O" tags are skipped.
+    with `return_starts`, index of first token of each span is returned too."""
+    spans = []
+    starts = []
+    span_label = None
+    for index, (token, tag) in enumerate(zip(tokens, tags)):
+        if tag is None or tag == "O":
+            span_label = None
+        elif tag.startswith("I-") and tag[2:] == span_label:
+            spans[-1][1].append(token)
+        elif tag.startswith("B-") or tag.startswith("I-"):
+            span_label = tag[2:]
+            spans.append((span_label, [token]))
+            starts.append(index)
+        else:
+            raise ValueError(f"Bad conll tag {tag!r}")
+    spans = [(" ".join(span_tokens), label) for label, span_tokens in spans]
+    return (spans, starts) if return_starts else spans
+
+
 def process_table_results(table_names, columns, inputs, outputs):
     """Post processing for tabel results to particular pattern."""
     table_outputs = []
@@ -232,23 +315,3 @@ def process_notes_results(inputs, outputs):
             if oup_word != "O":
                 Notes_outputs.append({inp_word: oup_word})
     return Notes_outputs
-
-
-def get_text_outside_table(content_between_comments: str) -> Tuple[str, bs4.BeautifulSoup]:
-    """THis function takes the part of a page out of many pages,
-    removes table from the page, returns remaining text."""
-    
-    soup1: bs4.BeautifulSoup = BeautifulSoup(content_between_comments, "lxml")
-    
-    # Remove all the tables from the HTML content
-    for table in soup1.find_all('table'):
-        table.extract()
-
-    # Remove all the elements with table-related tags from the HTML content
-    for tag in ['tbody', 'thead', 'tfoot', 'tr', 'th', 'td']:
-        for element in soup1.find_all(tag):
-            element.extract()
-
-    # Get the text outside the tables and table-related elements
-    text_outside_tables: str = soup1.get_text()
-    return text_outside_tables, soup1
\ No newline at end of file
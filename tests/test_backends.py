@@ -0,0 +1,35 @@
+import os
+import threading
+import warnings
+warnings.filterwarnings("ignore")
+
+import pytest
+
+from auto_tagging.backends import file_lock, write_atomically
+
+
+def test_model_file_is_written_once_and_never_half_written(tmp_path):
+    path = str(tmp_path / "dei_model.onnx")
+    exports = []
+
+    def export():
+        with file_lock(path):
+            if not os.path.exists(path):
+                with write_atomically(path) as tmp_path_:
+                    with open(tmp_path_, "w") as fp:
+                        fp.write("model")
+                exports.append(1)
+
+    threads = [threading.Thread(target=export) for _ in range(4)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert len(exports) == 1 and open(path).read() == "model"
+
+    # failed write keeps the old file & leaves no temp file behind
+    with pytest.raises(RuntimeError):
+        with write_atomically(path) as tmp_path_:
+            with open(tmp_path_, "w") as fp:
+                fp.write("half")
+            raise RuntimeError("export failed")
+    assert open(path).read() == "model"
+    assert sorted(os.listdir(tmp_path)) == ["dei_model.onnx", "dei_model.onnx.lock"]
@@ -0,0 +1,123 @@
+import os
+import json
+import pickle
+import time
+import warnings
+warnings.filterwarnings("ignore")
+
+import pytest
+
+from auto_tagging import cache
+from auto_tagging.cache import LRUCache, DiskCache, PredictionCache, cached_predict
+
+
+def test_lru_cache_drops_least_recently_used():
+    lru = LRUCache(max_items=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1 and lru.get("c") == 3
+
+
+def test_lru_cache_drops_least_recently_used_above_max_bytes():
+    lru = LRUCache(max_bytes=25)
+    lru.put("a", "x" * 10, size=10)
+    lru.put("b", "y" * 10, size=10)
+    lru.get("a")
+    lru.put("c", "z" * 10, size=10)
+    assert lru.get("b") is None
+    assert lru.total_bytes == 20 and len(lru) == 2
+
+
+def test_disk_cache_evicts_oldest_above_max_bytes(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=25)
+    disk.put_bytes("first", b"x" * 10)
+    disk.put_bytes("second", b"y" * 10)
+    # make "first" the least recently used file
+    old_time = time.time() - 100
+    os.utime(disk.path_for("first"), (old_time, old_time))
+
+    disk.put_bytes("third", b"z" * 10)
+    assert disk.get_bytes("first") is None
+    assert disk.get_bytes("second") == b"y" * 10
+    assert disk.get_bytes("third") == b"z" * 10
+
+
+def test_disk_cache_counts_writes_of_other_processes(tmp_path):
+    first_process = DiskCache(str(tmp_path), max_bytes=25)
+    other_process = DiskCache(str(tmp_path), max_bytes=25)
+    first_process.put_bytes("first", b"x" * 10)
+    old_time = time.time() - 100
+    os.utime(first_process.path_for("first"), (old_time, old_time))
+    other_process.put_bytes("second", b"y" * 10)
+
+    first_process.put_bytes("third", b"z" * 10)
+    assert first_process.get_bytes("first") is None
+    assert other_process.get_bytes("second") == b"y" * 10
+
+
+def test_disk_cache_removes_temp_file_of_failed_write(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=100)
+
+    def write(fp):
+        fp.write(b"half")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        disk._put("key", write)
+    assert disk.get_bytes("key") is None
+    assert [file for _, _, files in os.walk(tmp_path) for file in files if file.startswith("tmp")] == []
+
+
+def test_prediction_cache_counts_hits_and_misses(tmp_path):
+    prediction_cache = PredictionCache(memory_bytes=10**6, disk_dir=str(tmp_path), disk_max_bytes=10**6)
+    assert prediction_cache.get("model-a", "FORM 10-Q") is None
+    prediction_cache.put("model-a", "FORM 10-Q", (" <s> FORM 10-Q </s>", ["O", "B-DocumentType", "O"]))
+
+    assert prediction_cache.get("model-a", "FORM 10-Q")[1] == ["O", "B-DocumentType", "O"]
+    # another model id never reads this prediction
+    assert prediction_cache.get("model-b", "FORM 10-Q") is None
+
+    # new process, same disk folder
+    other_process_cache = PredictionCache(memory_bytes=10**6, disk_dir=str(tmp_path), disk_max_bytes=10**6)
+    assert other_process_cache.get("model-a", "FORM 10-Q") is not None
+    assert prediction_cache.stats()["memory_hits"] == 1
+    assert prediction_cache.stats()["misses"] == 2
+    assert other_process_cache.stats()["disk_hits"] == 1
+    # disk tier is plain json, a pickled file is a miss & never loaded
+    assert json.loads(prediction_cache.disk.get_bytes(prediction_cache.make_key("model-a", "FORM 10-Q")))[1][1] == \
+        "B-DocumentType"
+    prediction_cache.disk.put_bytes(prediction_cache.make_key("model-a", "10-K"), pickle.dumps("B-DocumentType"))
+    assert other_process_cache.get("model-a", "10-K") is None
+
+
+def test_cached_predict_runs_model_once_per_unique_text(monkeypatch):
+    prediction_cache = PredictionCache(memory_bytes=10**6)
+    monkeypatch.setattr(cache, "get_prediction_cache", lambda: prediction_cache)
+    calls = []
+
+    def predict(texts):
+        calls.append(list(texts))
+        return [text.upper() for text in texts]
+
+    assert cached_predict("model-a", ["a", "b", "a"], predict) == ["A", "B", "A"]
+    assert cached_predict("model-a", ["b", "c"], predict) == ["B", "C"]
+    assert calls == [["a", "b"], ["c"]]
+
+
+def test_result_cache_reads_tagged_html_and_tags(tmp_path):
+    (tmp_path / "tagged.htm").write_text("<html>tagged</html>")
+    results = cache.ResultCache(str(tmp_path / "results"), max_bytes=10**6)
+    key = results.make_key(cache.file_sha256(str(tmp_path / "tagged.htm")), "10-Q", ["dei-1", "notes-1", "table-1"])
+    assert results.get(key, str(tmp_path / "out.htm")) is None
+
+    tags = {"Coverpage": {"10-Q": ["DocumentType"]}, "Table": [{"24687": "Cash"}]}
+    results.put(key, str(tmp_path / "tagged.htm"), tags)
+    assert results.get(key, str(tmp_path / "out.htm")) == tags
+    # tags are plain json, never unpickled
+    assert json.loads(results.disk.get_bytes(f"tags\x00{key}")) == tags
+    assert (tmp_path / "out.htm").read_text() == "<html>tagged</html>"
+    # new model version is a different filing result
+    assert results.get(results.make_key("x", "10-Q", ["dei-2", "notes-1", "table-1"]), str(tmp_path / "o.htm")) is None
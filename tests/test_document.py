@@ -0,0 +1,58 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+from auto_tagging.document import FilingDocument
+
+FILING = """<html><body>
+<div><span>FORM 10-Q</span></div><div><span>Apple Inc.</span></div>
+<!-- Field: Page; Sequence: 1 -->
+<p>CONDENSED CONSOLIDATED BALANCE SHEETS</p>
+<table><tr><td><p>Cash</p></td><td>24,687</td></tr></table>
+<!-- Field: Page; Sequence: 2 -->
+<p>Revenue was $10 million.</p>
+<!-- Field: Page; Sequence: 3 -->
+</body></html>"""
+
+
+def test_pages_between_page_break_comments():
+    document = FilingDocument(FILING)
+    assert document.page_break_type == "comment"
+    assert document.cover_page().html == "<div><span>FORM 10-Q</span></div><div><span>Apple Inc.</span></div>"
+
+    pages = document.pages()
+    assert len(pages) == 2
+    assert len(pages[0].tables) == 1 and pages[1].tables == []
+    assert pages[0].text_outside_tables().split() == ["CONDENSED", "CONSOLIDATED", "BALANCE", "SHEETS"]
+
+
+def test_text_blocks_skip_tables_without_changing_document():
+    document = FilingDocument(FILING)
+    assert document.text_blocks() == ["CONDENSED CONSOLIDATED BALANCE SHEETS", "Revenue was $10 million."]
+    # tables are still in the parsed document for table stage
+    assert "Cash" in document.pages()[0].tables[0].get_text()
+
+
+def test_hr_page_breaks_when_no_comments():
+    document = FilingDocument("<div>cover</div><hr/><div>page 2</div><hr/>")
+    assert document.page_break_type == "hr"
+    cover_html, other_pages_html = document.split_cover_page()
+    assert cover_html == "<div>cover</div>"
+    assert other_pages_html == "<div>page 2</div><hr/>"
+
+
+def test_page_index_slices_raw_html_at_page_breaks():
+    document = FilingDocument(FILING)
+    page_index = document.page_index
+    assert page_index.page_break_type == "comment" and len(page_index) == 3
+    assert page_index.page_html(1) == "\n<p>Revenue was $10 million.</p>\n"
+    assert page_index.html_before(0).endswith("<div><span>Apple Inc.</span></div>\n")
+
+    cover_html, other_pages_html = document.split_cover_page()
+    assert cover_html + "<!-- Field: Page; Sequence: 1 -->" + other_pages_html == FILING
+
+
+def test_split_cover_page_without_page_breaks():
+    html = "<html><head><title>10-Q</title></head><body><p>Revenue was $10 million.</p></body></html>"
+    document = FilingDocument(html)
+    assert document.page_break_type is None
+    assert document.split_cover_page() == ("", html)
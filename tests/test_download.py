@@ -0,0 +1,51 @@
+import hashlib
+import threading
+import warnings
+warnings.filterwarnings("ignore")
+
+import requests
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from auto_tagging.download import SourceDownloader
+
+FILING = "<html><body>Caf\xe9 10-Q – 2023</body></html>"
+
+
+class FilingHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = FILING.encode("cp1252")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=windows-1252")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_download_is_streamed_and_unchanged_files_are_read_from_cache(tmp_path):
+    server = HTTPServer(("127.0.0.1", 0), FilingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/filing.htm"
+    try:
+        downloader = SourceDownloader(cache_dir=str(tmp_path / "cache"), cache_max_bytes=10**6, chunk_size=7)
+        sha256 = downloader.download(url, str(tmp_path / "first.htm"))
+        # same file as writing response.text
+        expected = requests.get(url).text.encode("utf-8")
+        assert (tmp_path / "first.htm").read_bytes() == expected
+        assert sha256 == hashlib.sha256(expected).hexdigest()
+
+        assert downloader.download(url, str(tmp_path / "second.htm")) == sha256
+        assert (tmp_path / "second.htm").read_bytes() == expected
+        assert FilingHandler.requests_seen == [None, None, '"v1"']
+    finally:
+        server.shutdown()
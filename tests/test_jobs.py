@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import sqlite3
+import subprocess
+import warnings
+warnings.filterwarnings("ignore")
+
+import pytest
+
+from functools import partial
+
+from auto_tagging.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, JobStore, QueueFull
+
+
+def write_job(path: str, text: str):
+    """job handler run by worker processes"""
+    if text == "fail":
+        raise ValueError("bad filing")
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def record_failure(path: str, text: str):
+    """on_failure of jobs, run by worker & api processes"""
+    with open(path + ".failed", "w") as file:
+        file.write(text)
+
+
+def failing_initializer(path: str):
+    """worker initializer that can not load its models"""
+    with open(path, "a") as file:
+        file.write("started\n")
+    raise RuntimeError("model file missing")
+
+
+def test_job_store_applies_backpressure_and_requeues_running_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    first = store.add({"file_id": 1}, max_queued=2)
+    second = store.add({"file_id": 2}, max_queued=2)
+    with pytest.raises(QueueFull) as error:
+        store.add({"file_id": 3}, max_queued=2, retry_after=60)
+    assert error.value.retry_after == 60
+
+    # oldest job first, a job is claimed only once
+    assert store.claim(worker_pid=100)["payload"] == {"file_id": 1}
+    assert store.claim(worker_pid=200)["id"] == second
+    assert store.claim(worker_pid=300) is None
+
+    # service restarted: jobs left running are queued again, up to max attempts
+    store.finish(second)
+    assert store.requeue_running(max_attempts=2, worker_pids=[999]) == 0
+    assert store.requeue_running(max_attempts=2) == 1
+    assert store.get(first)["status"] == QUEUED
+    store.claim(worker_pid=100)
+    store.requeue_running(max_attempts=2)
+    assert store.get(first)["status"] == FAILED
+    assert store.counts() == {QUEUED: 0, RUNNING: 0, DONE: 1, FAILED: 1}
+
+
+def test_job_queue_runs_jobs_in_worker_processes(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), handler=write_job, workers=2, poll_seconds=0.1,
+                     on_failure=record_failure)
+    queue.start()
+    try:
+        done = queue.submit(path=str(tmp_path / "out.txt"), text="tagged")
+        failed = queue.submit(path=str(tmp_path / "none.txt"), text="fail")
+        deadline = time.time() + 60
+        while time.time() < deadline and queue.stats()["jobs"][QUEUED] + queue.stats()["jobs"][RUNNING]:
+            time.sleep(0.1)
+    finally:
+        queue.stop(timeout=10)
+
+    assert queue.get(done)["status"] == DONE
+    assert (tmp_path / "out.txt").read_text() == "tagged"
+    assert queue.get(failed)["status"] == FAILED
+    assert "bad filing" in queue.get(failed)["error"]
+    assert (tmp_path / "none.txt.failed").read_text() == "fail"
+    assert not (tmp_path / "out.txt.failed").exists()
+
+
+def test_job_queue_takes_back_only_jobs_of_dead_workers(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    sibling_job = store.add({"path": str(tmp_path / "sibling.txt"), "text": "sibling"})
+    store.claim(worker_pid=os.getpid())
+    dead_job = store.add({"path": str(tmp_path / "dead.txt"), "text": "dead"})
+    dead_process = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead_process.wait()
+    store.claim(worker_pid=dead_process.pid)
+    assert store.dead_worker_pids() == [dead_process.pid]
+
+    # another api process starts its queue on same sqlite file
+    queue = JobQueue(store.db_path, handler=write_job, workers=1, poll_seconds=0.1, max_attempts=1,
+                     on_failure=record_failure)
+    queue.start()
+    queue.stop(timeout=10)
+    assert store.get(sibling_job)["status"] == RUNNING
+    assert store.get(dead_job)["status"] == FAILED
+    assert (tmp_path / "dead.txt.failed").read_text() == "dead"
+
+
+def test_locked_database_error_is_not_hidden_by_rollback(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+
+    def connect():
+        connection = sqlite3.connect(store.db_path, timeout=0.1, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    monkeypatch.setattr(store, "_connect", connect)
+    writer = sqlite3.connect(store.db_path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            store.add({"file_id": 1})
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+    assert store.add({"file_id": 1})
+
+
+def test_worker_failing_in_initializer_is_not_restarted_forever(tmp_path):
+    starts_path = tmp_path / "starts.txt"
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), handler=write_job, workers=1, poll_seconds=0.05,
+                     initializer=partial(failing_initializer, str(starts_path)), max_init_failures=3)
+    queue.start()
+    try:
+        deadline = time.time() + 60
+        while time.time() < deadline and not queue.stats()["workers_stopped"]:
+            time.sleep(0.1)
+        time.sleep(1)
+    finally:
+        queue.stop(timeout=10)
+
+    assert queue.stats()["workers_stopped"] == 1
+    assert starts_path.read_text().count("started") == 3
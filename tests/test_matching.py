@@ -0,0 +1,40 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+from auto_tagging.matching import CellReplacer, PatternReplacer, pattern_replacer
+from auto_tagging.dei_utils import format_processed_result, post_process_tags
+
+
+def test_entities_are_mapped_to_the_row_they_are_predicted_in():
+    rows = ["Apple Inc.", "One Apple Park", "Large accelerated filer Apple", "No match"]
+    # tokens of rows 0, 1 & 2 as after remove_unpredicted_rows
+    tokens = ["Apple", "Inc.", "One", "Apple", "Park", "Large", "filer", "Apple", "X"]
+    tags = ["B-EntityRegistrantName", "I-EntityRegistrantName", "O", "B-EntityRegistrantName",
+            "B-EntityAddressAddressLine1", "O", "O", "B-EntityRegistrantName", "B-EntityRegistrantName"]
+    token_rows = [0, 0, 1, 1, 1, 2, 2, 2, 3]
+    processed_result, result_rows = post_process_tags(tokens, tags, token_rows)
+    assert result_rows == [0, 1, 1, 2, 3]
+
+    assert format_processed_result(processed_result, rows, result_rows) == {
+        # "Apple" of "filer" row goes to every other row it is in
+        "Apple Inc.": [("Apple Inc.", "EntityRegistrantName"), ("Apple", "EntityRegistrantName")],
+        "One Apple Park": [("Apple", "EntityRegistrantName"), ("Park", "EntityAddressAddressLine1"),
+                           ("Apple", "EntityRegistrantName")],
+    }
+    # without row indexes, entities go to every row they are in
+    assert format_processed_result(processed_result, rows) == {
+        "Apple Inc.": [("Apple Inc.", "EntityRegistrantName"), ("Apple", "EntityRegistrantName"),
+                       ("Apple", "EntityRegistrantName")],
+        "One Apple Park": [("Apple", "EntityRegistrantName"), ("Park", "EntityAddressAddressLine1"),
+                           ("Apple", "EntityRegistrantName")],
+    }
+
+
+def test_cell_replacer_same_as_pattern_replacer():
+    html = '<td style="width:10px">10</td><td>10<br>100</td><td>>10<</td><td>1,100</td>'
+    replacements = {">10<": "><i>10</i><", ">1,100<": "><b>1,100</b><", "10": "<u>10</u>"}
+    replacer = pattern_replacer(replacements)
+    assert isinstance(replacer, CellReplacer)
+    assert replacer.replace(html) == PatternReplacer(replacements).replace(html)
+    assert replacer.find("<td>100</td>") == {"10"}
+    assert isinstance(pattern_replacer({">a>b<": ""}), PatternReplacer)
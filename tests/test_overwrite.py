@@ -0,0 +1,45 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+from auto_tagging.overwrite import OverwriteHtml
+
+HTML = "<p>Apple Inc.</p><td>1,100</td><td>100</td><p>Revenue of 2,500 was up\n10%</p>"
+
+
+def test_cell_values_are_preferred_and_others_replaced_anywhere():
+    tags = [["1,100", "Cash", "<b>1,100</b>"], ["2,500", "Revenue", "<b>2,500</b>"], ["10", "Debt", "<i>10</i>"]]
+    html = OverwriteHtml().replace_table_tags(HTML, tags)
+    # 10 is replaced wherever it is in given html, but not in 1,100 cell or <b> tags added for other values
+    assert html == "<p>Apple Inc.</p><td><b>1,100</b></td><td><i>10</i>0</td><p>Revenue of <b>2,500</b> was up <i>10</i>%</p>"
+    # page by page, 2,500 found in a cell on other page is replaced only as >2,500<
+    assert OverwriteHtml().replace_table_tags(HTML, tags, cell_values={"1,100", "2,500"}) == \
+        html.replace("<b>2,500</b>", "2,500")
+
+
+def test_notes_tags_replace_only_cells_and_nest_same_values():
+    tags = [["100", "us-gaap:Cash", "<b>100</b>"], ["100", "us-gaap:Debt", "<i>100</i>"], ["2,500", "us-gaap:Debt", "<i>2,500</i>"]]
+    html = OverwriteHtml().replace_notes_tags(HTML, tags)
+    assert html == HTML.replace("<td>100</td>", "<td><b><i>100</i></b></td>")
+
+
+def test_coverpage_tags_only_body_not_title():
+    from auto_tagging.document import FilingDocument
+
+    filing = FilingDocument(
+        "<html><head><title>Apple Inc.</title></head><body>\n<p>Apple Inc.</p>"
+        "<!-- Field: Page; Sequence: 1 --><p>Notes</p></body></html>"
+    )
+    cover_html, _ = filing.split_cover_page()
+    html = OverwriteHtml().modify_coverpage(cover_html, {"Apple Inc.": [("Apple Inc.", "EntityRegistrantName")]})
+    assert html.startswith("<html><head><title>Apple Inc.</title></head><body>")
+    assert html.count("EntityRegistrantName") == 1 and "<p><font" in html
+
+
+def test_filing_without_page_breaks_is_tagged_as_other_pages():
+    from auto_tagging.document import FilingDocument
+
+    html = "<html><body><p>Revenue of 2,500</p><td>100</td></body></html>"
+    cover_html, other_pages_html = FilingDocument(html).split_cover_page()
+    assert OverwriteHtml().modify_coverpage(cover_html, {"Apple Inc.": [("Apple Inc.", "EntityRegistrantName")]}) == ""
+    assert OverwriteHtml().replace_notes_tags(other_pages_html, [["100", "us-gaap:Cash", "<b>100</b>"]]) == \
+        html.replace("<td>100</td>", "<td><b>100</b></td>")
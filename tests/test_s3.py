@@ -0,0 +1,91 @@
+import os
+import gzip
+import warnings
+warnings.filterwarnings("ignore")
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+pytest.importorskip("psycopg2")
+pytest.importorskip("decouple")
+
+# utils.py reads database settings at import, no database is used here
+for setting in ["DATABASE_NAME", "DATABASE_HOST", "DATABASE_USERNAME", "DATABASE_PASSWORD"]:
+    os.environ.setdefault(setting, "test")
+
+from utils import S3Uploader
+
+BUCKET = "tags-bucket"
+REGION = "eu-west-1"
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3():
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name=REGION)
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+        yield client
+
+
+def new_uploader(**kwargs):
+    return S3Uploader(BUCKET, "access", "secret", REGION, **kwargs)
+
+
+def test_upload_file_is_multipart_above_threshold(s3, tmp_path):
+    small_path, large_path = tmp_path / "small.htm", tmp_path / "large.htm"
+    small_path.write_bytes(b"x" * MB)
+    large_path.write_bytes(os.urandom(12 * MB))
+    uploader = new_uploader(multipart_threshold=5 * MB)
+
+    uploader.upload_file(str(small_path))
+    uploader.upload_file(str(large_path))
+    # etag of multipart uploads ends with number of parts
+    assert "-" not in s3.head_object(Bucket=BUCKET, Key="small.htm")["ETag"]
+    assert s3.head_object(Bucket=BUCKET, Key="large.htm")["ETag"].endswith('-3"')
+    assert s3.get_object(Bucket=BUCKET, Key="large.htm")["Body"].read() == large_path.read_bytes()
+
+
+def test_gzip_upload_round_trips(s3, tmp_path):
+    html_path = tmp_path / "auto_tagging_filing.htm"
+    html_path.write_text("<html><body>FORM 10-Q</body></html>" * 1000)
+
+    new_uploader(gzip_files=True).upload_file(str(html_path), name="filing.htm")
+    response = s3.get_object(Bucket=BUCKET, Key="filing.htm")
+    assert response["ContentEncoding"] == "gzip"
+    assert gzip.decompress(response["Body"].read()) == html_path.read_bytes()
+    # compressed temp file is removed
+    assert sorted(os.listdir(tmp_path)) == ["auto_tagging_filing.htm"]
+
+
+def test_bucket_url_is_looked_up_once(s3, tmp_path):
+    (tmp_path / "filing.htm").write_text("<html></html>")
+    uploader = new_uploader()
+    lookups = []
+    get_bucket_location = uploader.client.get_bucket_location
+    uploader.client.get_bucket_location = lambda **kwargs: lookups.append(kwargs) or get_bucket_location(**kwargs)
+
+    assert uploader.upload_file(str(tmp_path / "filing.htm")) == f"https://s3-{REGION}.amazonaws.com/{BUCKET}/filing.htm"
+    assert uploader.bucket_url() == f"https://s3-{REGION}.amazonaws.com/{BUCKET}"
+    assert len(lookups) == 1
+
+
+def test_upload_to_endpoint_url(tmp_path):
+    server_module = pytest.importorskip("moto.server")
+    server = server_module.ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        endpoint_url = f"http://{host}:{port}"
+        boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint_url,
+                     aws_access_key_id="access", aws_secret_access_key="secret").create_bucket(Bucket=BUCKET)
+        (tmp_path / "filing.htm").write_text("<html>tagged</html>")
+
+        uploader = S3Uploader(BUCKET, "access", "secret", "us-east-1", endpoint_url=endpoint_url + "/")
+        url = uploader.upload_file(str(tmp_path / "filing.htm"))
+        assert url == f"{endpoint_url}/{BUCKET}/filing.htm"
+        body = uploader.client.get_object(Bucket=BUCKET, Key="filing.htm")["Body"].read()
+        assert body == b"<html>tagged</html>"
+    finally:
+        server.stop()
@@ -0,0 +1,45 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+from auto_tagging.document import FilingDocument, PageIndex
+from auto_tagging.streaming import FilingStream, scan_page_breaks
+
+FILING = """<html><body>
+<div><span>FORM 10-Q</span></div><hr/><!-- <hr/> commented out -->
+<!-- Field: Page; Sequence: 1 -->
+<p>CONDENSED CONSOLIDATED BALANCE SHEETS</p>
+<table><tr><td>Cash</td><td>24,687</td></tr></table>
+<!-- Field: Page; Sequence: 2 -->
+<p>Revenue was $10 million.</p>
+<!-- Field: Page; Sequence: 3 -->
+</body></html>"""
+
+
+def chunked(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+def test_scan_finds_same_page_breaks_as_page_index_for_any_chunk_size():
+    page_index = PageIndex(FILING)
+    for size in (1, 2, 5, 13, len(FILING)):
+        spans, position = [], 0
+        for html, page_break, kind in scan_page_breaks(chunked(FILING, size)):
+            position += len(html)
+            if kind == page_index.page_break_type:
+                spans.append((position, position + len(page_break)))
+            position += len(page_break)
+        assert spans == page_index.spans
+        assert position == len(FILING)
+
+
+def test_filing_stream_gives_same_pages_as_document(tmp_path):
+    html_path = tmp_path / "filing.htm"
+    html_path.write_text(FILING)
+    document = FilingDocument(FILING)
+    filing = FilingStream(str(html_path), chunk_size=7)
+
+    assert filing.page_break_type == "comment" and filing.has_cover_page
+    assert [page.text_outside_tables() for page in filing.pages()] == \
+        [page.text_outside_tables() for page in document.pages()]
+    assert [len(page.tables) for page in filing.pages(max_page_breaks=2)] == [1]
+    assert filing.text_blocks() == document.text_blocks()
@@ -0,0 +1,109 @@
+import io
+import warnings
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+
+from bs4 import BeautifulSoup
+from auto_tagging.document import FilingDocument
+from auto_tagging.table_extract import read_table_rows
+from auto_tagging.table_utils import (
+    align_context_and_columns_to_data,
+    arrange_rows_with_context,
+    clean_statement_table,
+    excel_round_trip,
+    get_excel_statements_tables,
+    get_statement_tables,
+)
+
+FILING = """<html><body>
+<div><span>FORM 10-Q</span></div>
+<!-- Field: Page; Sequence: 1 -->
+<p>CONDENSED CONSOLIDATED BALANCE SHEETS</p>
+<table>
+<tr><td></td><td></td><td>April 30, 2023</td><td></td><td>January 31, 2023</td></tr>
+<tr><td>Cash</td><td>$</td><td>24,687</td><td>$</td><td>19,110</td></tr>
+<tr><td>Inventories</td><td></td><td>(1,250)</td><td></td><td>1,100</td></tr>
+<tr><td>Total assets</td><td>$</td><td>25,937</td><td>$</td><td>20,210</td></tr>
+</table>
+<!-- Field: Page; Sequence: 2 -->
+</body></html>"""
+
+
+def test_excel_round_trip_reads_like_xlsx_file():
+    final_df = pd.DataFrame(
+        [["Cash", "24687", 1.0, np.nan, ""], ["N/A", "=SUM(B2)", 2.5, True, ""], ["", "", "", "", ""]],
+        columns=["index", "Total", "Total", np.nan, ""],
+    )
+    buffer = io.BytesIO()
+    final_df.to_excel(buffer, index=False)
+    buffer.seek(0)
+    expected = pd.read_excel(buffer).replace(np.nan, "", regex=True)
+
+    dataframe = excel_round_trip(final_df)
+    assert list(dataframe.columns) == ["index", "Total", "Total.1", "Unnamed: 3"]
+    pd.testing.assert_frame_equal(dataframe, expected)
+
+
+def test_statement_tables_are_arranged_in_memory():
+    table_records = get_statement_tables(FilingDocument(FILING))
+    assert [record.file_name for record in table_records] == \
+        ["page_comment_CONDENSED CONSOLIDATED BALANCE SHEETS_0"]
+    assert table_records[0].rows_and_tags[1] == ["Cash 24687 19110", [{"24687": "Others"}, {"19110": "Others"}]]
+
+    # dataframe & rows are passed in memory, nothing is saved to disk
+    data, columns, table_names = arrange_rows_with_context(table_records)
+    assert data == [[
+        "balance sheet Inventories April 30 2023 24687 1250==Others",
+        "balance sheet Inventories January 31 2023 19110 1100==Others",
+        "balance sheet Total assets April 30 2023 24687 25937==Others",
+        "balance sheet Total assets January 31 2023 19110 20210==Others",
+    ]]
+    assert columns == ["April 30 2023 24687", "January 31 2023 19110"] * 2
+    assert table_names == ["balance sheet"] * 4
+
+
+TABLES = [
+    # header & value columns with "$" and ")" cells
+    """<tr><td></td><td colspan="3">Three Months Ended</td><td colspan="3">Nine Months Ended</td></tr>
+    <tr><td></td><td></td><td>2023</td><td></td><td></td><td>2023</td><td></td></tr>
+    <tr><td>Revenue</td><td>$</td><td>24,687</td><td></td><td>$</td><td>(1,250</td><td>)</td></tr>
+    <tr><td>Net income (loss)</td><td></td><td>—</td><td></td><td></td><td>19,110</td><td></td></tr>
+    <tr><td>Total<br/>assets</td><td></td><td>12.5</td><td></td><td></td><td>0</td><td></td></tr>""",
+    # duplicate column names merged
+    """<tr><td></td><td>Total</td><td>Total</td><td>Total equity</td></tr>
+    <tr><td>Cash</td><td>1,100</td><td>5</td><td>(12</td></tr>
+    <tr><td>Inventories</td><td>2,200</td><td>6</td><td>N/A</td></tr>
+    <tr><td><span>Accounts payable</span><!-- note --></td><td>3,300</td><td>7</td><td>8</td></tr>""",
+    # <th> header is read by pd.read_html
+    """<tr><th>Item</th><th>2023</th><th>2022</th></tr>
+    <tr><td>Cash</td><td>$ 1,100</td><td>$ 1,000</td></tr>
+    <tr><td>Total</td><td>$ 2,200</td><td>$ 2,000</td></tr>
+    <tr><td>Total equity</td><td>$ 3,300</td><td>$ 3,000</td></tr>""",
+]
+
+
+def test_table_extractor_gives_same_table_as_read_html():
+    for html in TABLES:
+        html_table = BeautifulSoup(f"<table>{html}</table>", "lxml").table
+        expected = clean_statement_table(pd.read_html(str(html_table)))
+        pd.testing.assert_frame_equal(get_excel_statements_tables(html_table), expected)
+
+    assert read_table_rows(BeautifulSoup(f"<table>{TABLES[0]}</table>", "lxml").table)[1][:3] == ["", "", "2023"]
+    assert read_table_rows(BeautifulSoup(f"<table>{TABLES[2]}</table>", "lxml").table) is None
+
+
+def test_align_context_uses_last_untagged_cell_in_row():
+    text = [["Cash 24687 0.5", [{"24687": "Others"}, {"0.5": "Others"}]]]
+    dataframe = pd.DataFrame(
+        [["Cash", 24687.0, "", "0.5"], ["Total", "24687", "note", 7]],
+        columns=["index", "April 30 2023", "Notes", "January 31 2023"],
+    )
+    data, columns = align_context_and_columns_to_data(text, dataframe, "BALANCE SHEET")
+    assert data == [
+        "balance sheet Cash April 30 2023 24687==Others",
+        "balance sheet  January 31 2023 0.5==Others",
+        "balance sheet Total April 30 2023 24687==Others",
+    ]
+    assert columns == ["April 30 2023", "January 31 2023", "April 30 2023"]
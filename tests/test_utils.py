@@ -2,7 +2,12 @@ import pytest
 import warnings
 warnings.filterwarnings("ignore")
 
-from auto_tagging.utils import FileManager, ProcessText
+import numpy as np
+
+from cleantext import clean
+from auto_tagging.utils import (
+    FAST_CLEAN_CHARACTERS, FileManager, ProcessText, TokenAligner, decode_bio_spans, normalize_text, post_process,
+)
 
 def test_load_yaml():
     model_config = FileManager().load_yaml("/home/ubuntu/auto-tagging/config.yaml")
@@ -15,6 +20,40 @@ def test_read_html_file():
         FileManager().read_html_file("dummy/path/to/file.html")
     
 
+def test_decode_bio_spans():
+    tokens = ["Apple", "Inc.", "001-36743", "Delaware", "One", "Apple", "Park"]
+    tags = ["B-EntityRegistrantName", "I-EntityRegistrantName", "O", "I-EntityIncorporationStateCountryCode",
+            "B-EntityAddressAddressLine1", "I-EntityAddressAddressLine1", "B-EntityAddressAddressLine1"]
+    assert decode_bio_spans(tokens, tags) == [
+        ("Apple Inc.", "EntityRegistrantName"),
+        ("Delaware", "EntityIncorporationStateCountryCode"),
+        ("One Apple", "EntityAddressAddressLine1"),
+        ("Park", "EntityAddressAddressLine1"),
+    ]
+    with pytest.raises(ValueError):
+        decode_bio_spans(["Apple"], ["X-Entity"])
+
+
+class VocabTokenizer:
+    vocab = ["<s>", "<pad>", "</s>", "ĠApple", "ĠInc", ".", "ĠOne", "Ġ", "Park"]
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.vocab[token_id] for token_id in ids]
+
+
+def test_token_aligner_same_as_post_process():
+    id2label = {0: "O", 1: "B-EntityRegistrantName", 2: "I-EntityRegistrantName"}
+    input_ids = np.array([[0, 3, 4, 5, 2, 1, 1], [0, 6, 7, 8, 3, 5, 2]])
+    predictions = np.array([[0, 1, 2, 2, 0, 1, 2], [0, 2, 1, 0, 2, 1, 0]])
+
+    expected = [post_process(VocabTokenizer().convert_ids_to_tokens(ids), [id2label[p] for p in preds])
+                for ids, preds in zip(input_ids.tolist(), predictions.tolist())]
+    assert expected[0] == (" <s> Apple Inc. </s>", ["O", "B-EntityRegistrantName", "I-EntityRegistrantName", "O"])
+    assert TokenAligner(VocabTokenizer(), id2label).align(input_ids, predictions) == expected
+
 
 class TestProcessText:
     """class name should have "Test" starting for
@@ -40,5 +79,16 @@ class TestProcessText:
         assert self.text_process.clean_text(self.sample_text) == self.cleaned_sample_text
         assert self.text_process.add_commas(self.random_no) == self.random_no_readable
 
+    def test_fast_clean_text_same_as_cleantext(self):
+        from cleantext import clean
+        texts = ["Commission File\xa0Number: 001\u201338", "\u2612 Yes \u2610 No", "Soulpage\u2019s `AI`",
+                 "caf\xe9 &amp; co", "C:\\new", "Nasdaq :smile: Inc", "Soulpage\x92s \t Inc."]
+        for text in texts:
+            assert self.text_process.clean_text(text) == clean(text, lower=False)
 
 
+@pytest.mark.parametrize("char", list(FAST_CLEAN_CHARACTERS))
+def test_normalize_text_is_same_as_clean(char):
+    # with or without unidecode installed for cleantext
+    for text in [f"10{char}K", f"Apple{char}Inc.", f"Apple {char} Inc.", f"{char}", f"  {char}2023{char} "]:
+        assert normalize_text(text) == clean(text, lower=False)
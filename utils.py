@@ -1,86 +1,206 @@
+import os
+import gzip
 import json
+import shutil
+import logging
+import tempfile
+import threading
 import psycopg2
 import boto3
 
+from pathlib import Path
+from functools import lru_cache
+from contextlib import contextmanager
+from boto3.s3.transfer import TransferConfig
+from psycopg2 import extras, pool
 from decouple import config
 
 db = config("DATABASE_NAME")
 host = config("DATABASE_HOST")
 username = config("DATABASE_USERNAME")
 password = config("DATABASE_PASSWORD")
+db_url = f"postgresql://{username}:{password}@{host}:5432/{db}"
+# connections kept open by each process
+pool_min = config("DATABASE_POOL_MIN", default=1, cast=int)
+pool_max = config("DATABASE_POOL_MAX", default=4, cast=int)
 
-def get_db_record(file_id):
+logger = logging.getLogger(__name__)
+
+db_pool = None
+db_pool_pid = None
+db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """connection pool of this process. each job queue worker process gets
+    its own pool, connections are never shared across processes"""
+    global db_pool, db_pool_pid
+    with db_pool_lock:
+        if db_pool is None or db_pool_pid != os.getpid():
+            db_pool = pool.ThreadedConnectionPool(pool_min, pool_max, db_url)
+            db_pool_pid = os.getpid()
+    return db_pool
 
-    db_url = f"postgresql://{username}:{password}@{host}:5432/{db}"
+
+def get_db_connection(connections):
+    """pooled connection checked with a round-trip before use. connections
+    closed by database(restart, idle timeout) are dropped for a new one"""
+    # every pooled connection might be dead after a restart, then a new one
+    for _ in range(pool_max + 1):
+        connection = connections.getconn()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            connections.putconn(connection, close=True)
+    raise psycopg2.OperationalError("no open connection to the database")
+
+
+@contextmanager
+def db_cursor():
+    """cursor of a pooled connection, committed at the end or rolled back on
+    error. closed connections(database restarted) are dropped from pool"""
+    connections = get_db_pool()
+    connection = get_db_connection(connections)
     try:
-        # Attempt to connect and execute queries
-        connection = psycopg2.connect(db_url)
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT * FROM files where id={file_id}")
-        row = cursor.fetchone()
-        columns = [column[0] for column in cursor.description]
-        return dict(zip(columns, row))
-    except psycopg2.Error as e:
-        print("Error connecting to the database:", e)
+        with connection:
+            with connection.cursor() as cursor:
+                yield cursor
     finally:
-        # Close cursor and connection
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+        connections.putconn(connection, close=bool(connection.closed))
+
+
+def get_db_record(file_id):
+    """files row as dict, None if there is no such row or database is down"""
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("SELECT * FROM files WHERE id = %s", (file_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [column[0] for column in cursor.description]
+            return dict(zip(columns, row))
+    except psycopg2.Error as e:
+        logger.error(f"Error connecting to the database: {e}")
+
 
 def update_db_record(file_id, data):
-    import psycopg2
-    db_url = f"postgresql://{username}:{password}@{host}:5432/{db}"
+    """merges data in to `extra` of the file, raises if not saved"""
     try:
-        # Attempt to connect and execute queries
-        connection = psycopg2.connect(db_url)
-        cursor = connection.cursor()
-        # Convert the new data to a JSON string
-        new_json_data = json.dumps(data)
-        # SQL query to update the JSON field
-       # SQL query to update the JSON field using -> operator
-        update_sql = f"""
-            UPDATE files
-            SET extra = extra || %s::jsonb
-            WHERE id = %s
-        """
-        # Execute the SQL query with parameters
-        cursor.execute(update_sql, (new_json_data, file_id))
-        # Commit the changes and close the connection
-        connection.commit()
+        with db_cursor() as cursor:
+            # SQL query to update the JSON field
+            cursor.execute(
+                "UPDATE files SET extra = extra || %s::jsonb WHERE id = %s",
+                (json.dumps(data), file_id),
+            )
     except psycopg2.Error as e:
-        print("Error connecting to the database:", e)
-    finally:
-        # Close cursor and connection
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+        logger.error(f"Error connecting to the database: {e}")
+        raise
+
+
+def update_db_records(updates):
+    """[(file_id, data), ...] updated in one round-trip, for batch jobs.
+    data of same file_id is merged in order, same as updating one by one.
+    raises if not saved"""
+    merged = {}
+    for file_id, data in updates:
+        merged.setdefault(file_id, {}).update(data)
+    if not merged:
+        return
+    try:
+        with db_cursor() as cursor:
+            extras.execute_values(
+                cursor,
+                """
+                UPDATE files
+                SET extra = files.extra || data.extra::jsonb
+                FROM (VALUES %s) AS data (id, extra)
+                WHERE files.id = data.id
+                """,
+                [(file_id, json.dumps(data)) for file_id, data in merged.items()],
+                page_size=len(merged),
+            )
+    except psycopg2.Error as e:
+        logger.error(f"Error connecting to the database: {e}")
+        raise
+
+class S3Uploader:
+    """long lived s3 uploader, one client & bucket region lookup per process.
+    files are streamed from disk, multipart above `multipart_threshold` bytes.
+    `endpoint_url` is for S3 compatible stores(minio, localstack) in tests."""
+
+    def __init__(self, bucket, access_key, secret_key, region, endpoint_url=None,
+                 multipart_threshold=8 * 1024 * 1024, gzip_files=False):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.gzip_files = gzip_files
+        session = boto3.Session(
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+        )
+        self.client = session.client("s3", endpoint_url=endpoint_url)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+        )
+        self._bucket_url = None
+
+    def bucket_url(self):
+        """public url of bucket, region is looked up only once"""
+        if self._bucket_url is None:
+            if self.endpoint_url:
+                self._bucket_url = f"{self.endpoint_url.rstrip('/')}/{self.bucket}"
+            else:
+                location = self.client.get_bucket_location(Bucket=self.bucket)["LocationConstraint"]
+                self._bucket_url = f"https://s3-{location}.amazonaws.com/{self.bucket}"
+        return self._bucket_url
+
+    def upload_file(self, path, name=None, gzip_file=None):
+        """uploads file at `path` as `name`(file name by default) & returns its url.
+        with gzip the file is compressed to a temp file & served with gzip encoding"""
+        name = name or Path(path).name
+        gzip_file = self.gzip_files if gzip_file is None else gzip_file
+        extra_args = {"ACL": "public-read", "ContentType": "application/octet-stream"}
+        if not gzip_file:
+            self.client.upload_file(path, self.bucket, name, ExtraArgs=extra_args, Config=self.transfer_config)
+            return f"{self.bucket_url()}/{name}"
+
+        extra_args["ContentEncoding"] = "gzip"
+        with tempfile.NamedTemporaryFile(suffix=".gz", dir=os.path.dirname(os.path.abspath(path))) as compressed:
+            with open(path, "rb") as source, gzip.GzipFile(fileobj=compressed, mode="wb") as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            compressed.flush()
+            self.client.upload_file(
+                compressed.name, self.bucket, name, ExtraArgs=extra_args, Config=self.transfer_config
+            )
+        return f"{self.bucket_url()}/{name}"
+
+    def upload_fileobj(self, body, name):
+        """uploads a file like object as `name` & returns its url"""
+        extra_args = {"ACL": "public-read", "ContentType": "application/octet-stream"}
+        self.client.upload_fileobj(body, self.bucket, name, ExtraArgs=extra_args, Config=self.transfer_config)
+        return f"{self.bucket_url()}/{name}"
+
+
+@lru_cache(maxsize=None)
+def get_s3_uploader():
+    """S3Uploader of this process from AWS_S3_* settings"""
+    return S3Uploader(
+        bucket=config("AWS_S3_BUCKET_NAME"),
+        access_key=config("AWS_S3_ACCESS_KEY_ID"),
+        secret_key=config("AWS_S3_SECRET_ACCESS_KEY"),
+        region=config("AWS_S3_REGION"),
+        endpoint_url=config("AWS_S3_ENDPOINT_URL", default="") or None,
+        multipart_threshold=config("AWS_S3_MULTIPART_THRESHOLD_MB", default=8, cast=int) * 1024 * 1024,
+        gzip_files=config("AWS_S3_GZIP", default=False, cast=bool),
+    )
+
 
 def s3_uploader(name, body):
     # name is s3 file name
     # boyd is io.BytesIO()
-    access_key = config("AWS_S3_ACCESS_KEY_ID")
-    secret_key = config("AWS_S3_SECRET_ACCESS_KEY")
-    region = config("AWS_S3_REGION")
-    bucket = config("AWS_S3_BUCKET_NAME")
-    
-
-    session = boto3.Session(
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region,
-    )
-    s3 = session.resource("s3")
-    s3.Bucket(bucket).put_object(
-        Key=name,
-        Body=body.getvalue(),
-        ACL="public-read",
-        ContentType="application/octet-stream",
-    )
-    location = session.client("s3").get_bucket_location(Bucket=bucket)[
-        "LocationConstraint"
-    ]
-    uploaded_url = f"https://s3-{location}.amazonaws.com/{bucket}/{name}"
-    return uploaded_url
\ No newline at end of file
+    body.seek(0)
+    return get_s3_uploader().upload_fileobj(body, name)